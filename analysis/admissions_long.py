@@ -0,0 +1,202 @@
+################################################################################
+#
+# Description: This script writes the SUS admissions of each method (A, B and
+#              C, as in variables.admissions_data) in long format, one row per
+#              (patient, admission), rather than as admission1_date_sus ...
+#              admission5_date_sus columns:
+#             - each row has the admission date, discharge date, admission
+#               method, rank and days_in_critical_care of one admission, and
+#               there is no cap on the number of admissions per patient
+#             - rank is the dense rank of a patient's admission dates: episodes
+#               on the same date share a rank, as get_sequential_admissions_date
+#               only moves on to a strictly later date, so the date of rank n is
+#               admission<n>_date_sus (and rank 1 is first_admission_date_sus);
+#               rows with the same rank are ordered by discharge date
+#             - the filters are read from the code rather than copied: COVID-19
+#               codes from codelists_compiled.json and the emergency admission
+#               methods from variables.EMERGENCY_ADMISSION_METHODS
+#             - rows are streamed to block-gzip files (output_io.py), so the
+#               validation joins can read them directly without pivoting
+#             - with --staging-dir, the tables are read from their staged
+#               slices (stage_tables.py) where these are current
+#
+#              For method C the admission date is the A&E arrival date, and
+#              discharge date, admission method and days_in_critical_care are
+#              left empty.
+#
+# Input: <tables-dir>/hospital_admissions.csv
+#        <tables-dir>/emergency_care_attendances.csv
+#
+# Output: output/admissions/sus_method{A,B,C}_long.csv.gz
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import os
+import re
+from argparse import ArgumentParser
+
+import numpy as np
+
+from compile_codelists import load_compiled
+from generate_dummy_tables import VARIABLES_MODULE, module_constant
+from local_engine import ScanPlan, group_starts, sort_key, where
+from output_io import write_csv
+
+
+
+
+
+# FILTERS ------------------------
+
+METHOD_TABLES = {"A": "hospital_admissions", "B": "hospital_admissions", "C": "emergency_care_attendances"}
+DIAGNOSIS_COLUMNS = [f"diagnosis_{i:02d}" for i in range(1, 25)]
+FIELDNAMES = [
+    "patient_id", "admission_date", "discharge_date", "admission_method", "rank", "days_in_critical_care",
+]
+
+
+def contains_any(values, codes):
+    # The substring match of hospitalisation_diagnosis_matches, as one regular
+    # expression rather than one pass per code
+    pattern = re.compile("|".join(re.escape(code) for code in sorted(codes)))
+    return np.array([value is not None and pattern.search(value) is not None for value in values], dtype=bool)
+
+
+def is_in(values, codes):
+    codes = set(codes)
+    return np.array([value in codes for value in values], dtype=bool)
+
+
+def in_window(days, start_date=None, end_date=None):
+    keep = days != np.iinfo(np.int64).min
+    if start_date is not None:
+        keep &= days >= np.datetime64(start_date, "D").astype(np.int64)
+    if end_date is not None:
+        keep &= days <= np.datetime64(end_date, "D").astype(np.int64)
+    return keep
+
+
+def admissions_for_method(admission_method, tables, codelists, emergency_methods, start_date=None, end_date=None):
+    # The rows of variables.admissions_data, with the column holding their date
+    table = tables[METHOD_TABLES[admission_method]]
+    if admission_method in ("A", "B"):
+        keep = contains_any(table["all_diagnoses"], codelists["covid_icd10"])
+        if admission_method == "A":
+            keep &= is_in(table["admission_method"], emergency_methods)
+        date_column = "admission_date"
+    else:
+        keep = np.zeros(len(table), dtype=bool)
+        for column_name in DIAGNOSIS_COLUMNS:
+            if column_name in table:
+                keep |= is_in(table[column_name], codelists["covid_emergency"])
+        keep &= is_in(table["discharge_destination"], codelists["discharged_to_hospital"])
+        date_column = "arrival_date"
+    keep &= in_window(sort_key(table[date_column]), start_date, end_date)
+    return where(table, keep), date_column
+
+
+
+
+
+# LONG FORMAT ------------------------
+
+def rank_admissions(table, date_column):
+    # Sorts each patient's admissions by date (then discharge date) and gives
+    # each distinct date a rank from 1, in one sort of the filtered rows
+    days = sort_key(table[date_column])
+    keys = [days]
+    if "discharge_date" in table:
+        keys.insert(0, sort_key(table["discharge_date"]))
+    order = np.lexsort(keys + [table.patient_id])
+    table, days = table.take(order), days[order]
+    starts = group_starts(table.patient_id)
+    counts = np.diff(np.append(starts, len(table)))
+    new_date = np.ones(len(table), dtype=bool)
+    new_date[1:] = days[1:] != days[:-1]
+    new_date[starts] = True
+    dates_so_far = np.cumsum(new_date)
+    rank = dates_so_far - np.repeat(dates_so_far[starts], counts) + 1
+    return table, rank
+
+
+def text(column):
+    column = np.asarray(column)
+    if column.dtype.kind == "M":
+        return np.where(np.isnat(column), "", column.astype(str))
+    if column.dtype.kind == "f":
+        return np.array(["" if np.isnan(value) else f"{value:g}" for value in column], dtype=object)
+    return np.array(["" if value is None else value for value in column], dtype=object)
+
+
+def long_rows(table, date_column):
+    table, rank = rank_admissions(table, date_column)
+    empty = np.full(len(table), "", dtype=object)
+    columns = {
+        "patient_id": table.patient_id,
+        "admission_date": text(table[date_column]),
+        "discharge_date": text(table["discharge_date"]) if "discharge_date" in table else empty,
+        "admission_method": text(table["admission_method"]) if "admission_method" in table else empty,
+        "rank": rank,
+        "days_in_critical_care": (
+            text(table["days_in_critical_care"]) if "days_in_critical_care" in table else empty
+        ),
+    }
+    values = [columns[name].tolist() for name in FIELDNAMES]
+    for row in zip(*values):
+        yield dict(zip(FIELDNAMES, row))
+
+
+def write_long_admissions(
+    tables_dir, output_dir, admission_methods=("A", "B", "C"), start_date=None, end_date=None, staging_dir=None
+):
+    os.makedirs(output_dir, exist_ok=True)
+    codelists = load_compiled()
+    emergency_methods = module_constant(VARIABLES_MODULE, "EMERGENCY_ADMISSION_METHODS")
+
+    plan = ScanPlan(staging_dir=staging_dir)
+    plan.require(
+        "hospital_admissions",
+        "admission_date", "discharge_date", "admission_method", "all_diagnoses", "days_in_critical_care",
+    )
+    plan.require("emergency_care_attendances", "arrival_date", "discharge_destination", *DIAGNOSIS_COLUMNS)
+    tables = {}
+    for table_name in sorted({METHOD_TABLES[method] for method in admission_methods}):
+        tables[table_name] = plan.scan(table_name, os.path.join(tables_dir, f"{table_name}.csv"))
+
+    counts = {}
+    for admission_method in admission_methods:
+        table, date_column = admissions_for_method(
+            admission_method, tables, codelists, emergency_methods, start_date, end_date
+        )
+        path = os.path.join(output_dir, f"sus_method{admission_method}_long.csv.gz")
+        write_csv(path, FIELDNAMES, long_rows(table, date_column))
+        counts[admission_method] = (len(table), len(np.unique(table.patient_id)))
+    return counts
+
+
+
+
+
+# MAIN ------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--tables-dir", default="dummy-tables")
+    parser.add_argument("--output-dir", default="output/admissions")
+    parser.add_argument("--admission_methods", nargs="+", default=["A", "B", "C"])
+    parser.add_argument("--start_date")
+    parser.add_argument("--end_date")
+    parser.add_argument("--staging-dir", help="Read current staged slices from here (stage_tables.py)")
+    args = parser.parse_args()
+
+    counts = write_long_admissions(
+        args.tables_dir, args.output_dir, args.admission_methods, args.start_date, args.end_date,
+        args.staging_dir,
+    )
+    for admission_method, (n_admissions, n_patients) in counts.items():
+        print(f"sus_method{admission_method}_long: {n_admissions} admissions for {n_patients} patients")
@@ -11,6 +11,7 @@
 
 # IMPORT STATEMENTS ------------------------
 from databuilder.ehrql import codelist_from_csv
+from compile_codelists import load_compiled
 
 
 
@@ -176,3 +177,12 @@ clear_smoking_codes = codelist_from_csv(
     column = "CTV3Code",
     category_column = "Category",
 )
+
+
+
+# VALIDATED CODE SETS ------------------
+
+# Every codelist above, validated and normalised in bulk by compile_codelists.py
+# (re-run it after changing a codelist). Helpers take these as they are, without
+# validating each code again.
+validated = load_compiled()
@@ -0,0 +1,381 @@
+################################################################################
+#
+# Description: This script counts the overlap between the ISARIC cohort and the
+#              SUS method A/B/C populations without joining full tables:
+#             - Building compressed patient_id bitmaps (roaring-style: ids are
+#               split into 65536-wide chunks, each stored as a sorted array of
+#               offsets or as a bitmap, whichever is smaller) from each output
+#             - Persisting the bitmaps, plus one bitmap per value of any
+#               stratifying columns, next to the outputs
+#             - Evaluating set expressions such as
+#               "isaric_admission1 & (sus_methodA_admission1_ehrQL | sus_methodB_admission1_ehrQL)"
+#               to counts (optionally stratified) or patient_id lists
+#             - Venn-style counts for every combination of sources
+#
+#              Every released count, including each Venn region, is redacted
+#              at or below 7 and otherwise rounded to the nearest 10, as in
+#              validation_report_data.R, so that regions cannot be recovered
+#              by subtracting them from set sizes released elsewhere.
+#
+# Input: output/admissions/*.csv.gz
+#
+# Output: output/admissions/*.bitmaps.npz
+#         output/validation/cohort_overlap*.csv
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import csv
+import os
+import re
+from argparse import ArgumentParser
+from itertools import combinations
+
+import numpy as np
+
+from output_io import REDACTION_THRESHOLD, ROUNDING, open_output, redact_and_round
+
+
+
+
+
+# BITMAPS ------------------------
+
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+# Above this many ids a chunk is smaller stored as a bitmap (8kB) than as uint16 offsets
+ARRAY_LIMIT = 4096
+
+
+def to_bits(container):
+    if container.dtype == np.uint64:
+        return container
+    present = np.zeros(CHUNK_SIZE, dtype=bool)
+    present[container] = True
+    return np.packbits(present, bitorder="little").view(np.uint64)
+
+
+def to_offsets(bits):
+    return np.flatnonzero(np.unpackbits(bits.view(np.uint8), bitorder="little")).astype(np.uint16)
+
+
+def cardinality(container):
+    if container.dtype == np.uint64:
+        return int(np.unpackbits(container.view(np.uint8)).sum())
+    return len(container)
+
+
+def optimise(container):
+    # Store each chunk in whichever representation is smaller
+    if container.dtype == np.uint64:
+        if cardinality(container) <= ARRAY_LIMIT:
+            return to_offsets(container)
+        return container
+    if len(container) > ARRAY_LIMIT:
+        return to_bits(container)
+    return container
+
+
+ARRAY_OPERATIONS = {
+    "&": lambda a, b: np.intersect1d(a, b, assume_unique=True),
+    "|": np.union1d,
+    "-": lambda a, b: np.setdiff1d(a, b, assume_unique=True),
+    "^": lambda a, b: np.setxor1d(a, b, assume_unique=True),
+}
+
+BIT_OPERATIONS = {
+    "&": np.bitwise_and,
+    "|": np.bitwise_or,
+    "-": lambda a, b: a & ~b,
+    "^": np.bitwise_xor,
+}
+
+
+class PatientBitmap:
+
+    def __init__(self, containers=None):
+        # Maps the high bits of patient_id to the container of its low bits
+        self.containers = containers or {}
+
+    @classmethod
+    def from_ids(cls, ids):
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        if len(ids) and (ids[0] < 0 or ids[-1] >= 1 << 32):
+            raise ValueError("patient_id values must be in [0, 2**32)")
+        highs, starts = np.unique(ids >> CHUNK_BITS, return_index=True)
+        ends = np.append(starts[1:], len(ids))
+        return cls({
+            int(high): optimise((ids[start:end] & (CHUNK_SIZE - 1)).astype(np.uint16))
+            for high, start, end in zip(highs, starts, ends)
+        })
+
+    def __len__(self):
+        return sum(cardinality(container) for container in self.containers.values())
+
+    def to_ids(self):
+        if not self.containers:
+            return np.array([], dtype=np.int64)
+        return np.concatenate([
+            (high << CHUNK_BITS) + (container if container.dtype == np.uint16 else to_offsets(container)).astype(np.int64)
+            for high, container in sorted(self.containers.items())
+        ])
+
+    def combine(self, other, operator):
+        if operator == "&":
+            highs = self.containers.keys() & other.containers.keys()
+        elif operator == "-":
+            highs = self.containers.keys()
+        else:
+            highs = self.containers.keys() | other.containers.keys()
+        empty = np.array([], dtype=np.uint16)
+        containers = {}
+        for high in highs:
+            a = self.containers.get(high, empty)
+            b = other.containers.get(high, empty)
+            if a.dtype == np.uint16 and b.dtype == np.uint16:
+                result = ARRAY_OPERATIONS[operator](a, b).astype(np.uint16)
+            else:
+                result = BIT_OPERATIONS[operator](to_bits(a), to_bits(b))
+            result = optimise(result)
+            if cardinality(result):
+                containers[high] = result
+        return PatientBitmap(containers)
+
+    def __and__(self, other):
+        return self.combine(other, "&")
+
+    def __or__(self, other):
+        return self.combine(other, "|")
+
+    def __sub__(self, other):
+        return self.combine(other, "-")
+
+    def __xor__(self, other):
+        return self.combine(other, "^")
+
+    def to_bytes(self):
+        # high, kind (0 array, 1 bitmap) and length as uint32, then the container data
+        parts = []
+        for high, container in sorted(self.containers.items()):
+            kind = 1 if container.dtype == np.uint64 else 0
+            parts.append(np.array([high, kind, len(container)], dtype="<u4").tobytes())
+            parts.append(container.astype("<u8" if kind else "<u2").tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        containers = {}
+        position = 0
+        while position < len(data):
+            high, kind, length = np.frombuffer(data, dtype="<u4", count=3, offset=position)
+            position += 12
+            dtype = np.dtype("<u8" if kind else "<u2")
+            containers[int(high)] = np.frombuffer(data, dtype=dtype, count=int(length), offset=position).astype(
+                np.uint64 if kind else np.uint16
+            )
+            position += int(length) * dtype.itemsize
+        return cls(containers)
+
+
+
+
+
+# BUILDING AND STORING BITMAPS ------------------------
+
+def source_name(path):
+    return os.path.basename(path).split(".")[0]
+
+
+def bitmap_path(path):
+    return os.path.join(os.path.dirname(path), f"{source_name(path)}.bitmaps.npz")
+
+
+def build_bitmaps(path, strata=()):
+    # One pass over an output: a bitmap of all its patients, plus one per value
+    # of each stratifying column it contains, named "<source>.<column>=<value>"
+    name = source_name(path)
+    ids = []
+    stratum_ids = {}
+    opener = open_output if path.endswith(".gz") else open
+    with opener(path, "rt") as f:
+        reader = csv.DictReader(f)
+        columns = [column for column in strata if column in reader.fieldnames]
+        for row in reader:
+            patient_id = int(row["patient_id"])
+            ids.append(patient_id)
+            for column in columns:
+                stratum_ids.setdefault(f"{name}.{column}={row[column]}", []).append(patient_id)
+    bitmaps = {name: PatientBitmap.from_ids(ids)}
+    for stratum, stratum_patients in stratum_ids.items():
+        bitmaps[stratum] = PatientBitmap.from_ids(stratum_patients)
+    return bitmaps
+
+
+def save_bitmaps(bitmaps, path):
+    np.savez_compressed(path, **{
+        name: np.frombuffer(bitmap.to_bytes(), dtype=np.uint8) for name, bitmap in bitmaps.items()
+    })
+
+
+def load_bitmaps(path):
+    with np.load(path) as stored:
+        return {name: PatientBitmap.from_bytes(stored[name].tobytes()) for name in stored.files}
+
+
+
+
+
+# SET EXPRESSIONS ------------------------
+
+# Names are bitmap names, optionally double-quoted if they contain spaces or
+# operator characters (e.g. "isaric_admission1.imd_pc=1 (most deprived)")
+TOKEN_PATTERN = re.compile(r'\s*(?:(?P<op>[&|^()-])|"(?P<quoted>[^"]+)"|(?P<name>[^\s&|^()"-]+))')
+
+
+def tokenise(expression):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        if not match:
+            raise ValueError(f"Cannot parse expression at: {expression[position:]}")
+        if match.group("op"):
+            tokens.append(("op", match.group("op")))
+        else:
+            tokens.append(("name", match.group("quoted") or match.group("name")))
+        position = match.end()
+    return tokens
+
+
+class OverlapEngine:
+    # Evaluates set expressions over persisted bitmaps. Operators are & (and),
+    # | (or), - (and not) and ^ (xor), all of equal precedence and applied left
+    # to right, so use brackets to group.
+
+    def __init__(self, bitmaps):
+        self.bitmaps = bitmaps
+
+    @classmethod
+    def from_directory(cls, directory):
+        bitmaps = {}
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith(".bitmaps.npz"):
+                bitmaps.update(load_bitmaps(os.path.join(directory, filename)))
+        return cls(bitmaps)
+
+    def evaluate(self, expression):
+        tokens = tokenise(expression)
+        result, position = self.parse(tokens, 0)
+        if position != len(tokens):
+            raise ValueError(f"Unexpected {tokens[position][1]} in expression: {expression}")
+        return result
+
+    def parse(self, tokens, position):
+        result, position = self.parse_operand(tokens, position)
+        while position < len(tokens) and tokens[position] != ("op", ")"):
+            kind, operator = tokens[position]
+            if kind != "op":
+                raise ValueError(f"Expected an operator before {operator}")
+            operand, position = self.parse_operand(tokens, position + 1)
+            result = result.combine(operand, operator)
+        return result, position
+
+    def parse_operand(self, tokens, position):
+        if position >= len(tokens):
+            raise ValueError("Expression ends unexpectedly")
+        kind, value = tokens[position]
+        if (kind, value) == ("op", "("):
+            result, position = self.parse(tokens, position + 1)
+            if position >= len(tokens) or tokens[position] != ("op", ")"):
+                raise ValueError("Unbalanced brackets in expression")
+            return result, position + 1
+        if kind != "name":
+            raise ValueError(f"Unexpected {value} in expression")
+        if value not in self.bitmaps:
+            raise KeyError(f"No bitmap called {value}")
+        return self.bitmaps[value], position + 1
+
+    def count(self, expression, stratify_by=None):
+        # Count patients, optionally within each stratum "<source>.<column>"
+        result = self.evaluate(expression)
+        if stratify_by is None:
+            return {"all": len(result)}
+        prefix = f"{stratify_by}="
+        return {
+            name[len(prefix):]: len(result & bitmap)
+            for name, bitmap in sorted(self.bitmaps.items())
+            if name.startswith(prefix)
+        }
+
+    def venn(self, names):
+        # Count of patients in exactly each combination of the named sources
+        universe = PatientBitmap()
+        for name in names:
+            universe = universe | self.bitmaps[name]
+        regions = {}
+        for size in range(1, len(names) + 1):
+            for inside in combinations(names, size):
+                region = universe
+                for name in names:
+                    region = region & self.bitmaps[name] if name in inside else region - self.bitmaps[name]
+                regions[" & ".join(inside)] = len(region)
+        return regions
+
+
+
+
+
+# MAIN ------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="build and save bitmaps next to each output")
+    build.add_argument("outputs", nargs="+")
+    build.add_argument("--strata", nargs="*", default=[], help="columns to build per-value bitmaps for")
+
+    count = subparsers.add_parser("count", help="count patients matching set expressions")
+    count.add_argument("expressions", nargs="+")
+    count.add_argument("--dir", default=os.path.join("output", "admissions"))
+    count.add_argument("--stratify-by", help="<source>.<column> built with --strata")
+    count.add_argument("--ids", help="also write matching patient_ids of the first expression to this file")
+
+    venn = subparsers.add_parser("venn", help="count patients in each combination of sources")
+    venn.add_argument("sources", nargs="+")
+    venn.add_argument("--dir", default=os.path.join("output", "admissions"))
+
+    for subparser in (count, venn):
+        subparser.add_argument("--output", default=os.path.join("output", "validation", "cohort_overlap.csv"))
+        subparser.add_argument("--redaction-threshold", type=int, default=REDACTION_THRESHOLD)
+        subparser.add_argument("--rounding", type=int, default=ROUNDING)
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        for path in args.outputs:
+            save_bitmaps(build_bitmaps(path, args.strata), bitmap_path(path))
+    else:
+        engine = OverlapEngine.from_directory(args.dir)
+        if args.command == "count":
+            rows = [
+                (expression, stratum, count)
+                for expression in args.expressions
+                for stratum, count in engine.count(expression, args.stratify_by).items()
+            ]
+            if args.ids:
+                np.savetxt(args.ids, engine.evaluate(args.expressions[0]).to_ids(), fmt="%d", header="patient_id", comments="")
+        else:
+            rows = [(region, "all", count) for region, count in engine.venn(args.sources).items()]
+
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["expression", "stratum", "n"])
+            for expression, stratum, n in rows:
+                writer.writerow([expression, stratum, redact_and_round(n, args.redaction_threshold, args.rounding)])
@@ -0,0 +1,344 @@
+################################################################################
+#
+# Description: This script compares SUS data extracted using ehrQL to SUS data
+#              extracted using cohortextractor, column by column and patient by
+#              patient, without holding either extract in memory. Both files
+#              are streamed and hash-partitioned on patient_id (or merge-joined
+#              directly if both are already sorted by patient_id), so memory
+#              use is proportional to one partition.
+#
+# Input: /output/admissions/sus_method[]_admission1_ehrQL.csv.gz
+#        /output/admissions/sus_method[]_admission1_cohortextractor.csv.gz
+#
+# Output: /output/translation/ehrQL_vs_cohortextractor_diff.csv
+#         /output/translation/ehrQL_vs_cohortextractor_diff_examples.csv
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import csv
+import os
+import sys
+import tempfile
+from argparse import ArgumentParser
+
+from output_io import open_output
+
+
+
+
+
+# COLUMN MAPPINGS ------------------------
+
+# cohortextractor column names and their ehrQL equivalents
+DEFAULT_COLUMN_MAP = {
+    "admiss_date": "first_admission_date_sus",
+    "prior_dereg_date": "prior_dereg_date_sus",
+    "dereg_date": "dereg_date_sus",
+    "registered": "registered_sus",
+    "age": "age_sus",
+    "sex": "sex_sus",
+    "region": "region_sus",
+    "death_date": "death_date",
+}
+
+# ehrQL columns holding booleans, whose spellings are normalised (other columns,
+# e.g. sex "F", are compared as they are)
+DEFAULT_BOOLEAN_COLUMNS = {"registered_sus"}
+
+# ehrQL writes booleans as T/F and cohortextractor as 1/0
+BOOLEAN_SPELLINGS = {"T": "1", "True": "1", "true": "1", "F": "0", "False": "0", "false": "0"}
+
+
+
+
+
+# FUNCTIONS ------------------------
+
+def normalise_value(value, boolean=False):
+    value = value.strip()
+    if boolean:
+        value = BOOLEAN_SPELLINGS.get(value, value)
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    return str(int(number)) if number.is_integer() else repr(number)
+
+
+def read_rows(path):
+    # Yields (patient_id, row) pairs from a (gzipped) csv without loading it
+    if path.endswith(".gz"):
+        f = open_output(path, "rt")
+    else:
+        f = open(path, newline="")
+    with f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield int(row["patient_id"]), row
+
+
+class ColumnDiff:
+    # Running mismatch counts for one pair of aligned columns
+
+    def __init__(self, ehrql_column, cohortextractor_column, max_examples, boolean=False):
+        self.ehrql_column = ehrql_column
+        self.cohortextractor_column = cohortextractor_column
+        self.boolean = boolean
+        self.max_examples = max_examples
+        self.n_compared = 0
+        self.n_mismatch = 0
+        self.examples = []
+
+    def update(self, patient_id, ehrql_row, cohortextractor_row):
+        ehrql_value = normalise_value(ehrql_row.get(self.ehrql_column, ""), self.boolean)
+        cohortextractor_value = normalise_value(
+            cohortextractor_row.get(self.cohortextractor_column, ""), self.boolean
+        )
+        self.n_compared += 1
+        if ehrql_value != cohortextractor_value:
+            self.n_mismatch += 1
+            if len(self.examples) < self.max_examples:
+                self.examples.append((patient_id, ehrql_value, cohortextractor_value))
+
+
+class ExtractDiff:
+    # Comparison of one ehrQL extract against one cohortextractor extract
+
+    def __init__(self, method, column_map, max_examples, boolean_columns=DEFAULT_BOOLEAN_COLUMNS):
+        self.method = method
+        self.columns = [
+            ColumnDiff(ehrql_column, cohortextractor_column, max_examples, ehrql_column in boolean_columns)
+            for cohortextractor_column, ehrql_column in column_map.items()
+        ]
+        self.max_examples = max_examples
+        self.n_both = 0
+        self.only_ehrql = []
+        self.only_cohortextractor = []
+        self.n_only_ehrql = 0
+        self.n_only_cohortextractor = 0
+        # Patient-level extracts have one row per patient, so repeated
+        # patient_ids are errors rather than rows to compare
+        self.duplicates = []
+        self.n_duplicate_ehrql = 0
+        self.n_duplicate_cohortextractor = 0
+
+    def matched(self, patient_id, ehrql_row, cohortextractor_row):
+        self.n_both += 1
+        for column in self.columns:
+            column.update(patient_id, ehrql_row, cohortextractor_row)
+
+    def unmatched(self, patient_id, in_ehrql):
+        if in_ehrql:
+            self.n_only_ehrql += 1
+            if len(self.only_ehrql) < self.max_examples:
+                self.only_ehrql.append(patient_id)
+        else:
+            self.n_only_cohortextractor += 1
+            if len(self.only_cohortextractor) < self.max_examples:
+                self.only_cohortextractor.append(patient_id)
+
+    def duplicate(self, patient_id, in_ehrql):
+        if in_ehrql:
+            self.n_duplicate_ehrql += 1
+        else:
+            self.n_duplicate_cohortextractor += 1
+        if len(self.duplicates) < self.max_examples:
+            self.duplicates.append((patient_id, in_ehrql))
+
+    @property
+    def n_duplicates(self):
+        return self.n_duplicate_ehrql + self.n_duplicate_cohortextractor
+
+
+def checked_sorted(diff, rows, in_ehrql):
+    # Passes on rows of a stream that should be sorted by patient_id, raising
+    # if it is not and reporting (and skipping) repeated patient_ids
+    previous = None
+    for patient_id, row in rows:
+        if previous is not None and patient_id < previous:
+            side = "ehrQL" if in_ehrql else "cohortextractor"
+            raise ValueError(
+                f"{side} extract is not sorted by patient_id ({patient_id} after {previous}); "
+                "run without --assume-sorted"
+            )
+        if patient_id == previous:
+            diff.duplicate(patient_id, in_ehrql)
+            continue
+        previous = patient_id
+        yield patient_id, row
+
+
+def merge_sorted(diff, ehrql_rows, cohortextractor_rows):
+    # Merge-join two streams already sorted by patient_id
+    ehrql_rows = checked_sorted(diff, ehrql_rows, in_ehrql=True)
+    cohortextractor_rows = checked_sorted(diff, cohortextractor_rows, in_ehrql=False)
+    sentinel = (None, None)
+    left = next(ehrql_rows, sentinel)
+    right = next(cohortextractor_rows, sentinel)
+    while left[0] is not None or right[0] is not None:
+        if right[0] is None or (left[0] is not None and left[0] < right[0]):
+            diff.unmatched(left[0], in_ehrql=True)
+            left = next(ehrql_rows, sentinel)
+        elif left[0] is None or right[0] < left[0]:
+            diff.unmatched(right[0], in_ehrql=False)
+            right = next(cohortextractor_rows, sentinel)
+        else:
+            diff.matched(left[0], left[1], right[1])
+            left = next(ehrql_rows, sentinel)
+            right = next(cohortextractor_rows, sentinel)
+
+
+def partition(rows, directory, prefix, n_partitions):
+    # Spill rows into n_partitions plain csv files by patient_id
+    paths = [os.path.join(directory, f"{prefix}_{i}.csv") for i in range(n_partitions)]
+    files = [open(path, "w", newline="") for path in paths]
+    writers = [None] * n_partitions
+    try:
+        for patient_id, row in rows:
+            i = patient_id % n_partitions
+            if writers[i] is None:
+                writers[i] = csv.DictWriter(files[i], fieldnames=list(row))
+                writers[i].writeheader()
+            writers[i].writerow(row)
+    finally:
+        for f in files:
+            f.close()
+    return paths
+
+
+def read_partition(path):
+    if os.path.getsize(path) == 0:
+        return iter(())
+    return read_rows(path)
+
+
+def merge_partitioned(diff, ehrql_rows, cohortextractor_rows, n_partitions):
+    with tempfile.TemporaryDirectory() as directory:
+        ehrql_paths = partition(ehrql_rows, directory, "ehrql", n_partitions)
+        cohortextractor_paths = partition(cohortextractor_rows, directory, "cohortextractor", n_partitions)
+        for ehrql_path, cohortextractor_path in zip(ehrql_paths, cohortextractor_paths):
+            # Only the ehrQL side of one partition is held in memory
+            pending = {}
+            for patient_id, ehrql_row in read_partition(ehrql_path):
+                if patient_id in pending:
+                    diff.duplicate(patient_id, in_ehrql=True)
+                else:
+                    pending[patient_id] = ehrql_row
+            seen = set()
+            for patient_id, cohortextractor_row in read_partition(cohortextractor_path):
+                if patient_id in seen:
+                    diff.duplicate(patient_id, in_ehrql=False)
+                    continue
+                seen.add(patient_id)
+                ehrql_row = pending.pop(patient_id, None)
+                if ehrql_row is None:
+                    diff.unmatched(patient_id, in_ehrql=False)
+                else:
+                    diff.matched(patient_id, ehrql_row, cohortextractor_row)
+            for patient_id in pending:
+                diff.unmatched(patient_id, in_ehrql=True)
+
+
+def compare_extracts(method, ehrql_path, cohortextractor_path, column_map,
+                     n_partitions=64, assume_sorted=False, max_examples=5,
+                     boolean_columns=DEFAULT_BOOLEAN_COLUMNS):
+    diff = ExtractDiff(method, column_map, max_examples, boolean_columns)
+    ehrql_rows = read_rows(ehrql_path)
+    cohortextractor_rows = read_rows(cohortextractor_path)
+    if assume_sorted:
+        merge_sorted(diff, ehrql_rows, cohortextractor_rows)
+    else:
+        merge_partitioned(diff, ehrql_rows, cohortextractor_rows, n_partitions)
+    return diff
+
+
+def write_summary(diffs, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([
+            "method", "ehrQL_column", "cohortextractor_column", "n_both",
+            "n_only_ehrQL", "n_only_cohortextractor", "n_duplicate_ehrQL", "n_duplicate_cohortextractor",
+            "n_compared", "n_mismatch",
+        ])
+        for diff in diffs:
+            for column in diff.columns:
+                writer.writerow([
+                    diff.method, column.ehrql_column, column.cohortextractor_column, diff.n_both,
+                    diff.n_only_ehrql, diff.n_only_cohortextractor, diff.n_duplicate_ehrql,
+                    diff.n_duplicate_cohortextractor, column.n_compared, column.n_mismatch,
+                ])
+
+
+def write_examples(diffs, path):
+    # Example patient ids are kept apart from the counts as they are patient-level
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["method", "ehrQL_column", "patient_id", "ehrQL_value", "cohortextractor_value"])
+        for diff in diffs:
+            for patient_id in diff.only_ehrql:
+                writer.writerow([diff.method, "(only in ehrQL)", patient_id, "", ""])
+            for patient_id in diff.only_cohortextractor:
+                writer.writerow([diff.method, "(only in cohortextractor)", patient_id, "", ""])
+            for patient_id, in_ehrql in diff.duplicates:
+                side = "ehrQL" if in_ehrql else "cohortextractor"
+                writer.writerow([diff.method, f"(duplicate in {side})", patient_id, "", ""])
+            for column in diff.columns:
+                for patient_id, ehrql_value, cohortextractor_value in column.examples:
+                    writer.writerow([diff.method, column.ehrql_column, patient_id, ehrql_value, cohortextractor_value])
+
+
+def parse_column_map(pairs):
+    column_map = dict(DEFAULT_COLUMN_MAP)
+    for pair in pairs or []:
+        cohortextractor_column, _, ehrql_column = pair.partition("=")
+        if not ehrql_column:
+            raise ValueError(f"Column mapping must look like cohortextractor_name=ehrQL_name, not {pair}")
+        column_map[cohortextractor_column] = ehrql_column
+    return column_map
+
+
+
+
+
+# MAIN ------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--methods", nargs="+", default=["A", "B", "C"])
+    parser.add_argument("--input-dir", default=os.path.join("output", "admissions"))
+    parser.add_argument("--output-dir", default=os.path.join("output", "translation"))
+    parser.add_argument("--map", nargs="*", help="extra cohortextractor_name=ehrQL_name column mappings")
+    parser.add_argument("--boolean-columns", nargs="*", default=sorted(DEFAULT_BOOLEAN_COLUMNS),
+                        help="ehrQL columns whose T/F and 1/0 spellings are treated as the same")
+    parser.add_argument("--partitions", type=int, default=64)
+    parser.add_argument("--assume-sorted", action="store_true",
+                        help="both inputs are sorted by patient_id, so merge-join without partitioning")
+    parser.add_argument("--examples", type=int, default=5)
+    args = parser.parse_args()
+
+    column_map = parse_column_map(args.map)
+    diffs = [
+        compare_extracts(
+            method,
+            os.path.join(args.input_dir, f"sus_method{method}_admission1_ehrQL.csv.gz"),
+            os.path.join(args.input_dir, f"sus_method{method}_admission1_cohortextractor.csv.gz"),
+            column_map,
+            n_partitions=args.partitions,
+            assume_sorted=args.assume_sorted,
+            max_examples=args.examples,
+            boolean_columns=set(args.boolean_columns),
+        )
+        for method in args.methods
+    ]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    write_summary(diffs, os.path.join(args.output_dir, "ehrQL_vs_cohortextractor_diff.csv"))
+    write_examples(diffs, os.path.join(args.output_dir, "ehrQL_vs_cohortextractor_diff_examples.csv"))
+    n_duplicates = sum(diff.n_duplicates for diff in diffs)
+    if n_duplicates:
+        sys.exit(f"{n_duplicates} repeated patient_id(s) found; see ehrQL_vs_cohortextractor_diff_examples.csv")
@@ -0,0 +1,228 @@
+################################################################################
+#
+# Description: This script validates and normalises every codelist in
+#              codelists_ehrql.py in bulk, once, and stores the result so that
+#              runtime helpers can use the code sets without re-validating them
+#              on every call:
+#             - ICD-10 codes must match the ICD-10 pattern; case and dots are
+#               normalised (e.g. "u07.1" becomes "U071")
+#             - CTV3 codes must be five characters, padded with trailing dots
+#               (CTV3 is case-sensitive, so case is kept)
+#             - SNOMED CT codes must be 6-18 digits with a valid Verhoeff check
+#               digit
+#             - duplicates are dropped and each list's system is inferred from
+#               its codes
+#
+#              Every list is validated, and --check (run by just check and CI)
+#              fails when the stored result is out of date. Only the ICD-10
+#              lists are used from the stored result at runtime, as plain
+#              strings matched against all_diagnoses by
+#              hospitalisation_diagnosis_matches. The SNOMED CT and CTV3 lists
+#              are still passed to ehrQL's is_in as codelist_from_csv
+#              codelists, which hold typed codes rather than strings.
+#
+#              Usage:
+#                python analysis/compile_codelists.py           # write
+#                python analysis/compile_codelists.py --check   # fail if stale
+#
+# Input: codelists_ehrql.py, codelists/*.csv
+#
+# Output: analysis/codelists_compiled.json
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import ast
+import csv
+import json
+import os
+import re
+import sys
+from argparse import ArgumentParser
+
+
+
+
+
+# CODELISTS ------------------------
+
+CODELIST_MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "codelists_ehrql.py")
+
+
+def read_codelists(module_path=CODELIST_MODULE):
+    # Codes of every codelist defined in the module, by name, without importing
+    # it (codelist_from_csv needs ehrQL): codelist_from_csv(path, column=...)
+    # calls are read from their CSV, literal lists are used as is. Combined
+    # codelists (a + b) are left out as they are covered by their parts.
+    with open(module_path) as f:
+        tree = ast.parse(f.read())
+    root = os.path.dirname(os.path.dirname(module_path))
+    codelists = {}
+    for node in tree.body:
+        if not isinstance(node, ast.Assign) or not isinstance(node.targets[0], ast.Name):
+            continue
+        name = node.targets[0].id
+        value = node.value
+        if isinstance(value, ast.List):
+            codelists[name] = [element.value for element in value.elts if isinstance(element, ast.Constant)]
+        elif isinstance(value, ast.Call) and getattr(value.func, "id", None) == "codelist_from_csv":
+            path = value.args[0].value
+            column = next(keyword.value.value for keyword in value.keywords if keyword.arg == "column")
+            with open(os.path.join(root, path), newline="") as f:
+                codelists[name] = [row[column] for row in csv.DictReader(f) if row[column]]
+    return codelists
+
+
+
+
+
+# VALIDATION ------------------------
+
+ICD10_PATTERN = re.compile(r"^[A-Z][0-9]{2}[0-9A-Z]{0,2}$")
+CTV3_PATTERN = re.compile(r"^(?:[0-9A-Za-z]{5}|[0-9A-Za-z]{4}\.|[0-9A-Za-z]{3}\.\.|[0-9A-Za-z]{2}\.\.\.)$")
+SNOMED_PATTERN = re.compile(r"^[1-9][0-9]{5,17}$")
+
+# Verhoeff dihedral group multiplication and permutation tables
+VERHOEFF_D = [
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9],
+    [1, 2, 3, 4, 0, 6, 7, 8, 9, 5],
+    [2, 3, 4, 0, 1, 7, 8, 9, 5, 6],
+    [3, 4, 0, 1, 2, 8, 9, 5, 6, 7],
+    [4, 0, 1, 2, 3, 9, 5, 6, 7, 8],
+    [5, 9, 8, 7, 6, 0, 4, 3, 2, 1],
+    [6, 5, 9, 8, 7, 1, 0, 4, 3, 2],
+    [7, 6, 5, 9, 8, 2, 1, 0, 4, 3],
+    [8, 7, 6, 5, 9, 3, 2, 1, 0, 4],
+    [9, 8, 7, 6, 5, 4, 3, 2, 1, 0],
+]
+VERHOEFF_P = [
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9],
+    [1, 5, 7, 6, 2, 8, 3, 0, 9, 4],
+    [5, 8, 0, 3, 7, 9, 6, 1, 4, 2],
+    [8, 9, 1, 6, 0, 4, 3, 5, 2, 7],
+    [9, 4, 5, 3, 1, 2, 6, 8, 7, 0],
+    [4, 2, 8, 6, 5, 7, 3, 9, 0, 1],
+    [2, 7, 9, 3, 8, 0, 6, 4, 1, 5],
+    [7, 0, 4, 6, 9, 1, 3, 2, 5, 8],
+]
+
+
+def verhoeff_valid(digits):
+    check = 0
+    for i, digit in enumerate(reversed(digits)):
+        check = VERHOEFF_D[check][VERHOEFF_P[i % 8][int(digit)]]
+    return check == 0
+
+
+def normalise_icd10(code):
+    return code.strip().upper().replace(".", "")
+
+
+def valid_icd10(code):
+    return bool(ICD10_PATTERN.match(code))
+
+
+def valid_ctv3(code):
+    return bool(CTV3_PATTERN.match(code))
+
+
+def valid_snomed(code):
+    return bool(SNOMED_PATTERN.match(code)) and verhoeff_valid(code)
+
+
+SYSTEMS = {
+    "ctv3": (str.strip, valid_ctv3),
+    "icd10": (normalise_icd10, valid_icd10),
+    "snomed": (str.strip, valid_snomed),
+}
+
+
+def infer_system(codes):
+    # The system that accepts the most codes. Many CTV3 codes (e.g. "Y228A")
+    # also fit the ICD-10 pattern, so ties go to CTV3: ICD-10 lists are
+    # recognised by their shorter codes.
+    scores = {
+        system: sum(validate(normalise(code)) for code in codes)
+        for system, (normalise, validate) in SYSTEMS.items()
+    }
+    return max(scores, key=scores.get)
+
+
+def compile_codelist(codes, system=None):
+    # Returns (system, sorted valid normalised codes, invalid original codes)
+    system = system or infer_system(codes)
+    normalise, validate = SYSTEMS[system]
+    valid, invalid = set(), []
+    for code in codes:
+        normalised = normalise(code)
+        if validate(normalised):
+            valid.add(normalised)
+        else:
+            invalid.append(code)
+    return system, sorted(valid), invalid
+
+
+
+
+
+# COMPILED CODELISTS ------------------------
+
+COMPILED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "codelists_compiled.json")
+
+
+class ValidatedCodes(frozenset):
+    # A code set that has already been validated and normalised, so helpers
+    # can use it as is
+
+    def __new__(cls, codes, system):
+        instance = super().__new__(cls, codes)
+        instance.system = system
+        return instance
+
+
+def compile_all():
+    compiled, invalid = {}, {}
+    for name, codes in sorted(read_codelists().items()):
+        system, valid, rejected = compile_codelist(codes)
+        compiled[name] = {"system": system, "codes": valid}
+        if rejected:
+            invalid[name] = rejected
+    return compiled, invalid
+
+
+def load_compiled(path=COMPILED_PATH):
+    with open(path) as f:
+        compiled = json.load(f)
+    return {name: ValidatedCodes(entry["codes"], entry["system"]) for name, entry in compiled.items()}
+
+
+
+
+
+# MAIN ------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--output", default=COMPILED_PATH)
+    parser.add_argument("--check", action="store_true", help="fail if the stored result is out of date")
+    args = parser.parse_args()
+
+    compiled, invalid = compile_all()
+    for name, codes in invalid.items():
+        print(f"{name}: {len(codes)} invalid {compiled[name]['system']} code(s) dropped: {codes[:10]}")
+
+    # One codelist per line keeps changes to the stored file easy to review
+    text = "{\n" + ",\n".join(
+        f"{json.dumps(name)}: {json.dumps(entry, sort_keys=True)}" for name, entry in sorted(compiled.items())
+    ) + "\n}\n"
+    if args.check:
+        with open(args.output) as f:
+            if f.read() != text:
+                sys.exit(f"{args.output} is out of date; run compile_codelists.py")
+        sys.exit()
+    with open(args.output, "w") as f:
+        f.write(text)
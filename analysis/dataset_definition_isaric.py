@@ -17,7 +17,7 @@
 # IMPORT STATEMENTS ------------------------
 
 # Import tables and Python objects
-from ehrql import Dataset, days, years, case, when
+from ehrql import Dataset, case, when
 from ehrql.tables.beta.tpp import (
   clinical_events, patients, 
   sgss_covid_all_tests, vaccinations, addresses, 
@@ -28,7 +28,7 @@ from ehrql.tables.beta.raw.tpp import isaric
 import codelists_ehrql
 
 # Functions
-from variables import has_prior_comorbidity, date_deregistered_from_all_supported_practices, hospitalisation_diagnosis_matches
+from variables import has_prior_comorbidity, date_deregistered_from_all_supported_practices, hospitalisation_diagnosis_matches, numeric_measure_in_window, events_within_windows, multi_select_bitmask
 
 
 
@@ -71,17 +71,9 @@ dataset.coriona_ieorres3_isaric = first_isaric_admission.coriona_ieorres3
 # Adult or child who meets case definition for inflammatory multi-system syndrome (MIS-C/MIS-A).
 dataset.inflammatory_mss_isaric = first_isaric_admission.inflammatory_mss
 
-# Ethnicity
-dataset.eth1_isaric = first_isaric_admission.ethnic___1
-dataset.eth2_isaric = first_isaric_admission.ethnic___2
-dataset.eth3_isaric = first_isaric_admission.ethnic___3
-dataset.eth4_isaric = first_isaric_admission.ethnic___4
-dataset.eth5_isaric = first_isaric_admission.ethnic___5
-dataset.eth6_isaric = first_isaric_admission.ethnic___6
-dataset.eth7_isaric = first_isaric_admission.ethnic___7
-dataset.eth8_isaric = first_isaric_admission.ethnic___8
-dataset.eth9_isaric = first_isaric_admission.ethnic___9
-dataset.eth10_isaric = first_isaric_admission.ethnic___10
+# Ethnicity (checkboxes ethnic___1 to ethnic___10 packed into one bitmask, decoded
+# with decode_multi_select() in analysis/lib/custom_functions.R)
+dataset.ethnicity_bitmask_isaric = multi_select_bitmask(first_isaric_admission, "ethnic___{n}", 10)
 
 # COVID-19 vaccination
 dataset.covid19_vaccine_isaric = first_isaric_admission.covid19_vaccine
@@ -242,18 +234,11 @@ has_prior_comorbidity("cancer_haemo_pc", "cancer_haemo", "snomed", "first_admiss
 # AIDS/HIV
 has_prior_comorbidity("hiv_pc", "hiv", "snomed", "first_admission_date_isaric", dataset)
 
-# Obesity
-dataset.obesity_pc  = (
-    # Filter on codes which which capture recorded BMI
-    clinical_events.where(clinical_events.snomedct_code.is_in(codelists_ehrql.obesity_codelist))
-    # Only values in the 5 years prior to admission date
-    .where(clinical_events.date.is_on_or_between(dataset.first_admission_date_isaric - years(5), dataset.first_admission_date_isaric))
-    # Exclude out-of-range values
-    .where((clinical_events.numeric_value > 4.0) & (clinical_events.numeric_value < 200.0))
-    # Exclude measurements taken when patient was younger than 16
-    .where(clinical_events.date >= patients.date_of_birth + years(16))
-    .numeric_value.maximum_for_patient()
-)
+# Obesity (maximum BMI in the 5 years prior to admission, excluding out-of-range values
+# and measurements taken when patient was younger than 16)
+numeric_measure_in_window(
+  dataset, "obesity_pc", ["obesity_codelist"], "snomed", "first_admission_date_isaric", [5],
+  statistics=["max"], value_range=(4.0, 200.0), min_age=16)
 
 # Diabetes
 has_prior_comorbidity("diabetes_pc", "diabetes", "snomed", "first_admission_date_isaric", dataset)
@@ -283,7 +268,7 @@ dataset.n_admissions =  isaric.count_for_patient()
 
 ## Critical care days for COVID-related hospitalisation
 dataset.days_in_critical_care = hospitalisation_diagnosis_matches(
-  hospital_admissions, codelists_ehrql.covid_icd10).where(
+  hospital_admissions, codelists_ehrql.validated["covid_icd10"]).where(
     hospital_admissions.admission_date == dataset.first_admission_date_isaric).sort_by(
       hospital_admissions.admission_date).first_for_patient().days_in_critical_care
   
@@ -297,11 +282,10 @@ dataset.has_died = ons_deaths.where(ons_deaths.date >= dataset.first_admission_d
 #dataset.discharge_date = isaric.first_for_patient().where(dsterm == "Death").dsstdtc
 
 ## Non COVID-19 admission in SUS
-dataset.non_covid_admission_SUS_same_date = hospital_admissions.where(
-  hospital_admissions.admission_date == dataset.first_admission_date_isaric).exists_for_patient()
-  
-dataset.non_covid_admission_SUS_2days = hospital_admissions.where(
-  hospital_admissions.admission_date.is_on_or_between(dataset.first_admission_date_isaric - days(2), dataset.first_admission_date_isaric + days(2))).exists_for_patient()
+events_within_windows(dataset, "hospital_admissions", "first_admission_date_isaric", {
+  "non_covid_admission_SUS_same_date": (0, 0),
+  "non_covid_admission_SUS_2days": (2, 2),
+})
 
 ## Registration details
 dataset.prior_dereg_date_pc = practice_registrations.where(
@@ -0,0 +1,163 @@
+################################################################################
+#
+# Description: This script defines one dataset holding several variants of the
+#              SUS extract (a grid of admission methods and study windows), so a
+#              sensitivity sweep is a single extract rather than one per variant.
+#              Tables and codelists are read once, variables that do not depend
+#              on the variant are extracted once, and comorbidities are matched
+#              once for all variants' index dates (has_prior_comorbidity_as_of).
+#              Each variant's columns end in _<method>_<start>_<end>; the output
+#              is split into one file per grid point by split_sus_sweep.py.
+#
+#              Every variable of dataset_definition_sus.py is extracted for each
+#              variant, from the same helpers (add_sus_admission_variables and
+#              the comorbidity helpers in variables.py), so each split file has
+#              the columns of the single-variant extract. Matching tolerances
+#              do not change a variant's population, so rather than multiplying
+#              the grid they add one column per tolerance to every variant:
+#              isaric_within_<n>_days_sus is whether the first ISARIC admission
+#              is within n days of the variant's first admission.
+#
+#              Windows are given as start:end (either may be left out), e.g.
+#                --admission_methods A B C --windows 2020-03-01: 2020-03-01:2021-02-28
+#                --tolerances 0 2 5
+#
+# Output: output/admissions/sus_sweep.csv.gz
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+
+
+# IMPORT STATEMENTS ------------------------
+
+# Import tables and Python objects
+from ehrql import Dataset, case, days, when
+from ehrql.tables.beta.tpp import (
+  hospital_admissions,
+  emergency_care_attendances,
+  patients,
+  practice_registrations,
+  ons_deaths
+  )
+from ehrql.tables.beta.raw.tpp import isaric
+from argparse import ArgumentParser
+import operator
+from functools import reduce
+
+# Functions
+from variables import (
+  admissions_data,
+  date_deregistered_from_all_supported_practices,
+  has_prior_comorbidity_as_of,
+  numeric_measure_in_window,
+  add_sus_admission_variables
+  )
+
+# Process parameters
+parser = ArgumentParser()
+parser.add_argument("--admission_methods", nargs="+", default=["A", "B", "C"])
+parser.add_argument("--windows", nargs="+", default=[":"])
+parser.add_argument("--tolerances", nargs="+", type=int, default=[0, 2, 5],
+                    help="days between the first ISARIC and first SUS admission counted as a match")
+args = parser.parse_args()
+
+
+
+
+
+# GRID ------------------------
+
+def variant_suffix(admission_method, start_date, end_date):
+    return "_".join([
+      admission_method,
+      (start_date or "any").replace("-", ""),
+      (end_date or "any").replace("-", ""),
+    ])
+
+variants = {}
+for admission_method in args.admission_methods:
+  for window in args.windows:
+    start_date, end_date = (part or None for part in window.split(":", 1))
+    variants[variant_suffix(admission_method, start_date, end_date)] = (admission_method, start_date, end_date)
+
+
+
+
+
+# DEFINE DATASET ------------------------
+
+dataset = Dataset()
+
+admissions = {
+  suffix: admissions_data(admission_method, hospital_admissions, emergency_care_attendances, start_date, end_date)
+  for suffix, (admission_method, start_date, end_date) in variants.items()
+}
+
+# Anyone in any variant's population
+dataset.define_population(reduce(operator.or_, [data.exists_for_patient() for data in admissions.values()]))
+
+
+
+
+
+# VARIABLES SHARED BY ALL VARIANTS ------------------------
+
+dataset.dereg_date_sus = date_deregistered_from_all_supported_practices(practice_registrations, case, when)
+dataset.sex_sus = patients.sex
+dataset.ons_death_date = ons_deaths.sort_by(ons_deaths.date).last_for_patient().date
+dataset.death_date = patients.date_of_death
+dataset.in_hospital_death = ons_deaths.where(ons_deaths.place == "Hospital").exists_for_patient()
+
+# First ISARIC admission, chosen as in dataset_definition_isaric.py
+dataset.first_admission_date_isaric = isaric.sort_by(isaric.age).first_for_patient().hostdat
+
+
+
+
+
+# VARIABLES PER VARIANT ------------------------
+
+index_columns = []
+for suffix, (admission_method, start_date, end_date) in variants.items():
+  add_sus_admission_variables(dataset, admissions[suffix], admission_method, suffix)
+  index_column = f"first_admission_date_sus_{suffix}"
+  index_columns.append(index_column)
+  index_date = getattr(dataset, index_column)
+
+  # Obesity, as in dataset_definition_sus.py
+  numeric_measure_in_window(
+    dataset, f"obesity_sus_{suffix}", ["obesity_codelist"], "snomed", index_column, [5],
+    statistics=["max"], value_range=(4.0, 200.0), min_age=16)
+
+  # Matching tolerances
+  for tolerance in args.tolerances:
+    setattr(dataset, f"isaric_within_{tolerance}_days_sus_{suffix}", case(
+      when(dataset.first_admission_date_isaric.is_on_or_between(
+        index_date - days(tolerance), index_date + days(tolerance))).then(True),
+      default=False,
+    ))
+
+# Comorbidities: each codelist is matched once for every variant's index date
+for extract_name, codelist_name, system in [
+  ("ccd_sus", "chronic_cardiac_disease", "snomed"),
+  ("hypertension_sus", "hypertension", "snomed"),
+  ("copd_sus", "copd", "snomed"),
+  ("asthma_sus", "asthma", "snomed"),
+  ("ckd_sus", "chronic_kidney_disease", "snomed"),
+  ("cld_sus", "chronic_liver_disease", "snomed"),
+  ("neuro_sus", "neuro_other", "snomed"),
+  ("cancer_lung_sus", "cancer_lung", "snomed"),
+  ("cancer_other_sus", "cancer_other", "snomed"),
+  ("cancer_haemo_sus", "cancer_haemo", "snomed"),
+  ("hiv_sus", "hiv", "snomed"),
+  ("diabetes_sus", "diabetes", "snomed"),
+  ("diabetes_t1_sus", "diabetes_t1", "snomed"),
+  ("diabetes_t2_sus", "diabetes_t2", "snomed"),
+  ("dementia_sus", "dementia", "snomed"),
+  ("smoking_sus", "clear_smoking_codes", "ctv3"),
+]:
+  has_prior_comorbidity_as_of(f"{extract_name}_{{column}}", codelist_name, system, index_columns, dataset)
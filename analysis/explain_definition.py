@@ -0,0 +1,331 @@
+################################################################################
+#
+# Description: This script is a dry run for dataset definitions. It builds the
+#              Dataset (without touching the backend), walks each variable's
+#              query graph and, using stored table statistics, estimates:
+#             - rows scanned and the largest intermediate result per variable
+#             - relative cost per variable
+#             - the dominant terms (e.g. many-way ORs over A&E diagnosis
+#               columns, or the same table scanned by many variables)
+#
+#              The graph is walked generically (dataclass fields and node type
+#              names) so it does not depend on ehrQL internals beyond the
+#              query model node names.
+#
+#              Usage:
+#                python analysis/explain_definition.py \
+#                  analysis/dataset_definition_sus.py -- --admission_method B
+#                python analysis/explain_definition.py stats dummy-tables
+#
+# Input: dataset definition, output/explain/table_stats.json
+#
+# Output: cost report (stdout)
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import csv
+import dataclasses
+import json
+import math
+import os
+import runpy
+import sys
+from argparse import ArgumentParser
+from collections import Counter
+
+
+
+
+
+# TABLE STATISTICS ------------------------
+
+DEFAULT_STATS_PATH = "output/explain/table_stats.json"
+
+# Used when a table or code has no stored statistics
+DEFAULT_TABLE_ROWS = 1_000_000
+DEFAULT_PATIENTS = 100_000
+DEFAULT_CODE_SELECTIVITY = 0.01
+DEFAULT_SELECTIVITY = 0.5
+
+
+def is_code_column(column_name):
+    return column_name.endswith("_code") or column_name.startswith("diagnosis_") or column_name in (
+        "primary_diagnosis", "admission_method", "discharge_destination",
+    )
+
+
+def collect_stats(source_dir):
+    # Row counts, patient counts and code frequencies for every CSV table in
+    # source_dir. On the backend the same file can be written from any source.
+    stats = {"patients": 0, "tables": {}, "codes": {}}
+    for file_name in sorted(os.listdir(source_dir)):
+        if not file_name.endswith(".csv"):
+            continue
+        table_name = file_name[: -len(".csv")]
+        with open(os.path.join(source_dir, file_name), newline="") as f:
+            reader = csv.DictReader(f)
+            code_columns = [column for column in reader.fieldnames if is_code_column(column)]
+            frequencies = {column: Counter() for column in code_columns}
+            patients = set()
+            rows = 0
+            for row in reader:
+                rows += 1
+                patients.add(row["patient_id"])
+                for column in code_columns:
+                    if row[column]:
+                        frequencies[column][row[column]] += 1
+        stats["tables"][table_name] = {"rows": rows, "patients": len(patients)}
+        stats["patients"] = max(stats["patients"], len(patients))
+        for column, counts in frequencies.items():
+            stats["codes"][f"{table_name}.{column}"] = dict(counts)
+    return stats
+
+
+def load_stats(path):
+    if not os.path.exists(path):
+        print(f"No table statistics at {path}; using defaults", file=sys.stderr)
+        return {"patients": DEFAULT_PATIENTS, "tables": {}, "codes": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+
+
+
+# QUERY GRAPH ------------------------
+
+TABLE_NODES = {"SelectTable", "SelectPatientTable"}
+BOOLEAN_NODES = {"And", "Or", "Not"}
+ROW_PRESERVING_NODES = {"Sort"}
+
+
+def children(node):
+    # Every query model node reachable from this one's fields
+    if not dataclasses.is_dataclass(node):
+        return []
+    found = []
+    stack = [getattr(node, field.name) for field in dataclasses.fields(node)]
+    while stack:
+        value = stack.pop()
+        if dataclasses.is_dataclass(value):
+            found.append(value)
+        elif isinstance(value, dict):
+            stack.extend(value.keys())
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            stack.extend(value)
+    return found
+
+
+def node_name(node):
+    return type(node).__name__
+
+
+def is_frame(node):
+    # Many-rows-per-patient frames: tables and anything filtered or sorted from them
+    name = node_name(node)
+    if name == "SelectTable":
+        return True
+    if name in ("Filter", "Sort"):
+        return is_frame(node.source)
+    return False
+
+
+def source_table(node):
+    while not hasattr(node, "name") or node_name(node) not in TABLE_NODES:
+        node = getattr(node, "source", None)
+        if node is None:
+            return None
+    return node.name
+
+
+def dataset_variables(dataset):
+    # The population and every variable, found as attributes holding series
+    # with a query model node (works for the plain-attribute Dataset and for
+    # versions that keep variables in a dict)
+    variables = {}
+    for name, value in vars(dataset).items():
+        values = value.items() if isinstance(value, dict) else [(name, value)]
+        for variable_name, series in values:
+            node = getattr(series, "_qm_node", None)
+            if node is not None:
+                variables[variable_name] = node
+    return variables
+
+
+
+
+
+# COST MODEL ------------------------
+
+class CostModel:
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.patients = stats.get("patients") or DEFAULT_PATIENTS
+
+    def table_rows(self, table_name, patient_level=False):
+        table = self.stats["tables"].get(table_name)
+        if table:
+            return table["rows"]
+        return self.patients if patient_level else DEFAULT_TABLE_ROWS
+
+    def predicate_leaves(self, condition):
+        if node_name(condition) in BOOLEAN_NODES:
+            return sum(self.predicate_leaves(child) for child in children(condition))
+        return 1
+
+    def selectivity(self, condition, table_name):
+        name = node_name(condition)
+        parts = children(condition)
+        if name == "Or":
+            return min(1.0, sum(self.selectivity(part, table_name) for part in parts))
+        if name == "And":
+            return math.prod(self.selectivity(part, table_name) for part in parts)
+        if name == "Not":
+            return 1.0 - self.selectivity(parts[0], table_name)
+        if name == "In":
+            column = next((part.name for part in parts if node_name(part) == "SelectColumn"), None)
+            codes = next(
+                (part.value for part in parts if node_name(part) == "Value"
+                 and isinstance(part.value, (frozenset, set, tuple, list))),
+                None,
+            )
+            frequencies = self.stats["codes"].get(f"{table_name}.{column}")
+            rows = self.table_rows(table_name)
+            if frequencies is not None and codes is not None and rows:
+                return min(1.0, sum(frequencies.get(str(getattr(code, "value", code)), 0) for code in codes) / rows)
+            return DEFAULT_CODE_SELECTIVITY
+        if name in ("StringContains", "EQ"):
+            return DEFAULT_CODE_SELECTIVITY
+        return DEFAULT_SELECTIVITY
+
+    def estimate(self, root):
+        # Returns (rows scanned, largest intermediate, [(cost, description)])
+        # for one variable; shared subtrees within the variable count once
+        rows_out = {}
+        terms = []
+
+        def visit(node):
+            key = id(node)
+            if key in rows_out:
+                return rows_out[key]
+            for child in children(node):
+                visit(child)
+            name = node_name(node)
+            table_name = source_table(node) if is_frame(node) or name in TABLE_NODES else None
+
+            if name in TABLE_NODES:
+                rows = self.table_rows(node.name, patient_level=name == "SelectPatientTable")
+                terms.append((rows, f"scan {node.name}", node.name))
+            elif name == "Filter" and is_frame(node):
+                rows_in = rows_out[id(node.source)]
+                leaves = self.predicate_leaves(node.condition)
+                rows = rows_in * self.selectivity(node.condition, table_name)
+                detail = f"{leaves}-way condition" if leaves > 1 else "condition"
+                terms.append((rows_in * leaves, f"filter {table_name} ({detail})", None))
+            elif name == "SelectColumn":
+                rows = rows_out[id(node.source)]
+            elif name in ROW_PRESERVING_NODES and is_frame(node):
+                rows = rows_out[id(node.source)]
+                terms.append((rows * math.log2(rows + 2), f"sort {table_name}", None))
+            elif hasattr(node, "source") and id(node.source) in rows_out and is_frame(node.source):
+                # Aggregation or picking a row: one row per patient with rows
+                rows_in = rows_out[id(node.source)]
+                rows = min(rows_in, self.patients)
+                terms.append((rows_in, f"{name} over {source_table(node.source)}", None))
+            else:
+                # Values, conditions and other per-patient series
+                rows = self.patients
+            rows_out[key] = rows
+            return rows
+
+        visit(root)
+        scanned = sum(cost for cost, _, table in terms if table is not None)
+        largest = max(rows_out.values(), default=0)
+        return scanned, largest, terms
+
+
+def explain(dataset, stats, top=10):
+    model = CostModel(stats)
+    report = []
+    dominant = []
+    scans = Counter()
+    for variable_name, node in dataset_variables(dataset).items():
+        scanned, largest, terms = model.estimate(node)
+        cost = sum(term_cost for term_cost, _, _ in terms)
+        report.append((variable_name, scanned, largest, cost))
+        for term_cost, description, table_name in terms:
+            dominant.append((term_cost, f"{variable_name}: {description}"))
+            if table_name is not None:
+                scans[table_name] += 1
+
+    total = sum(cost for *_, cost in report) or 1
+    lines = [f"{'variable':<45} {'rows scanned':>14} {'max rows':>12} {'cost %':>7}"]
+    for variable_name, scanned, largest, cost in sorted(report, key=lambda row: -row[3]):
+        lines.append(f"{variable_name:<45} {scanned:>14,.0f} {largest:>12,.0f} {100 * cost / total:>7.1f}")
+
+    lines += ["", "Dominant terms:"]
+    for term_cost, description in sorted(dominant, reverse=True)[:top]:
+        lines.append(f"  {100 * term_cost / total:5.1f}%  {description}")
+
+    repeated = [(count, table_name) for table_name, count in scans.items() if count > 1]
+    if repeated:
+        lines += ["", "Tables scanned by more than one variable:"]
+        for count, table_name in sorted(repeated, reverse=True):
+            lines.append(f"  {table_name}: {count} scans")
+    return "\n".join(lines)
+
+
+def load_dataset(definition_path, definition_args):
+    # Run the definition as ehrQL would, with its own arguments, and return the
+    # Dataset it builds
+    definition_dir = os.path.dirname(os.path.abspath(definition_path))
+    sys.path.insert(0, definition_dir)
+    argv = sys.argv
+    sys.argv = [definition_path] + definition_args
+    try:
+        namespace = runpy.run_path(definition_path, run_name="dataset_definition")
+    finally:
+        sys.argv = argv
+    return next(
+        value for value in namespace.values() if type(value).__name__ == "Dataset"
+    )
+
+
+
+
+
+# MAIN ------------------------
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "stats":
+        parser = ArgumentParser()
+        parser.add_argument("command")
+        parser.add_argument("source_dir")
+        parser.add_argument("--output", default=DEFAULT_STATS_PATH)
+        args = parser.parse_args()
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(collect_stats(args.source_dir), f)
+        sys.exit()
+
+    # Everything after "--" is passed to the dataset definition
+    argv = sys.argv[1:]
+    definition_args = []
+    if "--" in argv:
+        definition_args = argv[argv.index("--") + 1:]
+        argv = argv[: argv.index("--")]
+    parser = ArgumentParser()
+    parser.add_argument("definition")
+    parser.add_argument("--stats", default=DEFAULT_STATS_PATH)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    dataset = load_dataset(args.definition, definition_args)
+    print(explain(dataset, load_stats(args.stats), top=args.top))
@@ -0,0 +1,409 @@
+################################################################################
+#
+# Description: This script generates dummy tables in which a chosen fraction
+#              of patients meets the populations of dataset_definition_isaric.py
+#              and dataset_definition_sus.py (methods A, B and C), so that local
+#              runs exercise the definitions rather than producing empty cohorts:
+#             - the key filters are read from the code rather than copied:
+#               COVID-19 ICD-10 codes, A&E diagnosis and discharge destination
+#               codelists (codelists_ehrql.py), the emergency admission methods
+#               (variables.EMERGENCY_ADMISSION_METHODS), the comorbidity
+#               codelists each definition uses and the isaric_raw columns that
+#               dataset_definition_isaric.py reads (e.g. hostdat, chrincard,
+#               the ethnic___<n> checkboxes)
+#             - qualifying patients have an ISARIC admission, an emergency SUS
+#               admission with a COVID-19 diagnosis and an A&E attendance
+#               resulting in admission, all on the same day
+#             - edge cases are planted in a fraction of patients: same-day
+#               admissions, back-to-back practice moves, 9999-12-31 (open)
+#               registrations and far-future dates
+#             - every other table the definitions read (ons_deaths, addresses,
+#               vaccinations, sgss_covid_all_tests) is written too, so that
+#               ehrql generate-dataset --dummy-tables can run on the output
+#
+#              Tables are generated in chunks of patients with numpy, so a
+#              million qualifying patients take minutes.
+#
+# Output: dummy-tables/synthetic/*.csv
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import ast
+import os
+from argparse import ArgumentParser
+
+import numpy as np
+
+from compile_codelists import read_codelists
+from local_tables import declared_kind
+
+
+
+
+
+# DEFINITION REQUIREMENTS ------------------------
+
+ANALYSIS_DIR = os.path.dirname(os.path.abspath(__file__))
+VARIABLES_MODULE = os.path.join(ANALYSIS_DIR, "variables.py")
+DEFINITIONS = [
+    os.path.join(ANALYSIS_DIR, "dataset_definition_isaric.py"),
+    os.path.join(ANALYSIS_DIR, "dataset_definition_sus.py"),
+]
+
+# Functions whose (codelist name, system) arguments mark a comorbidity lookup
+COMORBIDITY_FUNCTIONS = {"has_prior_comorbidity": (1, 2), "has_prior_comorbidity_as_of": (1, 2)}
+
+ISARIC_DEFINITION = os.path.join(ANALYSIS_DIR, "dataset_definition_isaric.py")
+
+
+def module_constant(module_path, name):
+    with open(module_path) as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign) and any(
+            isinstance(target, ast.Name) and target.id == name for target in node.targets
+        ):
+            return ast.literal_eval(node.value)
+    raise KeyError(f"{name} is not defined in {module_path}")
+
+
+def comorbidity_codelists(definition_paths):
+    # {codelist name: system} for every comorbidity the definitions look up
+    found = {}
+    for path in definition_paths:
+        with open(path) as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call) and getattr(node.func, "id", None) in COMORBIDITY_FUNCTIONS:
+                name_position, system_position = COMORBIDITY_FUNCTIONS[node.func.id]
+                arguments = node.args
+                if len(arguments) > system_position and all(
+                    isinstance(arguments[i], ast.Constant) for i in (name_position, system_position)
+                ):
+                    found[arguments[name_position].value] = arguments[system_position].value
+    return found
+
+
+def isaric_columns(definition_path):
+    # (columns, checkbox columns) of the isaric table that the definition reads:
+    # attributes of isaric, or of frames assigned from it, that are not method
+    # calls, and the options of multi_select_bitmask calls on those frames
+    with open(definition_path) as f:
+        tree = ast.parse(f.read())
+    frames = {"isaric"}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(
+            isinstance(child, ast.Name) and child.id in frames for child in ast.walk(node.value)
+        ):
+            frames.update(target.id for target in node.targets if isinstance(target, ast.Name))
+    called = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+    columns, checkboxes = [], []
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name)
+            and node.value.id in frames and id(node) not in called and node.attr not in columns
+        ):
+            columns.append(node.attr)
+        if (
+            isinstance(node, ast.Call) and getattr(node.func, "id", None) == "multi_select_bitmask"
+            and isinstance(node.args[0], ast.Name) and node.args[0].id in frames
+        ):
+            template, n_options = node.args[1].value, node.args[2].value
+            checkboxes += [template.format(n=n) for n in range(1, n_options + 1)]
+    return columns, checkboxes
+
+
+class Requirements:
+
+    def __init__(self):
+        codelists = read_codelists()
+        self.covid_icd10 = np.array(codelists["covid_icd10"])
+        self.covid_emergency = np.array(codelists["covid_emergency"])
+        self.discharged_to_hospital = np.array(codelists["discharged_to_hospital"])
+        self.other_emergency = np.array(codelists["resp_emergency"])
+        self.emergency_methods = np.array(module_constant(VARIABLES_MODULE, "EMERGENCY_ADMISSION_METHODS"))
+        self.ethnicity = np.array(codelists["ethnicity_codelist"])
+        self.obesity = np.array(codelists["obesity_codelist"])
+        self.isaric_columns, self.isaric_checkboxes = isaric_columns(ISARIC_DEFINITION)
+        systems = comorbidity_codelists(DEFINITIONS)
+        self.snomed = np.array(sorted({
+            code for name, system in systems.items() if system == "snomed" for code in codelists.get(name, ())
+        }))
+        self.ctv3 = np.array(sorted({
+            code for name, system in systems.items() if system == "ctv3" for code in codelists.get(name, ())
+        }))
+
+
+
+
+
+# GENERATION ------------------------
+
+MISSING_DAY = np.iinfo(np.int64).min
+OPEN_END = np.datetime64("9999-12-31").astype(np.int64)
+FAR_FUTURE = np.datetime64("2199-01-01").astype(np.int64)
+STUDY_START = np.datetime64("2020-03-01").astype(np.int64)
+STUDY_DAYS = 700
+
+# Codes that do not meet any population filter
+ELECTIVE_METHODS = np.array(["11", "12", "13"])
+OTHER_ICD10 = np.array(["I10", "J189", "E119", "N390", "K359"])
+DISCHARGED_HOME = "306689006"
+REGIONS = np.array(["North East", "North West", "Yorkshire and The Humber", "East Midlands",
+                    "West Midlands", "East", "London", "South East", "South West"])
+
+# ISARIC columns answered Yes/No/NA; other text columns without a declared
+# kind (the comorbidities) are answered YES/NO/Unknown
+ISARIC_COVID = ["corona_ieorres", "coriona_ieorres2", "coriona_ieorres3", "inflammatory_mss", "covid19_vaccine"]
+ONS_PLACES = np.array(["Hospital", "Home", "Care home", "Hospice"])
+
+
+def dates(days):
+    days = np.asarray(days, dtype=np.int64)
+    return np.where(days == MISSING_DAY, "", days.view("datetime64[D]").astype(str))
+
+
+def choice(rng, values, size):
+    return values[rng.integers(0, len(values), size)]
+
+
+def repeat_rows(rng, patient_id, mean):
+    # Indices into patient_id with a Poisson number of rows per patient
+    return np.repeat(np.arange(len(patient_id)), rng.poisson(mean, len(patient_id)))
+
+
+def generate_chunk(rng, first_id, n, requirements, qualifying_fraction, edge_fraction):
+    patient_id = np.arange(first_id, first_id + n, dtype=np.int64)
+    qualifies = rng.random(n) < qualifying_fraction
+    edge = rng.random(n) < edge_fraction
+    index_day = STUDY_START + rng.integers(0, STUDY_DAYS, n)
+    age = rng.uniform(18, 100, n)
+    tables = {}
+
+    # patients
+    birth = (index_day - age * 365.25).astype(np.int64)
+    birth = birth.view("datetime64[D]").astype("datetime64[M]").astype("datetime64[D]").view(np.int64)
+    died = rng.random(n) < 0.1
+    tables["patients"] = {
+        "patient_id": patient_id,
+        "date_of_birth": dates(birth),
+        "sex": choice(rng, np.array(["male", "female"]), n),
+        "date_of_death": dates(np.where(died, index_day + rng.integers(0, 120, n), MISSING_DAY)),
+    }
+
+    # practice_registrations: one open registration, split into a back-to-back
+    # move for edge-case patients; some deregister around the index date
+    start = index_day - rng.integers(365, 20 * 365, n)
+    end = np.where(rng.random(n) < 0.1, index_day + rng.integers(-400, 400, n), OPEN_END)
+    move = edge & (end == OPEN_END)
+    move_day = np.where(move, index_day - rng.integers(1, 300, n), MISSING_DAY)
+    reg_patient = np.concatenate([patient_id, patient_id[move]])
+    reg_start = np.concatenate([start, move_day[move] + 1])
+    reg_end = np.concatenate([np.where(move, move_day, end), end[move]])
+    order = np.argsort(reg_patient, kind="stable")
+    tables["practice_registrations"] = {
+        "patient_id": reg_patient[order],
+        "start_date": dates(reg_start[order]),
+        "end_date": dates(reg_end[order]),
+        "practice_pseudo_id": rng.integers(1, 5000, len(order)),
+        "practice_nuts1_region_name": choice(rng, REGIONS, len(order)),
+    }
+
+    # hospital_admissions: the qualifying COVID-19 admission (mostly emergency,
+    # some elective so methods A and B differ), other admissions, and for
+    # edge-case patients a second admission on the same day and one far in the future
+    elective = rng.random(n) < 0.2
+    covid = np.flatnonzero(qualifies)
+    other = repeat_rows(rng, patient_id, 0.7)
+    same_day = np.flatnonzero(edge & qualifies)
+    future = np.flatnonzero(edge & ~qualifies)
+    rows = np.concatenate([covid, other, same_day, future])
+    kind = np.repeat([0, 1, 2, 3], [len(covid), len(other), len(same_day), len(future)])
+    admitted = np.select(
+        [kind == 0, kind == 1, kind == 2],
+        [index_day[rows], index_day[rows] - rng.integers(30, 2000, len(rows)), index_day[rows]],
+        default=FAR_FUTURE,
+    )
+    method = np.where(
+        (kind == 0) & ~elective[rows],
+        choice(rng, requirements.emergency_methods, len(rows)),
+        choice(rng, ELECTIVE_METHODS, len(rows)),
+    )
+    primary = np.where(kind == 0, choice(rng, requirements.covid_icd10, len(rows)), choice(rng, OTHER_ICD10, len(rows)))
+    secondary = choice(rng, OTHER_ICD10, len(rows))
+    order = np.lexsort((admitted, patient_id[rows]))
+    rows, admitted, method, primary, secondary, kind = (
+        array[order] for array in (rows, admitted, method, primary, secondary, kind)
+    )
+    tables["hospital_admissions"] = {
+        "patient_id": patient_id[rows],
+        "admission_date": dates(admitted),
+        "discharge_date": dates(np.where(kind == 3, OPEN_END, admitted + rng.integers(1, 30, len(rows)))),
+        "admission_method": method,
+        "primary_diagnoses": primary,
+        "all_diagnoses": np.char.add(np.char.add(primary, ";"), secondary),
+        "days_in_critical_care": np.where(
+            (kind == 0) & (rng.random(len(rows)) < 0.2), rng.integers(1, 15, len(rows)), 0
+        ),
+    }
+
+    # emergency_care_attendances: qualifying attendances resulting in admission
+    # with a COVID-19 A&E diagnosis, plus unrelated attendances sent home
+    other = repeat_rows(rng, patient_id, 0.5)
+    rows = np.concatenate([covid, other])
+    qualifying_row = np.arange(len(rows)) < len(covid)
+    arrived = np.where(qualifying_row, index_day[rows], index_day[rows] - rng.integers(1, 2000, len(rows)))
+    order = np.lexsort((arrived, patient_id[rows]))
+    rows, arrived, qualifying_row = rows[order], arrived[order], qualifying_row[order]
+    attendances = {
+        "patient_id": patient_id[rows],
+        "arrival_date": dates(arrived),
+        "discharge_destination": np.where(
+            qualifying_row, choice(rng, requirements.discharged_to_hospital, len(rows)), DISCHARGED_HOME
+        ),
+        "diagnosis_01": np.where(
+            qualifying_row, choice(rng, requirements.covid_emergency, len(rows)),
+            choice(rng, requirements.other_emergency, len(rows)),
+        ),
+    }
+    for i in range(2, 25):
+        attendances[f"diagnosis_{i:02d}"] = np.full(len(rows), "")
+    tables["emergency_care_attendances"] = attendances
+
+    # isaric_raw: one row per qualifying patient, two (same day) for edge
+    # cases, with the columns dataset_definition_isaric.py reads; dates are
+    # the index day, so hostdat lines up with the SUS and A&E dates
+    rows = np.sort(np.concatenate([covid, same_day]))
+    m = len(rows)
+    isaric = {"patient_id": patient_id[rows]}
+    for column in requirements.isaric_columns:
+        kind = declared_kind("isaric", column)
+        if kind == "date":
+            isaric[column] = dates(index_day[rows])
+        elif column == "age":
+            isaric[column] = np.round(age[rows], 6)
+        elif column == "calc_age":
+            isaric[column] = age[rows].astype(np.int64)
+        elif column == "sex":
+            isaric[column] = np.where(tables["patients"]["sex"][rows] == "male", "Male", "Female")
+        elif column in ISARIC_COVID:
+            isaric[column] = choice(rng, np.array(["Yes", "No", "NA"]), m)
+        else:
+            isaric[column] = choice(rng, np.array(["NO", "NO", "NO", "YES", "Unknown"]), m)
+    for column in requirements.isaric_checkboxes:
+        isaric[column] = choice(rng, np.array(["Unchecked", "Unchecked", "Checked"]), m)
+    tables["isaric_raw"] = isaric
+
+    # ons_deaths: the patients who died, on their date of death
+    dead = np.flatnonzero(died)
+    tables["ons_deaths"] = {
+        "patient_id": patient_id[dead],
+        "date": tables["patients"]["date_of_death"][dead],
+        "place": choice(rng, ONS_PLACES, len(dead)),
+    }
+
+    # addresses: one address per patient from their first registration
+    tables["addresses"] = {
+        "patient_id": patient_id,
+        "start_date": dates(start),
+        "end_date": np.full(n, ""),
+        "imd_rounded": rng.integers(0, 329, n) * 100,
+    }
+
+    # vaccinations and sgss_covid_all_tests: a vaccination for some patients
+    # and a positive test shortly before the index date for qualifying ones
+    vaccinated = np.flatnonzero(rng.random(n) < 0.5)
+    tables["vaccinations"] = {
+        "patient_id": patient_id[vaccinated],
+        "date": dates(index_day[vaccinated] - rng.integers(-200, 200, len(vaccinated))),
+    }
+    tables["sgss_covid_all_tests"] = {
+        "patient_id": patient_id[covid],
+        "specimen_taken_date": dates(index_day[covid] - rng.integers(0, 10, len(covid))),
+        "is_positive": np.full(len(covid), "T"),
+    }
+
+    # clinical_events: comorbidity codes from the definitions' codelists (before
+    # and after the index date), ethnicity, BMI measurements and a few events
+    # dated far in the future
+    rows = repeat_rows(rng, patient_id, 3)
+    snomed = np.full(len(rows), "", dtype=object)
+    ctv3 = np.full(len(rows), "", dtype=object)
+    value = np.full(len(rows), "", dtype=object)
+    kind = rng.integers(0, 4, len(rows))
+    if len(requirements.ctv3):
+        ctv3[kind == 0] = choice(rng, requirements.ctv3, int((kind == 0).sum()))
+    snomed[kind == 1] = choice(rng, requirements.ethnicity, int((kind == 1).sum()))
+    snomed[kind == 2] = choice(rng, requirements.obesity, int((kind == 2).sum()))
+    value[kind == 2] = np.round(rng.uniform(15, 45, int((kind == 2).sum())), 1).astype(str)
+    snomed[kind == 3] = choice(rng, requirements.snomed, int((kind == 3).sum()))
+    event_day = index_day[rows] + rng.integers(-3650, 60, len(rows))
+    event_day = np.where(edge[rows] & (rng.random(len(rows)) < 0.1), FAR_FUTURE, event_day)
+    order = np.lexsort((event_day, patient_id[rows]))
+    tables["clinical_events"] = {
+        "patient_id": patient_id[rows][order],
+        "date": dates(event_day[order]),
+        "snomedct_code": snomed[order],
+        "ctv3_code": ctv3[order],
+        "numeric_value": value[order],
+    }
+    return tables
+
+
+
+
+
+# WRITING ------------------------
+
+def write_chunk(files, tables):
+    for name, columns in tables.items():
+        f = files[name]
+        if f.tell() == 0:
+            f.write(",".join(columns) + "\n")
+        values = [np.asarray(column).astype(str).tolist() for column in columns.values()]
+        if values and values[0]:
+            f.write("\n".join(",".join(row) for row in zip(*values)) + "\n")
+
+
+def generate(output_dir, n_patients, qualifying_fraction=0.5, edge_fraction=0.05, seed=0, chunk_size=100_000):
+    os.makedirs(output_dir, exist_ok=True)
+    requirements = Requirements()
+    rng = np.random.default_rng(seed)
+    files = {}
+    try:
+        for first in range(0, n_patients, chunk_size):
+            n = min(chunk_size, n_patients - first)
+            tables = generate_chunk(rng, first + 1, n, requirements, qualifying_fraction, edge_fraction)
+            for name in tables:
+                if name not in files:
+                    files[name] = open(os.path.join(output_dir, f"{name}.csv"), "w", newline="")
+            write_chunk(files, tables)
+    finally:
+        for f in files.values():
+            f.close()
+
+
+
+
+
+# MAIN ------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--patients", type=int, default=10_000)
+    parser.add_argument("--qualifying-fraction", type=float, default=0.5)
+    parser.add_argument("--edge-case-fraction", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--output-dir", default="dummy-tables/synthetic")
+    args = parser.parse_args()
+
+    generate(
+        args.output_dir, args.patients, args.qualifying_fraction,
+        args.edge_case_fraction, args.seed, args.chunk_size,
+    )
@@ -0,0 +1,224 @@
+################################################################################
+#
+# Description: This script links ISARIC admissions, SUS hospital episodes and
+#              A&E attendances into hospital spells, so that one stay that
+#              appears as several SUS episodes, a transfer between hospitals or
+#              an A&E arrival the day before admission is counted once:
+#             - every record becomes an event (patient, start, end, source):
+#               ISARIC from hostdat (or admission_date), or from
+#               hostdat_transfer when the patient was transferred in, to the
+#               discharge date (dsstdtc) where recorded; SUS from
+#               admission_date to discharge_date; A&E on arrival_date
+#             - events are sorted once by patient and start date and swept
+#               once, merging overlapping and adjacent (next day) events, or
+#               events up to gap_days further apart, into spells
+#             - each spell keeps a linked-source record: the number of events
+#               from each source and the first record of each, and every source
+#               row can be mapped to its spell
+#
+#              Missing, far-future (from 3000-01-01) or earlier-than-admission
+#              end dates are treated as unknown, so the event ends on its
+#              admission date rather than swallowing later stays.
+#
+# Input: <tables-dir>/isaric_raw.csv
+#        <tables-dir>/hospital_admissions.csv
+#        <tables-dir>/emergency_care_attendances.csv
+#
+# Output: output/admissions/hospital_spells.csv.gz
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import os
+from argparse import ArgumentParser
+
+import numpy as np
+
+from local_engine import ScanPlan
+from output_io import write_csv
+from registration_spells import FAR_FUTURE, MISSING_DAY, RegistrationSpells, to_dates, to_days
+
+
+
+
+
+# EVENTS ------------------------
+
+SOURCES = ["isaric", "sus", "ae"]
+
+# (start columns in order of preference, transfer column, end column) by source
+EVENT_COLUMNS = {
+    "isaric": (["hostdat", "admission_date"], "hostdat_transfer", "dsstdtc"),
+    "sus": (["admission_date"], None, "discharge_date"),
+    "ae": (["arrival_date"], None, None),
+}
+
+
+def source_events(table, source):
+    # (row, start, end) of every record with a start date
+    start_columns, transfer_column, end_column = EVENT_COLUMNS[source]
+    start_column = next(column for column in start_columns if column in table)
+    admitted = to_days(table[start_column])
+    starts = admitted
+    if transfer_column in table:
+        # A transfer in means the stay began at the other hospital
+        transfers = to_days(table[transfer_column])
+        earlier = (transfers != MISSING_DAY) & ((transfers < admitted) | (admitted == MISSING_DAY))
+        starts = np.where(earlier, transfers, admitted)
+    last_known = np.where(admitted == MISSING_DAY, starts, admitted)
+    ends = to_days(table[end_column]) if end_column in table else last_known
+    ends = np.where((ends == MISSING_DAY) | (ends >= FAR_FUTURE) | (ends < last_known), last_known, ends)
+    rows = np.flatnonzero(starts != MISSING_DAY)
+    return rows, starts[rows], ends[rows]
+
+
+
+
+
+# SPELLS ------------------------
+
+class HospitalSpells:
+
+    def __init__(self, tables, gap_days=0):
+        # tables maps source ("isaric", "sus", "ae") to a table with
+        # patient_id and the source's date columns; sources may be left out
+        parts = []
+        for code, source in enumerate(SOURCES):
+            if tables.get(source) is None:
+                continue
+            rows, starts, ends = source_events(tables[source], source)
+            patient_id = np.asarray(tables[source].patient_id, dtype=np.int64)[rows]
+            parts.append((patient_id, starts, ends, np.full(len(rows), code, dtype=np.int8), rows))
+        patient_id, starts, ends, source, row = (
+            np.concatenate(arrays) for arrays in zip(*parts)
+        ) if parts else (np.array([], dtype=np.int64),) * 5
+
+        # The only sort: events by patient, then start, then longest first
+        order = np.lexsort((-ends, starts, patient_id))
+        self.event_patient_id = patient_id[order]
+        self.event_start = starts[order]
+        self.event_end = ends[order]
+        self.event_source = source[order]
+        self.event_row = row[order]
+
+        # One sweep, as for registration spells: an event starts a new spell if
+        # it is the patient's first or starts more than gap_days + 1 days after
+        # every earlier event has ended
+        new_patient = np.ones(len(order), dtype=bool)
+        new_patient[1:] = self.event_patient_id[1:] != self.event_patient_id[:-1]
+        covered_until = RegistrationSpells.running_max_by_patient(self.event_end, new_patient)
+        new_spell = new_patient.copy()
+        new_spell[1:] |= self.event_start[1:] > covered_until[:-1] + 1 + gap_days
+        self.event_spell = np.cumsum(new_spell) - 1
+
+        spell_starts_at = np.flatnonzero(new_spell)
+        self.patient_id = self.event_patient_id[spell_starts_at]
+        self.start = self.event_start[spell_starts_at]
+        self.end = (
+            np.maximum.reduceat(self.event_end, spell_starts_at) if len(spell_starts_at) else self.event_end[:0]
+        )
+        self.n_events = np.diff(np.append(spell_starts_at, len(order)))
+
+        # Linked-source record: per source, the number of events in each spell
+        # and the earliest one (its row in the source table, -1 if none)
+        self.counts = {}
+        self.first_row = {}
+        self.first_event = {}
+        for code, source_name in enumerate(SOURCES):
+            in_source = np.flatnonzero(self.event_source == code)
+            self.counts[source_name] = np.bincount(self.event_spell[in_source], minlength=len(self))
+            spells, first = np.unique(self.event_spell[in_source], return_index=True)
+            self.first_event[source_name] = np.full(len(self), -1, dtype=np.int64)
+            self.first_event[source_name][spells] = in_source[first]
+            self.first_row[source_name] = np.full(len(self), -1, dtype=np.int64)
+            self.first_row[source_name][spells] = self.event_row[in_source[first]]
+
+    def __len__(self):
+        return len(self.patient_id)
+
+    def spell_of_rows(self, source, n_rows):
+        # Spell of each row of a source table, -1 for rows with no start date
+        result = np.full(n_rows, -1, dtype=np.int64)
+        in_source = self.event_source == SOURCES.index(source)
+        result[self.event_row[in_source]] = self.event_spell[in_source]
+        return result
+
+    def sum_by_spell(self, source, values):
+        # Sum of a source column (e.g. SUS days_in_critical_care) over each
+        # spell's events from that source; missing values count as 0
+        values = np.nan_to_num(np.asarray(values, dtype=np.float64))
+        in_source = self.event_source == SOURCES.index(source)
+        return np.bincount(
+            self.event_spell[in_source], weights=values[self.event_row[in_source]], minlength=len(self)
+        )
+
+    def first_start(self, source):
+        # Start date of each spell's earliest event from the source
+        first = self.first_event[source]
+        return to_dates(np.where(first >= 0, self.event_start[np.maximum(first, 0)], MISSING_DAY))
+
+    def rows(self, days_in_critical_care=None):
+        starts = {source: self.first_start(source).astype(str) for source in SOURCES}
+        spell_start = to_dates(self.start).astype(str)
+        spell_end = to_dates(self.end).astype(str)
+        for i in range(len(self)):
+            row = {
+                "patient_id": self.patient_id[i],
+                "spell_start_date": spell_start[i],
+                "spell_end_date": spell_end[i],
+                "n_events": self.n_events[i],
+            }
+            for source in SOURCES:
+                row[f"n_{source}"] = self.counts[source][i]
+                row[f"first_date_{source}"] = "" if starts[source][i] == "NaT" else starts[source][i]
+            if days_in_critical_care is not None:
+                row["days_in_critical_care"] = f"{days_in_critical_care[i]:g}"
+            yield row
+
+    def fieldnames(self, days_in_critical_care=False):
+        names = ["patient_id", "spell_start_date", "spell_end_date", "n_events"]
+        for source in SOURCES:
+            names += [f"n_{source}", f"first_date_{source}"]
+        return names + (["days_in_critical_care"] if days_in_critical_care else [])
+
+
+
+
+
+# MAIN ------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--tables-dir", default="dummy-tables")
+    parser.add_argument("--isaric", help="ISARIC table (default <tables-dir>/isaric_raw.csv)")
+    parser.add_argument("--gap-days", type=int, default=0)
+    parser.add_argument("--isaric-patients-only", action="store_true")
+    parser.add_argument("--output", default="output/admissions/hospital_spells.csv.gz")
+    parser.add_argument("--staging-dir", help="Read current staged slices from here (stage_tables.py)")
+    args = parser.parse_args()
+
+    plan = ScanPlan(staging_dir=args.staging_dir)
+    plan.require("isaric", "hostdat", "admission_date", "hostdat_transfer", "dsstdtc")
+    plan.require("hospital_admissions", "admission_date", "discharge_date", "days_in_critical_care")
+    plan.require("emergency_care_attendances", "arrival_date")
+    isaric = plan.scan("isaric", args.isaric or os.path.join(args.tables_dir, "isaric_raw.csv"))
+    if args.isaric_patients_only:
+        plan.restrict_to(isaric.patient_id)
+    tables = {
+        "isaric": isaric,
+        "sus": plan.scan("hospital_admissions", os.path.join(args.tables_dir, "hospital_admissions.csv")),
+        "ae": plan.scan("emergency_care_attendances", os.path.join(args.tables_dir, "emergency_care_attendances.csv")),
+    }
+
+    spells = HospitalSpells(tables, gap_days=args.gap_days)
+    critical_care = None
+    if "days_in_critical_care" in tables["sus"]:
+        critical_care = spells.sum_by_spell("sus", tables["sus"]["days_in_critical_care"])
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    write_csv(args.output, spells.fieldnames(critical_care is not None), spells.rows(critical_care))
+    linked = (spells.counts["isaric"] > 0) & ((spells.counts["sus"] > 0) | (spells.counts["ae"] > 0))
+    print(f"{len(spells)} spells from {len(spells.event_spell)} events; {int(linked.sum())} link ISARIC to SUS or A&E")
@@ -0,0 +1,125 @@
+################################################################################
+#
+# Description: This script contains a per-patient interval index for tables of
+#              date ranges (practice_registrations, addresses) loaded with
+#              local_tables.py. It answers batched "which row is active for
+#              patient p on date d" queries for many (patient, date) pairs in
+#              one vectorised call - the local equivalent of
+#              practice_registrations.for_patient_on(...) and
+#              addresses.for_patient_on(...) for every index date at once.
+#
+#              As in ehrQL, a row is active on d if start_date <= d and
+#              end_date is missing or on/after d. Where several rows are active
+#              the one that sorts last by the table's precedence columns wins.
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import numpy as np
+
+from local_engine import sort_key
+from local_tables import PackedTriState
+
+
+
+
+
+# PRECEDENCE RULES ------------------------
+
+# Columns that decide between overlapping rows, in order; the row that sorts
+# last wins (matching the sort_by(...).last_for_patient() used by ehrQL)
+REGISTRATION_PRECEDENCE = ["start_date", "end_date", "practice_pseudo_id"]
+ADDRESS_PRECEDENCE = ["has_postcode", "start_date", "end_date", "address_id"]
+
+NO_ROW = -1
+
+# NaT viewed as int64
+MISSING_DAY = np.iinfo(np.int64).min
+
+
+
+
+
+# INDEX ------------------------
+
+def to_days(column):
+    return np.asarray(column).astype("datetime64[D]").view(np.int64)
+
+
+class IntervalIndex:
+
+    def __init__(self, table, precedence, start="start_date", end="end_date"):
+        self.table = table
+        patient_id = table.patient_id
+
+        # Within each patient, order rows from highest to lowest precedence so
+        # that the first active row found for a query is the one ehrQL picks
+        keys = [~sort_key(table.columns[column]) for column in precedence if column in table]
+        self.order = np.lexsort(keys[::-1] + [patient_id]) if len(table) else np.array([], dtype=np.int64)
+
+        ordered_patients = patient_id[self.order]
+        self.patients, self.group_starts, self.group_sizes = np.unique(
+            ordered_patients, return_index=True, return_counts=True
+        )
+        self.start = to_days(table[start])[self.order]
+        self.end = to_days(table[end])[self.order]
+        self.max_group_size = int(self.group_sizes.max()) if len(self.group_sizes) else 0
+
+    @classmethod
+    def for_registrations(cls, practice_registrations):
+        return cls(practice_registrations, REGISTRATION_PRECEDENCE)
+
+    @classmethod
+    def for_addresses(cls, addresses):
+        return cls(addresses, ADDRESS_PRECEDENCE)
+
+    def active_rows(self, patient_ids, dates):
+        # Returns the table row active for each (patient, date) pair, or NO_ROW.
+        # Each round checks the next-highest-precedence row of every unresolved
+        # query, so the work is the number of rows examined, not a scan per query.
+        patient_ids = np.asarray(patient_ids, dtype=np.int64)
+        dates = to_days(dates)
+        result = np.full(len(patient_ids), NO_ROW, dtype=np.int64)
+
+        if not len(self.patients):
+            return result
+        position = np.minimum(np.searchsorted(self.patients, patient_ids), len(self.patients) - 1)
+        pending = np.flatnonzero((self.patients[position] == patient_ids) & (dates != MISSING_DAY))
+        group_start = self.group_starts[position]
+        group_size = self.group_sizes[position]
+
+        for offset in range(self.max_group_size):
+            pending = pending[group_size[pending] > offset]
+            if not len(pending):
+                break
+            rows = group_start[pending] + offset
+            start, end, date = self.start[rows], self.end[rows], dates[pending]
+            active = (start != MISSING_DAY) & (start <= date) & ((end == MISSING_DAY) | (end >= date))
+            result[pending[active]] = self.order[rows[active]]
+            pending = pending[~active]
+        return result
+
+    def values_on(self, patient_ids, dates, column):
+        # Value of a column from the active row, or missing if no row is active
+        rows = self.active_rows(patient_ids, dates)
+        found = rows != NO_ROW
+        column = self.table.columns[column]
+        if isinstance(column, PackedTriState):
+            values = np.full(len(rows), None, dtype=object)
+            values[found] = column.decode(rows[found])
+            return values
+        if column.dtype.kind == "M":
+            values = np.full(len(rows), np.datetime64("NaT"), dtype=column.dtype)
+        elif column.dtype.kind == "f":
+            values = np.full(len(rows), np.nan)
+        else:
+            values = np.full(len(rows), None, dtype=object)
+        values[found] = column[rows[found]]
+        return values
+
+    def exists_on(self, patient_ids, dates):
+        return self.active_rows(patient_ids, dates) != NO_ROW
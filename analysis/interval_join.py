@@ -0,0 +1,172 @@
+################################################################################
+#
+# Description: This script joins point events (e.g. ONS death dates, positive
+#              tests) to per-patient intervals (e.g. hospital admissions from
+#              admission_date to discharge_date) by containment, for every
+#              interval rather than only each patient's first:
+#             - containing_interval gives, for each point, an interval of the
+#               same patient that contains it (the one open longest, if
+#               several overlap), or -1
+#             - first_point_in_interval gives, for each interval, the earliest
+#               point of the same patient that falls inside it, or -1, so a
+#               death counts as in-hospital for the admission it falls in
+#             - both sort the intervals and points once by (patient, date) and
+#               sweep them with binary searches, rather than filtering the
+#               points once per admission
+#
+#              Intervals with missing, far-future (from 3000-01-01) or
+#              earlier-than-start ends have no known extent and contain no
+#              points, as in the ehrQL death_during_admission variable (whose
+#              comparison with a missing discharge date is never true).
+#
+#              Usage:
+#                python analysis/interval_join.py --tables-dir dummy-tables \
+#                  --points ons_deaths:date
+#
+# Input: <tables-dir>/hospital_admissions.csv, <tables-dir>/<points table>.csv
+#
+# Output: output/admissions/<intervals>_<points>.csv.gz (one row per interval)
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import os
+from argparse import ArgumentParser
+
+import numpy as np
+
+from local_engine import ScanPlan
+from output_io import write_csv
+from registration_spells import FAR_FUTURE, MISSING_DAY, RegistrationSpells, to_dates, to_days
+
+
+
+
+
+# CONTAINMENT JOIN ------------------------
+
+def interval_days(starts, ends):
+    # Intervals without a known end are given a missing start, so that they
+    # are left out like intervals without a start
+    starts, ends = to_days(starts), to_days(ends)
+    unknown_end = (ends == MISSING_DAY) | (ends >= FAR_FUTURE) | (ends < starts)
+    return np.where(unknown_end, MISSING_DAY, starts), ends
+
+
+def patient_day_keys(patient_id, days):
+    return np.rec.fromarrays([np.asarray(patient_id, dtype=np.int64), np.asarray(days, dtype=np.int64)])
+
+
+def containing_interval(point_patient_id, point_dates, interval_patient_id, starts, ends):
+    # Index of an interval containing each point, or -1. Intervals are sorted
+    # by (patient, start); the running maximum of their ends (restarting at
+    # each patient) says whether any interval starting on or before the point
+    # is still open, and which one.
+    point_patient_id = np.asarray(point_patient_id, dtype=np.int64)
+    point_days = to_days(point_dates)
+    starts, ends = interval_days(starts, ends)
+    interval_patient_id = np.asarray(interval_patient_id, dtype=np.int64)
+    result = np.full(len(point_days), -1, dtype=np.int64)
+    keep = np.flatnonzero(starts != MISSING_DAY)
+    if not len(keep) or not len(point_days):
+        return result
+
+    order = keep[np.lexsort((starts[keep], interval_patient_id[keep]))]
+    patient_id, starts, ends = interval_patient_id[order], starts[order], ends[order]
+    new_patient = np.ones(len(order), dtype=bool)
+    new_patient[1:] = patient_id[1:] != patient_id[:-1]
+    open_until = RegistrationSpells.running_max_by_patient(ends, new_patient)
+    # The last interval reaching the running maximum is the one open longest;
+    # each patient's first interval reaches it, so it never leaks across patients
+    open_longest = np.maximum.accumulate(np.where(ends == open_until, np.arange(len(order)), 0))
+
+    latest = np.searchsorted(
+        patient_day_keys(patient_id, starts), patient_day_keys(point_patient_id, point_days), side="right"
+    ) - 1
+    found = np.maximum(latest, 0)
+    contained = (
+        (latest >= 0) & (point_days != MISSING_DAY)
+        & (patient_id[found] == point_patient_id) & (open_until[found] >= point_days)
+    )
+    result[contained] = order[open_longest[found[contained]]]
+    return result
+
+
+def first_point_in_interval(interval_patient_id, starts, ends, point_patient_id, point_dates):
+    # Index of the earliest point inside each interval, or -1
+    interval_patient_id = np.asarray(interval_patient_id, dtype=np.int64)
+    starts, ends = interval_days(starts, ends)
+    point_patient_id = np.asarray(point_patient_id, dtype=np.int64)
+    point_days = to_days(point_dates)
+    result = np.full(len(starts), -1, dtype=np.int64)
+    keep = np.flatnonzero(point_days != MISSING_DAY)
+    if not len(keep) or not len(starts):
+        return result
+
+    order = keep[np.lexsort((point_days[keep], point_patient_id[keep]))]
+    found = np.searchsorted(
+        patient_day_keys(point_patient_id[order], point_days[order]),
+        patient_day_keys(interval_patient_id, starts),
+    )
+    position = np.minimum(found, len(order) - 1)
+    candidate = order[position]
+    contained = (
+        (found < len(order)) & (starts != MISSING_DAY)
+        & (point_patient_id[candidate] == interval_patient_id) & (point_days[candidate] <= ends)
+    )
+    result[contained] = candidate[contained]
+    return result
+
+
+
+
+
+# MAIN ------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--tables-dir", default="dummy-tables")
+    parser.add_argument("--intervals", default="hospital_admissions:admission_date:discharge_date",
+                        help="table:start column:end column")
+    parser.add_argument("--points", default="ons_deaths:date", help="table:date column")
+    parser.add_argument("--output-dir", default="output/admissions")
+    parser.add_argument("--staging-dir", help="Read current staged slices from here (stage_tables.py)")
+    args = parser.parse_args()
+
+    interval_table, start_column, end_column = args.intervals.split(":")
+    point_table, point_column = args.points.split(":")
+    plan = ScanPlan(staging_dir=args.staging_dir)
+    plan.require(interval_table, start_column, end_column)
+    plan.require(point_table, point_column)
+    intervals = plan.scan(interval_table, os.path.join(args.tables_dir, f"{interval_table}.csv"))
+    plan.restrict_to(intervals.patient_id)
+    points = plan.scan(point_table, os.path.join(args.tables_dir, f"{point_table}.csv"))
+
+    found = first_point_in_interval(
+        intervals.patient_id, intervals[start_column], intervals[end_column],
+        points.patient_id, points[point_column],
+    )
+    point_days = to_days(points[point_column])
+    point_dates = to_dates(np.where(found >= 0, point_days[np.maximum(found, 0)], MISSING_DAY)).astype(str)
+    starts = to_dates(to_days(intervals[start_column])).astype(str)
+    ends = to_dates(to_days(intervals[end_column])).astype(str)
+
+    def rows():
+        for i in range(len(intervals)):
+            yield {
+                "patient_id": intervals.patient_id[i],
+                start_column: "" if starts[i] == "NaT" else starts[i],
+                end_column: "" if ends[i] == "NaT" else ends[i],
+                f"{point_table}_{point_column}": "" if point_dates[i] == "NaT" else point_dates[i],
+                f"{point_table}_in_interval": int(found[i] >= 0),
+            }
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, f"{interval_table}_{point_table}.csv.gz")
+    fieldnames = ["patient_id", start_column, end_column, f"{point_table}_{point_column}", f"{point_table}_in_interval"]
+    write_csv(path, fieldnames, rows())
+    print(f"{int((found >= 0).sum())} of {len(intervals)} {interval_table} rows contain a {point_table} {point_column}")
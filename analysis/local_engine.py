@@ -0,0 +1,181 @@
+################################################################################
+#
+# Description: This script contains the per-patient operations used to evaluate
+#              dataset definitions locally against tables loaded with
+#              local_tables.py:
+#             - Filtering rows (where)
+#             - Picking the first/last row per patient, or the top k rows, by
+#               one or more sort keys (the local equivalent of
+#               sort_by(...).first_for_patient()) without sorting the table
+#             - Planning base-table scans so the population is pushed down as a
+#               semi-join on patient_id and unreferenced columns are never read,
+#               reading a table's staged slice (stage_tables.py) instead of the
+#               raw CSV when one is current
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import numpy as np
+
+from local_tables import LocalTable, PackedTriState, load_table
+from stage_tables import current_slice, load_slice
+
+
+
+
+
+# SORT KEYS ------------------------
+
+INT64_MAX = np.iinfo(np.int64).max
+
+
+def sort_key(column):
+    # Encode a column as int64 values with the same ordering, nulls first (as
+    # in ehrQL), so that every key can be compared with integer min/max
+    if isinstance(column, PackedTriState):
+        return column.codes().astype(np.int64)
+    column = np.asarray(column)
+    if column.dtype.kind == "M":
+        # NaT is the smallest int64, so already sorts first
+        return column.astype("datetime64[D]").view(np.int64)
+    if column.dtype.kind in "iub":
+        return column.astype(np.int64)
+    if column.dtype.kind == "f":
+        # NaN sorts first, and adding 0.0 turns -0.0 into 0.0 so the two compare equal
+        values = (np.where(np.isnan(column), -np.inf, column) + 0.0).astype(np.float64).view(np.int64)
+        # Flip the magnitude bits of negative floats so integer order matches float order
+        return values ^ ((values >> 63) & INT64_MAX)
+    # Strings: rank the distinct values (a sort of the vocabulary, not the table)
+    present = np.array([value is not None for value in column])
+    keys = np.full(len(column), -1, dtype=np.int64)
+    if present.any():
+        _, ranks = np.unique(column[present].astype(str), return_inverse=True)
+        keys[present] = ranks
+    return keys
+
+
+def group_starts(patient_id):
+    # Offsets at which each patient's rows begin, for rows sorted by patient_id
+    if len(patient_id) == 0:
+        return np.array([], dtype=np.int64)
+    return np.concatenate([[0], np.flatnonzero(np.diff(patient_id)) + 1])
+
+
+def ensure_patient_sorted(table):
+    patient_id = table.patient_id
+    if len(patient_id) > 1 and np.any(np.diff(patient_id) < 0):
+        return table.take(np.argsort(patient_id, kind="stable"))
+    return table
+
+
+
+
+
+# PER-PATIENT OPERATIONS ------------------------
+
+def where(table, mask):
+    return table.take(np.flatnonzero(mask))
+
+
+def pick_for_patient(patient_id, keys, candidates, last=False):
+    # One linear grouped pass per key: keep rows whose key equals their
+    # patient's minimum (or maximum), then break ties with the next key.
+    # Remaining ties go to the earliest row.
+    for key in keys:
+        if not len(candidates):
+            break
+        values = key[candidates]
+        if last:
+            values = ~values  # order-reversing without overflow
+        starts = group_starts(patient_id[candidates])
+        best = np.minimum.reduceat(values, starts)
+        counts = np.diff(np.append(starts, len(candidates)))
+        candidates = candidates[values == np.repeat(best, counts)]
+    return candidates[group_starts(patient_id[candidates])]
+
+
+def top_k_for_patient(table, sort_by, k=1, last=False):
+    # Returns (row indices, rank) of each patient's first k rows by the sort
+    # columns, taking k passes over the table rather than sorting it
+    table = ensure_patient_sorted(table)
+    keys = [sort_key(table.columns[column]) for column in sort_by]
+    remaining = np.ones(len(table), dtype=bool)
+    indices, ranks = [], []
+    for rank in range(1, k + 1):
+        winners = pick_for_patient(table.patient_id, keys, np.flatnonzero(remaining), last=last)
+        if not len(winners):
+            break
+        remaining[winners] = False
+        indices.append(winners)
+        ranks.append(np.full(len(winners), rank, dtype=np.int64))
+    if not indices:
+        return table, np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    indices = np.concatenate(indices)
+    ranks = np.concatenate(ranks)
+    order = np.lexsort((ranks, table.patient_id[indices]))
+    return table, indices[order], ranks[order]
+
+
+def first_for_patient(table, sort_by, last=False):
+    # One row per patient with every column pulled from the winning row at
+    # once, so reading many fields from e.g. the first ISARIC admission costs
+    # one selection
+    table, indices, _ = top_k_for_patient(table, sort_by, k=1, last=last)
+    return table.take(indices)
+
+
+def last_for_patient(table, sort_by):
+    return first_for_patient(table, sort_by, last=True)
+
+
+def top_k_table(table, sort_by, k, last=False, rank_column="rank"):
+    table, indices, ranks = top_k_for_patient(table, sort_by, k=k, last=last)
+    selected = table.take(indices)
+    return LocalTable(table.name, {**selected.columns, rank_column: ranks})
+
+
+
+
+
+# SCAN PLANNING ------------------------
+
+class ScanPlan:
+    # Collects, before any base table is read, the columns each variable
+    # references and the population, so that every scan reads only those
+    # columns for only those patients. Tables with no recorded columns are
+    # read in full.
+
+    def __init__(self, sample=None, staging_dir=None, source_version=None):
+        # sample is an optional (fraction, seed) patient-hash sample applied to
+        # every scan, so all tables keep the same patients. With staging_dir,
+        # tables with a current staged slice are read from it; source_version
+        # is the --source-version the slices were staged with, if any.
+        self.columns = {}
+        self.population = None
+        self.sample = sample
+        self.staging_dir = staging_dir
+        self.source_version = source_version
+
+    def require(self, table_name, *column_names):
+        self.columns.setdefault(table_name, set()).update(column_names)
+        return self
+
+    def restrict_to(self, patient_ids):
+        # e.g. the patients of isaric.exists_for_patient()
+        self.population = np.unique(np.asarray(patient_ids, dtype=np.int64))
+        return self
+
+    def scan(self, table_name, path):
+        if self.staging_dir is not None and current_slice(table_name, path, self.staging_dir, self.source_version):
+            return load_slice(
+                table_name, self.staging_dir, columns=self.columns.get(table_name),
+                patient_ids=self.population, sample=self.sample,
+            )
+        return load_table(
+            path, name=table_name, columns=self.columns.get(table_name),
+            patient_ids=self.population, sample=self.sample,
+        )
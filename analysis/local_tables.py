@@ -0,0 +1,394 @@
+################################################################################
+#
+# Description: This script contains functions for loading the tables in
+#              dummy-tables/ into memory so that dataset definitions and
+#              helper functions can be checked locally:
+#             - Reading a table into typed numpy columns, sorted by patient_id,
+#               with a fixed kind per column (code columns are always text)
+#             - Storing yes/no style fields (e.g. ISARIC comorbidities) as
+#               packed 2-bit columns that are only decoded when projected
+#             - Pruning columns and restricting to a set of patients, or to a
+#               deterministic patient-hash sample, while reading
+#
+# Input: dummy-tables/*.csv
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import csv
+import re
+import sys
+
+import numpy as np
+
+
+
+
+
+# TRI-STATE (YES/NO/UNKNOWN) FIELDS ------------------------
+
+# Codes stored for each value of a tri-state field (2 bits each)
+MISSING, NEGATIVE, POSITIVE, NOT_KNOWN = 0, 1, 2, 3
+
+# Spellings seen in ISARIC extracts, normalised once at load time. Values are
+# matched case-insensitively so "YES", "Yes" and "yes" all share one code.
+TRISTATE_SPELLINGS = {
+    "yes": POSITIVE,
+    "no": NEGATIVE,
+    "checked": POSITIVE,
+    "unchecked": NEGATIVE,
+    "n/k": NOT_KNOWN,
+    "nk": NOT_KNOWN,
+    "unknown": NOT_KNOWN,
+    "not known": NOT_KNOWN,
+}
+
+# Labels returned when decoding, by field family (indexed by code)
+YES_NO_LABELS = (None, "NO", "YES", "Unknown")
+CHECKBOX_LABELS = (None, "Unchecked", "Checked", "Unknown")
+
+MISSING_VALUES = {"", "NA", "N/A"}
+
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+class PackedTriState:
+    # A column of tri-state values packed four to a byte
+
+    __slots__ = ("packed", "length", "labels")
+
+    def __init__(self, packed, length, labels):
+        self.packed = packed
+        self.length = length
+        self.labels = labels
+
+    @classmethod
+    def from_codes(cls, codes, labels=YES_NO_LABELS):
+        codes = np.asarray(codes, dtype=np.uint8)
+        padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+        padded[: len(codes)] = codes
+        quads = padded.reshape(-1, 4)
+        packed = quads[:, 0] | (quads[:, 1] << 2) | (quads[:, 2] << 4) | (quads[:, 3] << 6)
+        return cls(packed, len(codes), labels)
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    def codes(self, indices=None):
+        # Unpack all codes, or only those at the given row indices, without
+        # materialising the rest of the column
+        if indices is None:
+            shifts = np.array([0, 2, 4, 6], dtype=np.uint8)
+            return ((self.packed[:, None] >> shifts) & 3).ravel()[: self.length]
+        indices = np.asarray(indices, dtype=np.int64)
+        shifts = ((indices & 3) * 2).astype(np.uint8)
+        return (self.packed[indices >> 2] >> shifts) & 3
+
+    def take(self, indices):
+        return PackedTriState.from_codes(self.codes(indices), self.labels)
+
+    def decode(self, indices=None):
+        labels = np.array(self.labels, dtype=object)
+        return labels[self.codes(indices)]
+
+
+def tristate_codes(values, column_name):
+    codes = np.zeros(len(values), dtype=np.uint8)
+    for i, value in enumerate(values):
+        if value in MISSING_VALUES:
+            continue
+        code = TRISTATE_SPELLINGS.get(value.strip().lower())
+        if code is None:
+            raise ValueError(f"{column_name}: {value!r} is not a yes/no value")
+        codes[i] = code
+    return codes
+
+
+
+
+
+# COLUMN KINDS ------------------------
+
+# Each column is read as one kind: "date", "float", "text", or "tristate" and
+# "checkbox" (packed yes/no and checked/unchecked fields)
+
+# Code columns are always text: SNOMED CT codes do not survive a float round
+# trip, and codes such as "21" and "2A" must compare as the same type
+TEXT_COLUMNS = {
+    "snomedct_code", "ctv3_code", "icd10_code", "primary_diagnosis", "primary_diagnoses", "all_diagnoses",
+    "admission_method", "discharge_destination", "practice_pseudo_id",
+}
+CODE_COLUMN_PATTERN = re.compile(r"(^diagnosis_\d+|_code|_codes|_diagnoses)$")
+
+# Fixed kinds of the columns the definitions use, by table. Other columns are
+# inferred from every value in the file (KindInference).
+TABLE_SCHEMAS = {
+    "patients": {"date_of_birth": "date", "sex": "text", "date_of_death": "date"},
+    "practice_registrations": {"start_date": "date", "end_date": "date", "practice_nuts1_region_name": "text"},
+    "hospital_admissions": {"admission_date": "date", "discharge_date": "date", "days_in_critical_care": "float"},
+    "emergency_care_attendances": {"arrival_date": "date"},
+    "clinical_events": {"date": "date", "numeric_value": "float"},
+    "ons_deaths": {"date": "date", "place": "text"},
+    "sgss_covid_all_tests": {"specimen_taken_date": "date"},
+    "isaric": {
+        "admission_date": "date", "hostdat": "date", "hostdat_transfer": "date", "dsstdtc": "date",
+        "covid19_vaccined": "date", "age": "float", "calc_age": "float", "sex": "text",
+        **{
+            f"{name}_isaric": "tristate"
+            for name in [
+                "ccd", "hypertension", "chronicpul", "asthma", "ckd", "mildliver", "modliver", "neuro",
+                "cancer", "haemo", "hiv", "obesity", "diabetes", "diabetescom", "rheumatologic",
+                "dementia", "malnutrition",
+            ]
+        },
+    },
+}
+TABLE_ALIASES = {"isaric_raw": "isaric", "isaric_raw_test": "isaric"}
+
+
+def declared_kind(table_name, column_name):
+    # The fixed kind of a column, or None if it is to be inferred
+    if column_name in TEXT_COLUMNS or CODE_COLUMN_PATTERN.search(column_name):
+        return "text"
+    return TABLE_SCHEMAS.get(TABLE_ALIASES.get(table_name, table_name), {}).get(column_name)
+
+
+def column_kinds(table_name, column_names, schema=None):
+    # {column: kind or None} for the columns other than patient_id; schema
+    # overrides the declared kinds
+    schema = schema or {}
+    return {
+        column_name: schema.get(column_name) or declared_kind(table_name, column_name)
+        for column_name in column_names
+        if column_name != "patient_id"
+    }
+
+
+class KindInference:
+    # Infers a column's kind from every value in a file as it streams past, so
+    # the kind does not depend on which rows a semi-join, sample or partition
+    # keeps
+
+    __slots__ = ("candidates", "present", "answered", "checkbox")
+
+    def __init__(self):
+        self.candidates = {"tristate", "date", "float"}
+        self.present = self.answered = self.checkbox = False
+
+    def update(self, value):
+        if not self.candidates or value in MISSING_VALUES:
+            return
+        self.present = True
+        if "tristate" in self.candidates:
+            lowered = value.strip().lower()
+            code = TRISTATE_SPELLINGS.get(lowered)
+            if code is None:
+                self.candidates.discard("tristate")
+            else:
+                self.answered = self.answered or code != NOT_KNOWN
+                self.checkbox = self.checkbox or lowered in ("checked", "unchecked")
+        if "date" in self.candidates and not DATE_PATTERN.match(value):
+            self.candidates.discard("date")
+        if "float" in self.candidates:
+            try:
+                float(value)
+            except ValueError:
+                self.candidates.discard("float")
+
+    @property
+    def kind(self):
+        if "tristate" in self.candidates and self.answered:
+            return "checkbox" if self.checkbox else "tristate"
+        if "date" in self.candidates and self.present:
+            return "date"
+        if "float" in self.candidates:
+            return "float"
+        return "text"
+
+
+def infer_kind(values):
+    inference = KindInference()
+    for value in values:
+        inference.update(value)
+    return inference.kind
+
+
+
+
+
+# PATIENT SAMPLING ------------------------
+
+# A patient is in a sample when a stable hash of (patient_id, seed) falls below
+# the sample fraction, so every table keeps the same patients, and the same
+# fraction and seed always give the same sample
+UINT64_MASK = 0xFFFFFFFFFFFFFFFF
+GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+
+
+def patient_hash(patient_id, seed=0):
+    # SplitMix64 finaliser of the patient_id offset by the seed, as a float in [0, 1)
+    x = (int(patient_id) + (int(seed) + 1) * GOLDEN_GAMMA) & UINT64_MASK
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & UINT64_MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & UINT64_MASK
+    x ^= x >> 31
+    return (x >> 11) / 2**53
+
+
+def patient_hashes(patient_ids, seed=0):
+    # Vectorised patient_hash
+    with np.errstate(over="ignore"):
+        x = np.asarray(patient_ids, dtype=np.int64).astype(np.uint64)
+        x = x + np.uint64(((int(seed) + 1) * GOLDEN_GAMMA) & UINT64_MASK)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x = x ^ (x >> np.uint64(31))
+    return (x >> np.uint64(11)).astype(np.float64) / 2**53
+
+
+def in_sample(patient_id, fraction, seed=0):
+    return patient_hash(patient_id, seed) < fraction
+
+
+def sample_mask(patient_ids, fraction, seed=0):
+    return patient_hashes(patient_ids, seed) < fraction
+
+
+
+
+
+# TABLES ------------------------
+
+class LocalTable:
+    # A table held as one array per column, with rows sorted by patient_id.
+    # Tri-state columns stay packed until they are projected with table[name].
+
+    def __init__(self, name, columns):
+        self.name = name
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns["patient_id"])
+
+    def __contains__(self, column_name):
+        return column_name in self.columns
+
+    @property
+    def column_names(self):
+        return list(self.columns)
+
+    @property
+    def patient_id(self):
+        return self.columns["patient_id"]
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+    def __getitem__(self, column_name):
+        column = self.columns[column_name]
+        if isinstance(column, PackedTriState):
+            return column.decode()
+        return column
+
+    def take(self, indices):
+        # Copy whole rows; packed columns are gathered without being decoded
+        return LocalTable(
+            self.name, {name: column.take(indices) for name, column in self.columns.items()}
+        )
+
+    def project(self, column_names):
+        keep = ["patient_id"] + [name for name in column_names if name != "patient_id"]
+        return LocalTable(self.name, {name: self.columns[name] for name in keep})
+
+
+def to_column(values, column_name, kind=None):
+    # kind is inferred from the values themselves when not given
+    if column_name == "patient_id":
+        return np.array([int(value) for value in values], dtype=np.int64)
+    kind = kind or infer_kind(values)
+
+    if kind in ("tristate", "checkbox"):
+        labels = CHECKBOX_LABELS if kind == "checkbox" else YES_NO_LABELS
+        return PackedTriState.from_codes(tristate_codes(values, column_name), labels)
+
+    if kind == "date":
+        return np.array(
+            [value if value not in MISSING_VALUES else "NaT" for value in values],
+            dtype="datetime64[D]",
+        )
+
+    if kind == "float":
+        return np.array(
+            [float(value) if value not in MISSING_VALUES else np.nan for value in values],
+            dtype=np.float64,
+        )
+
+    # Interning shares one string object between repeated values
+    return np.array(
+        [sys.intern(value) if value not in MISSING_VALUES else None for value in values],
+        dtype=object,
+    )
+
+
+def load_table(path, name=None, columns=None, patient_ids=None, sample=None, schema=None):
+    # columns prunes unreferenced columns and patient_ids (a semi-join with the
+    # population) drops other patients' rows, both while reading, so memory
+    # scales with what is used rather than with the raw file. sample is a
+    # (fraction, seed) pair keeping only patients in that hash sample. Column
+    # kinds come from schema ({column: kind}), then the declared kinds, and
+    # are otherwise inferred from every row of the file, kept or not.
+    name = name or path.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+    if patient_ids is not None:
+        patient_ids = {int(patient_id) for patient_id in patient_ids}
+    sampled = {}
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        wanted = [
+            (i, column_name)
+            for i, column_name in enumerate(header)
+            if columns is None or column_name in columns or column_name == "patient_id"
+        ]
+        kinds = column_kinds(name, [column_name for _, column_name in wanted], schema)
+        inferences = [
+            (i, KindInference()) for i, column_name in wanted if column_name in kinds and kinds[column_name] is None
+        ]
+        patient_position = header.index("patient_id")
+        raw = {column_name: [] for _, column_name in wanted}
+        for row in reader:
+            for i, inference in inferences:
+                inference.update(row[i])
+            if patient_ids is not None and int(row[patient_position]) not in patient_ids:
+                continue
+            if sample is not None:
+                patient_id = row[patient_position]
+                if patient_id not in sampled:
+                    sampled[patient_id] = in_sample(patient_id, *sample)
+                if not sampled[patient_id]:
+                    continue
+            for i, column_name in wanted:
+                raw[column_name].append(row[i])
+    kinds.update({header[i]: inference.kind for i, inference in inferences})
+
+    table = LocalTable(
+        name,
+        {column_name: to_column(values, column_name, kinds.get(column_name)) for column_name, values in raw.items()},
+    )
+
+    # Keep each patient's rows contiguous for the per-patient operations
+    order = np.argsort(table.patient_id, kind="stable")
+    if np.any(order != np.arange(len(order))):
+        table = table.take(order)
+    return table
+
+
+def load_isaric(path="dummy-tables/isaric_raw.csv", columns=None, patient_ids=None, sample=None):
+    return load_table(path, name="isaric", columns=columns, patient_ids=patient_ids, sample=sample)
@@ -0,0 +1,285 @@
+################################################################################
+#
+# Description: This script runs per-patient operations from local_engine.py
+#              (e.g. first_for_patient for sort_by(...).first_for_patient())
+#              within a memory budget, for tables too large to load at once:
+#             - if the table is estimated to fit, it is processed in memory
+#             - otherwise its rows are hash-partitioned by patient_id into
+#               temporary files while streaming, so each partition fits the
+#               budget and holds every row for its patients; column kinds
+#               are inferred once over the whole file and shared by every
+#               partition, and a warning is given if more than MAX_PARTITIONS
+#               partitions would be needed to fit the budget
+#             - each partition's result is spilled as a patient-sorted run of
+#               memory-mapped .npy columns
+#             - the runs are combined with an external merge on patient_id,
+#               streaming rows to the output
+#
+#              Usage:
+#                python analysis/memory_budget.py dummy-tables/clinical_events.csv \
+#                  output.csv.gz --sort-by date --memory-budget 512M
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import csv
+import heapq
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import warnings
+from argparse import ArgumentParser
+
+import numpy as np
+
+from local_engine import first_for_patient, top_k_table
+from local_tables import KindInference, PackedTriState, column_kinds, load_table
+from output_io import write_csv
+
+
+
+
+
+# BUDGET ------------------------
+
+# Parsing a CSV holds every field as a Python string before it is typed, so the
+# peak is several times the file size
+CSV_EXPANSION_FACTOR = 8
+
+# Keeps the number of open partition files within usual descriptor limits
+MAX_PARTITIONS = 256
+
+UNITS = {"K": 2**10, "M": 2**20, "G": 2**30}
+
+
+def parse_size(text):
+    # "512M", "2G" or a number of bytes
+    text = str(text).strip().upper().rstrip("B")
+    if text and text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def estimated_bytes(path):
+    return os.path.getsize(path) * CSV_EXPANSION_FACTOR
+
+
+def partitions_needed(path, memory_budget):
+    needed = max(1, -(-estimated_bytes(path) // memory_budget))
+    if needed > MAX_PARTITIONS:
+        warnings.warn(
+            f"{path} needs {needed} partitions to fit a {memory_budget} byte budget, but at most "
+            f"{MAX_PARTITIONS} are used, so each partition may use up to "
+            f"{estimated_bytes(path) // MAX_PARTITIONS} bytes",
+            RuntimeWarning,
+        )
+    return min(MAX_PARTITIONS, needed)
+
+
+def partition_of(patient_id, n_partitions):
+    # Multiplicative hash so that runs of consecutive ids spread evenly
+    return ((patient_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) % n_partitions
+
+
+
+
+
+# PARTITIONING ------------------------
+
+def partition_csv(path, directory, n_partitions, name, patient_ids=None):
+    # One streaming pass writing each row to its patient's partition file.
+    # Returns the partition paths and one schema ({column: kind}) for all of
+    # them, with undeclared kinds inferred from every row of the file, so every
+    # partition is typed the same way.
+    if patient_ids is not None:
+        patient_ids = {int(patient_id) for patient_id in patient_ids}
+    paths = [os.path.join(directory, f"partition_{i:03d}.csv") for i in range(n_partitions)]
+    files = [open(partition_path, "w", newline="") for partition_path in paths]
+    try:
+        with open(path, newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            patient_position = header.index("patient_id")
+            schema = column_kinds(name, header)
+            inferences = [
+                (i, KindInference()) for i, column_name in enumerate(header) if schema.get(column_name, "") is None
+            ]
+            writers = [csv.writer(partition_file) for partition_file in files]
+            for writer in writers:
+                writer.writerow(header)
+            for row in reader:
+                for i, inference in inferences:
+                    inference.update(row[i])
+                patient_id = int(row[patient_position])
+                if patient_ids is not None and patient_id not in patient_ids:
+                    continue
+                writers[partition_of(patient_id, n_partitions)].writerow(row)
+    finally:
+        for partition_file in files:
+            partition_file.close()
+    schema.update({header[i]: inference.kind for i, inference in inferences})
+    return paths, schema
+
+
+
+
+
+# SORTED RUNS ------------------------
+
+def encode_columns(table):
+    # Text (and packed tri-state) columns become integer codes into a
+    # vocabulary, so every column is a plain array that can be memory-mapped
+    columns, vocabularies = {}, {}
+    for name, column in table.columns.items():
+        if isinstance(column, PackedTriState):
+            column = column.decode()
+        if column.dtype.kind == "O":
+            present = np.array([value is not None for value in column], dtype=bool)
+            vocabulary, codes = np.unique(column[present].astype(str), return_inverse=True)
+            values = np.full(len(column), -1, dtype=np.int64)
+            values[present] = codes
+            vocabularies[name] = vocabulary.tolist()
+            column = values
+        columns[name] = column
+    return columns, vocabularies
+
+
+def save_run(table, directory):
+    # One .npy file per column so the run can be memory-mapped column by column
+    os.makedirs(directory, exist_ok=True)
+    columns, vocabularies = encode_columns(table)
+    for position, column in enumerate(columns.values()):
+        np.save(os.path.join(directory, f"{position:04d}.npy"), column)
+    with open(os.path.join(directory, "columns.json"), "w") as f:
+        json.dump({"columns": list(columns), "vocabularies": vocabularies}, f)
+    return directory
+
+
+class Run:
+    # A patient-sorted result, usually spilled and read back through memory maps
+
+    def __init__(self, columns, vocabularies):
+        self.columns = columns
+        self.vocabularies = vocabularies
+
+    @classmethod
+    def from_table(cls, table):
+        return cls(*encode_columns(table))
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, "columns.json")) as f:
+            metadata = json.load(f)
+        columns = {
+            name: np.load(os.path.join(directory, f"{position:04d}.npy"), mmap_mode="r")
+            for position, name in enumerate(metadata["columns"])
+        }
+        return cls(columns, metadata["vocabularies"])
+
+    def __len__(self):
+        return len(self.columns["patient_id"])
+
+    def row(self, index):
+        values = {}
+        for name, column in self.columns.items():
+            value = column[index]
+            if name in self.vocabularies:
+                value = self.vocabularies[name][value] if value >= 0 else None
+            elif column.dtype.kind == "M":
+                value = None if np.isnat(value) else str(value)
+            elif column.dtype.kind == "f":
+                value = None if np.isnan(value) else float(value)
+            else:
+                value = value.item()
+            values[name] = value
+        return values
+
+    def keyed_rows(self, run_index):
+        # (patient_id, run, row) in patient order, read a block at a time
+        patient_id = self.columns["patient_id"]
+        block = 65536
+        for start in range(0, len(patient_id), block):
+            ids = np.asarray(patient_id[start:start + block]).tolist()
+            for offset, value in enumerate(ids):
+                yield value, run_index, start + offset
+
+
+def merge_runs(runs):
+    # External merge: only the current row of each run is held in memory
+    for _, run_index, row_index in heapq.merge(*(run.keyed_rows(i) for i, run in enumerate(runs))):
+        yield runs[run_index].row(row_index)
+
+
+
+
+
+# EXECUTION ------------------------
+
+def run_with_budget(path, operation, memory_budget, name=None, columns=None, patient_ids=None, temp_dir=None):
+    # Yields the rows of operation(table) in patient order, where operation maps
+    # a LocalTable to a patient-sorted LocalTable and only needs each patient's
+    # own rows (true of every per-patient operation)
+    name = name or path.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+    n_partitions = partitions_needed(path, memory_budget)
+    if n_partitions == 1:
+        result = operation(load_table(path, name=name, columns=columns, patient_ids=patient_ids))
+        yield from merge_runs([Run.from_table(result)])
+        return
+
+    directory = tempfile.mkdtemp(dir=temp_dir)
+    try:
+        partition_paths, schema = partition_csv(path, directory, n_partitions, name, patient_ids)
+        runs = []
+        for i, partition_path in enumerate(partition_paths):
+            partition = load_table(partition_path, name=name, columns=columns, schema=schema)
+            os.remove(partition_path)
+            runs.append(Run.load(save_run(operation(partition), os.path.join(directory, f"run_{i:03d}"))))
+            del partition
+        yield from merge_runs(runs)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+
+
+
+# MAIN ------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--sort-by", nargs="+", required=True)
+    parser.add_argument("--k", type=int, default=1, help="rows to keep per patient")
+    parser.add_argument("--last", action="store_true")
+    parser.add_argument("--columns", nargs="*", help="columns to read (default: all)")
+    parser.add_argument("--memory-budget", default="1G", help="e.g. 512M, 2G")
+    parser.add_argument("--temp-dir", help="where to spill (default: system temp directory)")
+    args = parser.parse_args()
+
+    def operation(table):
+        if args.k == 1:
+            return first_for_patient(table, args.sort_by, last=args.last)
+        return top_k_table(table, args.sort_by, args.k, last=args.last)
+
+    rows = run_with_budget(
+        args.input, operation, parse_size(args.memory_budget),
+        columns=args.columns and args.columns + args.sort_by, temp_dir=args.temp_dir,
+    )
+    first = next(rows, None)
+    fieldnames = list(first) if first else ["patient_id"]
+    rows = itertools.chain([first] if first else [], rows)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    if args.output.endswith(".gz"):
+        write_csv(args.output, fieldnames, rows)
+    else:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
@@ -0,0 +1,285 @@
+################################################################################
+#
+# Description: This script contains functions for reading and writing the
+#              csv.gz outputs of each action using several cores:
+#             - Writing block gzip: the data is cut into fixed-size blocks that
+#               are compressed on a thread pool and written as consecutive gzip
+#               members. Any standard gzip reader (gzip, zcat, readr) reads the
+#               result as one file. Each member records its own size in a gzip
+#               extra field (as in BGZF) so that readers can find block
+#               boundaries without decompressing. An empty member ends every
+#               file, so an output with no rows is still valid gzip.
+#             - Reading with parallel decompression for block gzip files, and
+#               with decompression pipelined on a background thread for any
+#               other gzip file
+#             - Redacting and rounding released counts
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import csv
+import io
+import os
+import queue
+import struct
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+
+
+
+# BLOCK GZIP FORMAT ------------------------
+
+# Uncompressed bytes per gzip member
+BLOCK_SIZE = 1 << 20
+
+# Gzip extra subfield holding the total size of the member in bytes
+SUBFIELD_ID = b"IE"
+
+HEADER_SIZE = 10 + 2 + 8  # fixed header, XLEN, one subfield with a 4-byte payload
+TRAILER_SIZE = 8
+
+FEXTRA = 0x04
+
+
+def default_threads():
+    return max(1, os.cpu_count() or 1)
+
+
+def compress_block(data, level):
+    # zlib releases the GIL while compressing, so blocks compress in parallel
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    member_size = HEADER_SIZE + len(deflated) + TRAILER_SIZE
+    header = (
+        b"\x1f\x8b\x08" + bytes([FEXTRA]) + b"\x00\x00\x00\x00" + b"\x00\xff"
+        + struct.pack("<H", 8) + SUBFIELD_ID + struct.pack("<HI", 4, member_size)
+    )
+    trailer = struct.pack("<II", zlib.crc32(data), len(data) & 0xFFFFFFFF)
+    return header + deflated + trailer
+
+
+def decompress_member(member):
+    flags = member[3]
+    xlen = struct.unpack("<H", member[10:12])[0]
+    data = zlib.decompress(member[12 + xlen : -TRAILER_SIZE], -15)
+    crc, size = struct.unpack("<II", member[-TRAILER_SIZE:])
+    if flags & ~FEXTRA or zlib.crc32(data) != crc or len(data) & 0xFFFFFFFF != size:
+        raise OSError("Corrupt block gzip member")
+    return data
+
+
+def member_size(header):
+    # Returns the size recorded in a block gzip member header, or None if the
+    # header was not written by this module
+    if len(header) < HEADER_SIZE or header[:3] != b"\x1f\x8b\x08" or header[3] != FEXTRA:
+        return None
+    xlen = struct.unpack("<H", header[10:12])[0]
+    if xlen != 8 or header[12:14] != SUBFIELD_ID:
+        return None
+    return struct.unpack("<HI", header[14:20])[1]
+
+
+
+
+
+# WRITING ------------------------
+
+class BlockGzipWriter(io.RawIOBase):
+    # Binary file object that compresses blocks on a thread pool and writes
+    # them in order, keeping at most 2 blocks per thread in flight
+
+    def __init__(self, path, threads=None, level=6, block_size=BLOCK_SIZE):
+        self.file = open(path, "wb")
+        self.threads = threads or default_threads()
+        self.level = level
+        self.block_size = block_size
+        self.executor = ThreadPoolExecutor(self.threads)
+        self.pending = deque()
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self.submit(bytes(self.buffer[: self.block_size]))
+            del self.buffer[: self.block_size]
+        return len(data)
+
+    def submit(self, block):
+        self.pending.append(self.executor.submit(compress_block, block, self.level))
+        while len(self.pending) > 2 * self.threads:
+            self.file.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.buffer:
+                self.submit(bytes(self.buffer))
+                self.buffer.clear()
+            while self.pending:
+                self.file.write(self.pending.popleft().result())
+            # An empty member marks the end of the file (as the BGZF EOF
+            # block does), and keeps a file with no rows a valid gzip file
+            self.file.write(compress_block(b"", self.level))
+        finally:
+            self.executor.shutdown()
+            self.file.close()
+            super().close()
+
+
+
+
+
+# READING ------------------------
+
+def indexed_chunks(f, threads):
+    # Decompress block gzip members on a thread pool, yielding them in order
+    with ThreadPoolExecutor(threads) as executor:
+        pending = deque()
+        while True:
+            header = f.read(HEADER_SIZE)
+            if not header:
+                break
+            size = member_size(header)
+            if size is None:
+                raise OSError("Block gzip file contains a member without a size field")
+            pending.append(executor.submit(decompress_member, header + f.read(size - HEADER_SIZE)))
+            if len(pending) > 2 * threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def pipelined_chunks(f, read_size=BLOCK_SIZE):
+    # Decompress any gzip file (including multi-member files) on a background
+    # thread so that decompression overlaps with parsing in the caller. If the
+    # caller stops early, the stop event ends the thread rather than leaving it
+    # blocked on a full queue.
+    chunks = queue.Queue(maxsize=8)
+    done = object()
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            decompressor = zlib.decompressobj(31)
+            while True:
+                data = f.read(read_size)
+                if not data:
+                    break
+                while data:
+                    if not put(decompressor.decompress(data)):
+                        return
+                    data = decompressor.unused_data
+                    if decompressor.eof:
+                        decompressor = zlib.decompressobj(31)
+                    else:
+                        data = b""
+            put(done)
+        except Exception as error:
+            put(error)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        stop.set()
+        thread.join()
+
+
+class ChunkReader(io.RawIOBase):
+    # Binary file object over an iterator of decompressed chunks
+
+    def __init__(self, f, chunks):
+        self.file = f
+        self.chunks = chunks
+        self.current = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.current:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.current = memoryview(chunk)
+        n = min(len(buffer), len(self.current))
+        buffer[:n] = self.current[:n]
+        self.current = self.current[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            # Finish the chunk generator (and any thread feeding it) before
+            # closing the file it reads from
+            self.chunks.close()
+            self.file.close()
+            super().close()
+
+
+def open_output(path, mode="rt", threads=None, level=6):
+    # Open a csv.gz output for reading ("rt"/"rb") or block gzip writing ("wt"/"wb")
+    threads = threads or default_threads()
+    if mode[0] == "w":
+        raw = BlockGzipWriter(path, threads=threads, level=level)
+    else:
+        f = open(path, "rb")
+        indexed = member_size(f.read(HEADER_SIZE)) is not None
+        f.seek(0)
+        chunks = indexed_chunks(f, threads) if indexed else pipelined_chunks(f)
+        raw = ChunkReader(f, chunks)
+    buffered = io.BufferedWriter(raw) if mode[0] == "w" else io.BufferedReader(raw)
+    if "b" in mode:
+        return buffered
+    return io.TextIOWrapper(buffered, encoding="utf-8", newline="")
+
+
+def write_csv(path, fieldnames, rows, threads=None, level=6):
+    with open_output(path, "wt", threads=threads, level=level) as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+
+
+
+# DISCLOSURE CONTROL ------------------------
+
+# As in validation_report_data.R: counts at or below the threshold are
+# redacted and every other count is rounded to the nearest multiple of 10
+REDACTION_THRESHOLD = 7
+ROUNDING = 10
+
+
+def redact_and_round(count, threshold=REDACTION_THRESHOLD, rounding=ROUNDING):
+    if count <= threshold:
+        return "redacted"
+    return int(round(count / rounding) * rounding)
@@ -0,0 +1,418 @@
+################################################################################
+#
+# Description: This script keeps a local history of benchmark timings so that
+#              slowdowns in the helpers are caught before they reach production
+#              extracts:
+#             - "record" runs the benchmarks (local engine operations, ehrql
+#               generate-dataset runs of each dataset definition, and each
+#               variable of each definition on its own, as built by the
+#               variables.py helpers) on generated dummy tables of a given
+#               size, repeating each to measure variation, and appends wall
+#               times, peak memory, the git commit and the data scale to the
+#               history file as each benchmark finishes
+#             - "compare" compares the latest record for a commit against a
+#               baseline commit and flags slowdowns above a threshold (10% by
+#               default) whose confidence interval excludes no change; it exits
+#               with status 1 if any are found
+#
+#              The definition and variable benchmarks need ehrql installed;
+#              without it they are skipped. A definition's peak memory is the
+#              peak resident size of the ehrql process. A variable is evaluated
+#              with the population by ehrQL's local file query engine, so its
+#              time includes reading the tables it uses; the population-only
+#              benchmark (variable.<definition>.population) is the baseline.
+#
+#              Usage:
+#                python analysis/perf_history.py record --patients 100000
+#                python analysis/perf_history.py compare --baseline <commit>
+#
+# Output: output/perf/history.jsonl
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import importlib.util
+import json
+import math
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+
+import numpy as np
+
+from generate_dummy_tables import generate
+from interval_index import IntervalIndex
+from explain_definition import dataset_variables, load_dataset
+from local_engine import first_for_patient
+from local_tables import load_table
+from registration_spells import RegistrationSpells
+from time_to_event import follow_up_table
+
+
+
+
+
+# BENCHMARKS ------------------------
+
+DEFAULT_HISTORY = "output/perf/history.jsonl"
+ANALYSIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Context:
+    # Tables for one data scale, loaded on first use and shared by benchmarks
+    # (loading is only timed by the load benchmark itself)
+
+    def __init__(self, tables_dir):
+        self.tables_dir = tables_dir
+        self.tables = {}
+        self.outputs = None
+
+    def output_dir(self):
+        # Scratch directory for dataset definition outputs
+        if self.outputs is None:
+            self.outputs = tempfile.TemporaryDirectory()
+        return self.outputs.name
+
+    def close(self):
+        if self.outputs is not None:
+            self.outputs.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tables_dir, f"{name}.csv")
+
+    def table(self, name):
+        if name not in self.tables:
+            self.tables[name] = load_table(self.path(name), name=name)
+        return self.tables[name]
+
+    def index_dates(self):
+        # First ISARIC admission date (hostdat) per ISARIC patient
+        isaric = self.table("isaric_raw")
+        first = first_for_patient(isaric, ["hostdat"])
+        return first.patient_id, first["hostdat"]
+
+
+def bench_load_clinical_events(context):
+    return lambda: load_table(context.path("clinical_events"), name="clinical_events")
+
+
+def bench_first_for_patient(context):
+    events = context.table("clinical_events")
+    return lambda: first_for_patient(events, ["date", "snomedct_code"])
+
+
+def bench_registration_spells(context):
+    registrations = context.table("practice_registrations")
+    patient_ids, dates = context.index_dates()
+    return lambda: RegistrationSpells(registrations).at(patient_ids, dates)
+
+
+def bench_interval_index(context):
+    registrations = context.table("practice_registrations")
+    patient_ids, dates = context.index_dates()
+    return lambda: IntervalIndex.for_registrations(registrations).exists_on(patient_ids, dates)
+
+
+def bench_time_to_event(context):
+    patient_ids, dates = context.index_dates()
+    patients = context.table("patients")
+    position = np.searchsorted(patients.patient_id, patient_ids)
+    died = patients["date_of_death"][position]
+    return lambda: follow_up_table(dates, {"death": died}, end_date="2022-03-31")
+
+
+class DefinitionRun:
+    # One ehrql generate-dataset run of a dataset definition on the context's
+    # tables, in its own process; keeps the peak resident size of the process
+
+    def __init__(self, context, definition, *definition_args):
+        self.command = [
+            sys.executable, "-m", "ehrql", "generate-dataset",
+            os.path.join(ANALYSIS_DIR, definition),
+            "--dummy-tables", context.tables_dir,
+            "--output", os.path.join(context.output_dir(), f"{definition[:-3]}.csv"),
+        ]
+        if definition_args:
+            self.command += ["--", *definition_args]
+        self.peak_bytes = 0
+
+    def __call__(self):
+        with subprocess.Popen(self.command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as process:
+            stderr = process.stderr.read()
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, self.command, stderr=stderr)
+        # ru_maxrss is in KiB on Linux
+        self.peak_bytes = max(self.peak_bytes, usage.ru_maxrss * 1024)
+
+
+class VariableRun:
+    # One variable of a dataset definition, evaluated with the population by
+    # ehrQL's local file query engine
+
+    def __init__(self, engine, population, name, node):
+        self.engine = engine
+        self.variables = {"population": population}
+        if name != "population":
+            self.variables[name] = node
+
+    def __call__(self):
+        for _ in self.engine.get_results(self.variables):
+            pass
+
+
+# Dataset definitions benchmarked as a whole and per variable, with their arguments
+DEFINITIONS = {
+    "isaric": ("dataset_definition_isaric.py", []),
+    "sus_methodA": ("dataset_definition_sus.py", ["--admission_method", "A"]),
+    "sus_methodB": ("dataset_definition_sus.py", ["--admission_method", "B"]),
+    "sus_methodC": ("dataset_definition_sus.py", ["--admission_method", "C"]),
+}
+
+
+def bench_definition(definition_name):
+    definition, definition_args = DEFINITIONS[definition_name]
+
+    def bench(context):
+        return DefinitionRun(context, definition, *definition_args)
+    return bench
+
+
+def variable_benchmarks(definition_names):
+    # {"variable.<definition>.<variable>": benchmark} for every variable of the
+    # definitions (ehrQL is imported here as only these benchmarks need it)
+    from ehrql.query_engines.local_file import LocalFileQueryEngine
+
+    benchmarks = {}
+    for definition_name in definition_names:
+        definition, definition_args = DEFINITIONS[definition_name]
+        variables = dataset_variables(load_dataset(os.path.join(ANALYSIS_DIR, definition), definition_args))
+        population = variables["population"]
+        for name, node in variables.items():
+            def bench(context, name=name, node=node):
+                return VariableRun(LocalFileQueryEngine(context.tables_dir), population, name, node)
+            benchmarks[f"variable.{definition_name}.{name}"] = bench
+    return benchmarks
+
+
+BENCHMARKS = {
+    "load_table.clinical_events": bench_load_clinical_events,
+    "first_for_patient.clinical_events": bench_first_for_patient,
+    "registration_spells.at": bench_registration_spells,
+    "interval_index.registrations": bench_interval_index,
+    "time_to_event.follow_up_table": bench_time_to_event,
+    **{f"definition.{definition_name}": bench_definition(definition_name) for definition_name in DEFINITIONS},
+}
+
+# Benchmarks that run the dataset definitions, so need ehrql
+DEFINITION_BENCHMARKS = {name for name in BENCHMARKS if name.startswith("definition.")}
+
+
+def measure(run, repeats):
+    # Wall time of each repeat, and peak traced memory over one further run
+    # (tracing slows allocation, so it is kept out of the timed repeats);
+    # definition runs measure their own process instead
+    run()  # warm up
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    if isinstance(run, DefinitionRun):
+        return timings, run.peak_bytes
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return timings, peak
+
+
+
+
+
+# HISTORY ------------------------
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, bool(dirty)
+
+
+def record(history_path, patients, repeats, benchmarks=None, seed=0, tables_dir=None):
+    tables_dir = tables_dir or os.path.join(os.path.dirname(history_path), f"tables_{patients}_{seed}")
+    if not os.path.exists(os.path.join(tables_dir, "clinical_events.csv")):
+        generate(tables_dir, patients, seed=seed)
+    context = Context(tables_dir)
+    commit, dirty = git_commit()
+    recorded_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+    has_ehrql = importlib.util.find_spec("ehrql") is not None
+    available = dict(BENCHMARKS)
+    if has_ehrql:
+        available.update(variable_benchmarks(DEFINITIONS))
+    selected = [
+        name for name in available
+        if not benchmarks or any(name == prefix or name.startswith(f"{prefix}.") for prefix in benchmarks)
+    ]
+
+    # Each entry is appended as soon as it is measured, so a failing benchmark
+    # does not lose the others
+    os.makedirs(os.path.dirname(history_path) or ".", exist_ok=True)
+    entries, failed = [], []
+    try:
+        with open(history_path, "a") as f:
+            for name in selected:
+                if name in DEFINITION_BENCHMARKS and not has_ehrql:
+                    print(f"{name:<40} skipped (ehrql is not installed)")
+                    continue
+                try:
+                    timings, peak = measure(available[name](context), repeats)
+                except Exception as error:
+                    print(f"{name:<40} failed: {error!r}")
+                    failed.append(name)
+                    continue
+                entry = {
+                    "benchmark": name,
+                    "commit": commit,
+                    "dirty": dirty,
+                    "patients": patients,
+                    "recorded_at": recorded_at,
+                    "timings": timings,
+                    "peak_bytes": peak,
+                }
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                entries.append(entry)
+                print(f"{name:<40} {statistics.mean(timings):9.4f}s  {peak / 2**20:9.1f} MiB")
+            if not has_ehrql and (not benchmarks or any(prefix.startswith("variable") for prefix in benchmarks)):
+                print(f"{'variable.*':<40} skipped (ehrql is not installed)")
+    finally:
+        context.close()
+    return entries, failed
+
+
+def read_history(history_path):
+    with open(history_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def latest_by_benchmark(history, commit, patients):
+    # Latest entry per benchmark for a commit (prefix) at a data scale
+    latest = {}
+    for entry in history:
+        if entry["patients"] == patients and (commit is None or entry["commit"].startswith(commit)):
+            latest[entry["benchmark"]] = entry
+    return latest
+
+
+
+
+
+# COMPARISON ------------------------
+
+def t_quantile(p, df):
+    # Student's t quantile from the normal quantile (Cornish-Fisher expansion),
+    # accurate to a few per cent for df >= 3 without needing scipy
+    z = statistics.NormalDist().inv_cdf(p)
+    return z + (z**3 + z) / (4 * df) + (5 * z**5 + 16 * z**3 + 3 * z) / (96 * df**2)
+
+
+def relative_change(baseline, current, confidence=0.95):
+    # Change in mean time relative to the baseline mean, with a Welch interval
+    b_mean, c_mean = statistics.mean(baseline), statistics.mean(current)
+    b_var = statistics.variance(baseline) / len(baseline) if len(baseline) > 1 else 0.0
+    c_var = statistics.variance(current) / len(current) if len(current) > 1 else 0.0
+    change = (c_mean - b_mean) / b_mean
+    standard_error = math.sqrt(b_var + c_var)
+    if standard_error == 0:
+        return change, change, change
+    df = (b_var + c_var) ** 2 / (
+        (b_var**2 / (len(baseline) - 1) if len(baseline) > 1 else 0)
+        + (c_var**2 / (len(current) - 1) if len(current) > 1 else 0)
+    )
+    margin = t_quantile(1 - (1 - confidence) / 2, max(df, 1)) * standard_error / b_mean
+    return change, change - margin, change + margin
+
+
+def compare(history, baseline_commit, current_commit, patients, threshold=0.10, confidence=0.95):
+    baseline = latest_by_benchmark(history, baseline_commit, patients)
+    current = latest_by_benchmark(history, current_commit, patients)
+    rows, regressions = [], []
+    for name in sorted(set(baseline) & set(current)):
+        change, lower, upper = relative_change(
+            baseline[name]["timings"], current[name]["timings"], confidence
+        )
+        memory_change = current[name]["peak_bytes"] / max(baseline[name]["peak_bytes"], 1) - 1
+        slower = change > threshold and lower > 0
+        more_memory = memory_change > threshold
+        rows.append((name, change, lower, upper, memory_change, slower or more_memory))
+        if slower or more_memory:
+            regressions.append(name)
+    return rows, regressions
+
+
+
+
+
+# MAIN ------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record")
+    record_parser.add_argument("--patients", type=int, default=100_000, help="data scale")
+    record_parser.add_argument("--repeats", type=int, default=5)
+    record_parser.add_argument(
+        "--benchmarks", nargs="*", help="benchmark names or prefixes, e.g. variable.sus_methodA"
+    )
+    record_parser.add_argument("--seed", type=int, default=0)
+    record_parser.add_argument("--tables-dir", help="existing tables to use instead of generated ones")
+    record_parser.add_argument("--history", default=DEFAULT_HISTORY)
+
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("--baseline", required=True, help="baseline commit (prefix)")
+    compare_parser.add_argument("--current", help="commit to check (default: HEAD)")
+    compare_parser.add_argument("--patients", type=int, default=100_000)
+    compare_parser.add_argument("--threshold", type=float, default=0.10)
+    compare_parser.add_argument("--confidence", type=float, default=0.95)
+    compare_parser.add_argument("--history", default=DEFAULT_HISTORY)
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        _, failed = record(args.history, args.patients, args.repeats, args.benchmarks, args.seed, args.tables_dir)
+        sys.exit(1 if failed else 0)
+
+    current = args.current or git_commit()[0]
+    rows, regressions = compare(
+        read_history(args.history), args.baseline, current, args.patients, args.threshold, args.confidence
+    )
+    if not rows:
+        sys.exit(f"No benchmarks recorded for both {args.baseline} and {current} at {args.patients} patients")
+    print(f"{'benchmark':<40} {'time change':>12} {'CI':>20} {'memory':>8}")
+    for name, change, lower, upper, memory_change, flagged in rows:
+        flag = "  REGRESSION" if flagged else ""
+        print(
+            f"{name:<40} {100 * change:>+11.1f}% [{100 * lower:+7.1f}%, {100 * upper:+7.1f}%]"
+            f" {100 * memory_change:>+7.1f}%{flag}"
+        )
+    sys.exit(1 if regressions else 0)
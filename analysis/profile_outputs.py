@@ -0,0 +1,344 @@
+################################################################################
+#
+# Description: This script profiles extract outputs in a single streaming pass,
+#              as a constant-memory alternative to os_skim() and
+#              data_properties.R. Each file is read once, in chunks, and for
+#              each column it records:
+#             - the number of rows and the null rate
+#             - the inferred type (boolean, integer, numeric, date, character)
+#             - min/max
+#             - a distinct count estimate (HyperLogLog)
+#             - approximate quantiles (KLL sketch)
+#             - the most common categories (Misra-Gries)
+#              Row, distinct and category counts are redacted at or below 7
+#              and otherwise rounded to the nearest 10, as in
+#              validation_report_data.R.
+#              All of these are mergeable, so profiles of chunks, shards or
+#              files can be combined with ColumnProfile.merge().
+#
+# Input: output/admissions/*.csv.gz (or any list of csv/csv.gz files)
+#
+# Output: output/data_properties/*_profile.json
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import csv
+import datetime
+import glob
+import hashlib
+import json
+import math
+import os
+import random
+import re
+from argparse import ArgumentParser
+from itertools import islice
+
+from output_io import REDACTION_THRESHOLD, ROUNDING, open_output, redact_and_round
+
+
+
+
+
+# SKETCHES ------------------------
+
+class HyperLogLog:
+    # Distinct count estimate with 2**precision one-byte registers
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def update(self, value):
+        h = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            return round(m * math.log(m / zeros))
+        return round(raw)
+
+
+class KLLSketch:
+    # Approximate quantiles from a hierarchy of compactors (Karnin, Lang & Liberty)
+
+    def __init__(self, k=200, seed=0):
+        self.k = k
+        self.compactors = [[]]
+        self.random = random.Random(seed)
+
+    def capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return max(2, int(math.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, value):
+        self.compactors[0].append(value)
+        if len(self.compactors[0]) >= self.capacity(0):
+            self.compress()
+
+    def compress(self):
+        for level in range(len(self.compactors)):
+            if len(self.compactors[level]) >= self.capacity(level):
+                if level + 1 == len(self.compactors):
+                    self.compactors.append([])
+                items = sorted(self.compactors[level])
+                # An odd item out stays at this level
+                keep = [items.pop()] if len(items) % 2 else []
+                offset = self.random.randint(0, 1)
+                self.compactors[level + 1].extend(items[offset::2])
+                self.compactors[level] = keep
+
+    def merge(self, other):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for level, items in enumerate(other.compactors):
+            self.compactors[level].extend(items)
+        self.compress()
+
+    def quantiles(self, probabilities):
+        weighted = sorted(
+            (value, 2 ** level) for level, items in enumerate(self.compactors) for value in items
+        )
+        total = sum(weight for _, weight in weighted)
+        if not total:
+            return [None for _ in probabilities]
+        results = []
+        for p in probabilities:
+            target = p * total
+            cumulative = 0
+            for value, weight in weighted:
+                cumulative += weight
+                if cumulative >= target:
+                    results.append(value)
+                    break
+        return results
+
+
+class MisraGries:
+    # Frequent items using at most `size` counters; counts are lower bounds
+
+    def __init__(self, size=100):
+        self.size = size
+        self.counts = {}
+
+    def update(self, value, n=1):
+        if value in self.counts or len(self.counts) < self.size:
+            self.counts[value] = self.counts.get(value, 0) + n
+            return
+        # Decrement every counter, dropping those that reach zero
+        self.counts = {key: count - n for key, count in self.counts.items() if count > n}
+
+    def merge(self, other):
+        for value, count in other.counts.items():
+            self.counts[value] = self.counts.get(value, 0) + count
+        if len(self.counts) > self.size:
+            cutoff = sorted(self.counts.values(), reverse=True)[self.size]
+            self.counts = {key: count - cutoff for key, count in self.counts.items() if count > cutoff}
+
+    def top(self, k):
+        return sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+
+
+
+
+# COLUMN PROFILES ------------------------
+
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+INTEGER_PATTERN = re.compile(r"^-?\d+$")
+BOOLEAN_VALUES = {"T", "F"}
+MISSING_VALUES = {"", "NA"}
+
+# Types from least to most general; a column takes the most general type seen
+TYPE_ORDER = ["boolean", "integer", "numeric", "date", "character"]
+
+
+def classify(value):
+    # Returns (type, value on a numeric scale or None)
+    if value in BOOLEAN_VALUES:
+        return "boolean", None
+    if INTEGER_PATTERN.match(value):
+        return "integer", int(value)
+    if DATE_PATTERN.match(value):
+        try:
+            return "date", datetime.date.fromisoformat(value).toordinal()
+        except ValueError:
+            return "character", None
+    try:
+        number = float(value)
+    except ValueError:
+        return "character", None
+    return ("numeric", number) if math.isfinite(number) else ("character", None)
+
+
+class ColumnProfile:
+
+    def __init__(self, name):
+        self.name = name
+        self.n = 0
+        self.n_missing = 0
+        self.types = {}
+        self.minimum = None
+        self.maximum = None
+        self.distinct = HyperLogLog()
+        self.quantile_sketch = KLLSketch()
+        self.categories = MisraGries()
+
+    def update(self, value):
+        self.n += 1
+        if value in MISSING_VALUES:
+            self.n_missing += 1
+            return
+        kind, number = classify(value)
+        self.types[kind] = self.types.get(kind, 0) + 1
+        self.distinct.update(value)
+        if number is not None:
+            self.minimum = number if self.minimum is None else min(self.minimum, number)
+            self.maximum = number if self.maximum is None else max(self.maximum, number)
+            self.quantile_sketch.update(number)
+        else:
+            self.categories.update(value)
+
+    def merge(self, other):
+        self.n += other.n
+        self.n_missing += other.n_missing
+        for kind, count in other.types.items():
+            self.types[kind] = self.types.get(kind, 0) + count
+        for attribute, pick in (("minimum", min), ("maximum", max)):
+            mine, theirs = getattr(self, attribute), getattr(other, attribute)
+            setattr(self, attribute, theirs if mine is None else mine if theirs is None else pick(mine, theirs))
+        self.distinct.merge(other.distinct)
+        self.quantile_sketch.merge(other.quantile_sketch)
+        self.categories.merge(other.categories)
+
+    @property
+    def type(self):
+        if not self.types:
+            return None
+        kinds = set(self.types)
+        if kinds <= {"integer", "numeric"}:
+            return "numeric" if "numeric" in kinds else "integer"
+        if len(kinds) == 1:
+            return kinds.pop()
+        return "character"
+
+    def summary(
+        self, probabilities=(0.1, 0.25, 0.5, 0.75, 0.9), top_k=10,
+        redaction_threshold=REDACTION_THRESHOLD, rounding=ROUNDING,
+    ):
+        column_type = self.type
+        summary = {
+            "type": column_type,
+            "n": redact_and_round(self.n, redaction_threshold, rounding),
+            "null_rate": self.n_missing / self.n if self.n else None,
+            "distinct_estimate": redact_and_round(self.distinct.estimate(), redaction_threshold, rounding),
+        }
+        if column_type in ("integer", "numeric", "date"):
+            quantiles = self.quantile_sketch.quantiles(probabilities)
+            as_output = date_from_ordinal if column_type == "date" else (lambda value: value)
+            summary["min"] = as_output(self.minimum)
+            summary["max"] = as_output(self.maximum)
+            summary["quantiles"] = {
+                f"p{round(p * 100)}": as_output(value) for p, value in zip(probabilities, quantiles)
+            }
+        else:
+            # Category counts are lower bounds, redacted and rounded like the others
+            summary["top_categories"] = [
+                {"value": value, "n": redact_and_round(count, redaction_threshold, rounding)}
+                for value, count in self.categories.top(top_k)
+            ]
+        return summary
+
+
+def date_from_ordinal(value):
+    return None if value is None else datetime.date.fromordinal(value).isoformat()
+
+
+
+
+
+# FUNCTIONS ------------------------
+
+def open_extract(path):
+    if path.endswith(".gz"):
+        return open_output(path, "rt")
+    return open(path, newline="")
+
+
+def profile_chunk(header, rows):
+    profiles = [ColumnProfile(name) for name in header]
+    for row in rows:
+        for profile, value in zip(profiles, row):
+            profile.update(value)
+    return profiles
+
+
+def profile_file(path, chunk_size=100_000, skip_suffix="_id"):
+    # Profile one file in a single pass, merging per-chunk profiles as we go
+    with open_extract(path) as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        keep = [i for i, name in enumerate(header) if not name.endswith(skip_suffix)]
+        names = [header[i] for i in keep]
+        profiles = [ColumnProfile(name) for name in names]
+        while True:
+            chunk = [[row[i] for i in keep] for row in islice(reader, chunk_size)]
+            if not chunk:
+                break
+            for profile, chunk_profile in zip(profiles, profile_chunk(names, chunk)):
+                profile.merge(chunk_profile)
+    return profiles
+
+
+def write_profile(profiles, path, **summary_options):
+    with open(path, "w") as f:
+        json.dump({profile.name: profile.summary(**summary_options) for profile in profiles}, f, indent=2)
+
+
+
+
+
+# MAIN ------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("inputs", nargs="+", help="csv/csv.gz files or directories of them")
+    parser.add_argument("--output-dir", default=os.path.join("output", "data_properties"))
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--redaction-threshold", type=int, default=REDACTION_THRESHOLD)
+    parser.add_argument("--rounding", type=int, default=ROUNDING)
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.inputs:
+        if os.path.isdir(path):
+            paths.extend(sorted(glob.glob(os.path.join(path, "*.csv.gz"))))
+        else:
+            paths.append(path)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for path in paths:
+        filenamebase = os.path.basename(path).split(".")[0]
+        write_profile(
+            profile_file(path, chunk_size=args.chunk_size),
+            os.path.join(args.output_dir, f"{filenamebase}_profile.json"),
+            redaction_threshold=args.redaction_threshold,
+            rounding=args.rounding,
+        )
@@ -0,0 +1,176 @@
+################################################################################
+#
+# Description: This script merges each patient's practice registrations into
+#              continuous registration spells, so that moving practice (with
+#              overlapping or back-to-back registrations) does not look like a
+#              deregistration. From one spell table it derives, at any number
+#              of index dates:
+#             - whether the patient is registered (registered_*)
+#             - the end of the latest spell before the index date
+#               (prior_dereg_date_*)
+#             - the current deregistration date, i.e. the end of the latest
+#               spell (dereg_date_*, as date_deregistered_from_all_supported_practices)
+#             - continuous registration before and after the index date
+#
+#              End dates of 9999-12-31 (and any other date from 3000-01-01,
+#              as in date_deregistered_from_all_supported_practices) or missing
+#              end dates mean the registration is still open.
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import numpy as np
+
+
+
+
+
+# SPELLS ------------------------
+
+MISSING_DAY = np.iinfo(np.int64).min
+OPEN_DAY = np.iinfo(np.int64).max
+FAR_FUTURE = np.datetime64("3000-01-01").astype(np.int64)
+
+# Every real date lies in this range, which needs DAY_BITS bits with a
+# sentinel either side
+LOWEST_DAY = np.datetime64("0001-01-01").astype(np.int64)
+HIGHEST_DAY = np.datetime64("9999-12-31").astype(np.int64)
+DAY_BITS = int(HIGHEST_DAY - LOWEST_DAY + 2).bit_length()
+
+
+def to_days(column):
+    return np.asarray(column).astype("datetime64[D]").view(np.int64)
+
+
+def to_dates(days):
+    # Open (and missing) ends become NaT
+    days = np.where(days == OPEN_DAY, MISSING_DAY, days)
+    return days.view("datetime64[D]")
+
+
+class RegistrationSpells:
+
+    def __init__(self, practice_registrations, gap_days=0, start="start_date", end="end_date"):
+        # Registrations separated by at most gap_days days without cover are
+        # merged; 0 merges overlapping and back-to-back (next day) registrations
+        patient_id = np.asarray(practice_registrations.patient_id, dtype=np.int64)
+        starts = to_days(practice_registrations[start])
+        ends = to_days(practice_registrations[end])
+        ends = np.where((ends == MISSING_DAY) | (ends >= FAR_FUTURE), OPEN_DAY, ends)
+
+        keep = starts != MISSING_DAY
+        patient_id, starts, ends = patient_id[keep], starts[keep], ends[keep]
+        order = np.lexsort((starts, patient_id))
+        patient_id, starts, ends = patient_id[order], starts[order], ends[order]
+
+        # One sweep: a row starts a new spell if it is the patient's first or
+        # begins more than gap_days + 1 days after everything before it has ended
+        new_patient = np.ones(len(patient_id), dtype=bool)
+        new_patient[1:] = patient_id[1:] != patient_id[:-1]
+        covered_until = self.running_max_by_patient(ends, new_patient)
+        previous_cover = np.empty_like(covered_until)
+        previous_cover[1:] = covered_until[:-1]
+        new_spell = new_patient.copy()
+        with np.errstate(over="ignore"):
+            reach = np.where(previous_cover == OPEN_DAY, OPEN_DAY, previous_cover + 1 + gap_days)
+        new_spell[1:] |= starts[1:] > reach[1:]
+
+        spell_starts_at = np.flatnonzero(new_spell)
+        self.patient_id = patient_id[spell_starts_at]
+        self.start = starts[spell_starts_at]
+        self.end = np.maximum.reduceat(ends, spell_starts_at) if len(spell_starts_at) else ends[:0]
+
+        self.patients, self.first_spell, self.n_spells = np.unique(
+            self.patient_id, return_index=True, return_counts=True
+        )
+
+    @staticmethod
+    def running_max_by_patient(values, new_group):
+        # Cumulative maximum that restarts at each patient, in one pass: the
+        # group number in the high bits stops maxima leaking between patients.
+        # Days are clamped to the range of real dates first, with MISSING_DAY
+        # and OPEN_DAY (and anything beyond) on one sentinel either side, so
+        # the key never overflows whatever the dates or number of patients.
+        if not len(values):
+            return values
+        group = np.cumsum(new_group, dtype=np.int64) - 1
+        shifted = np.clip(values, LOWEST_DAY - 1, HIGHEST_DAY + 1) - (LOWEST_DAY - 1)
+        combined = np.maximum.accumulate((group << DAY_BITS) | shifted)
+        result = (combined & ((1 << DAY_BITS) - 1)) + (LOWEST_DAY - 1)
+        result[result < LOWEST_DAY] = MISSING_DAY
+        result[result > HIGHEST_DAY] = OPEN_DAY
+        return result
+
+    def __len__(self):
+        return len(self.patient_id)
+
+    def spell_on_or_before(self, patient_ids, dates):
+        # Index of each patient's latest spell starting on or before the date,
+        # or -1 if none (including patients with no registrations)
+        patient_ids = np.asarray(patient_ids, dtype=np.int64)
+        dates = to_days(dates)
+        result = np.full(len(patient_ids), -1, dtype=np.int64)
+        if not len(self.patients):
+            return result
+        position = np.minimum(np.searchsorted(self.patients, patient_ids), len(self.patients) - 1)
+        known = (self.patients[position] == patient_ids) & (dates != MISSING_DAY)
+        first = self.first_spell[position]
+        count = self.n_spells[position]
+        # Spells are sorted by start within each patient, so a binary search over
+        # (patient rank, start) finds the latest one starting on or before the date
+        rank = np.repeat(np.arange(len(self.patients)), self.n_spells)
+        keys = np.rec.fromarrays([rank, self.start])
+        queries = np.rec.fromarrays([position, np.where(known, dates, MISSING_DAY)])
+        found = np.searchsorted(keys, queries, side="right") - 1
+        valid = known & (found >= first) & (found < first + count)
+        result[valid] = found[valid]
+        return result
+
+    def at(self, patient_ids, dates, study_end=None):
+        # Registration status for each (patient, index date) pair
+        dates = to_days(dates)
+        spell = self.spell_on_or_before(patient_ids, dates)
+        has_spell = spell >= 0
+        spell_end = np.where(has_spell, self.end[np.maximum(spell, 0)], MISSING_DAY)
+        registered = has_spell & (spell_end >= dates)
+
+        # Latest spell ending before the index date: the spell found, unless it
+        # covers the date, in which case the one before it (for the same patient)
+        previous = spell - 1
+        previous_valid = registered & (previous >= 0) & (
+            self.patient_id[np.maximum(previous, 0)] == np.asarray(patient_ids, dtype=np.int64)
+        )
+        prior_dereg = np.where(
+            has_spell & ~registered, spell_end,
+            np.where(previous_valid, self.end[np.maximum(previous, 0)], MISSING_DAY),
+        )
+
+        follow_up_end = spell_end
+        if study_end is not None:
+            follow_up_end = np.minimum(spell_end, to_days([study_end])[0])
+        spell_start = np.where(has_spell, self.start[np.maximum(spell, 0)], MISSING_DAY)
+        return {
+            "registered": registered,
+            "prior_dereg_date": to_dates(prior_dereg),
+            "spell_start_date": to_dates(np.where(registered, spell_start, MISSING_DAY)),
+            "spell_end_date": to_dates(np.where(registered, spell_end, MISSING_DAY)),
+            "days_registered_before": np.where(registered, dates - spell_start, -1),
+            "days_registered_after": np.where(
+                registered & (follow_up_end != OPEN_DAY), follow_up_end - dates, -1
+            ),
+        }
+
+    def current_dereg_date(self, patient_ids):
+        # End of each patient's latest spell, missing if still registered
+        patient_ids = np.asarray(patient_ids, dtype=np.int64)
+        result = np.full(len(patient_ids), MISSING_DAY, dtype=np.int64)
+        if len(self.patients):
+            position = np.minimum(np.searchsorted(self.patients, patient_ids), len(self.patients) - 1)
+            known = self.patients[position] == patient_ids
+            last = self.first_spell[position] + self.n_spells[position] - 1
+            result[known] = self.end[last[known]]
+        return to_dates(result)
@@ -0,0 +1,92 @@
+################################################################################
+#
+# Description: This script writes a deterministic patient-hash sample of every
+#              table in a dummy tables directory, so that dataset definitions
+#              can be debugged on a fraction of the patients (ehrQL cannot hash
+#              patient_id itself, so the sample is taken from the tables):
+#             - a patient is kept when the hash of their patient_id and the
+#               seed falls below the fraction (local_tables.in_sample), so
+#               every table keeps the same patients and joins between ISARIC,
+#               SUS and primary care tables stay coherent
+#             - the same fraction and seed always give the same patients
+#
+#              Usage:
+#                python analysis/sample_tables.py dummy-tables/synthetic \
+#                  dummy-tables/sample --sample-fraction 0.01 --sample-seed 1
+#                ehrql generate-dataset analysis/dataset_definition_isaric.py \
+#                  --dummy-tables dummy-tables/sample --output ...
+#
+#              The local engine takes the same sample at its base-table scans
+#              (ScanPlan(sample=(fraction, seed)), load_table(..., sample=...)).
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import csv
+import os
+from argparse import ArgumentParser
+
+from local_tables import in_sample
+
+
+
+
+
+# SAMPLING ------------------------
+
+def sample_table(input_path, output_path, fraction, seed=0, sampled=None):
+    # sampled caches decisions by patient_id string across tables
+    sampled = {} if sampled is None else sampled
+    kept = read = 0
+    with open(input_path, newline="") as source, open(output_path, "w", newline="") as target:
+        reader = csv.reader(source)
+        writer = csv.writer(target)
+        header = next(reader)
+        writer.writerow(header)
+        patient_position = header.index("patient_id")
+        for row in reader:
+            read += 1
+            patient_id = row[patient_position]
+            if patient_id not in sampled:
+                sampled[patient_id] = in_sample(patient_id, fraction, seed)
+            if sampled[patient_id]:
+                writer.writerow(row)
+                kept += 1
+    return kept, read
+
+
+def sample_tables(input_dir, output_dir, fraction, seed=0):
+    os.makedirs(output_dir, exist_ok=True)
+    sampled = {}
+    counts = {}
+    for file_name in sorted(os.listdir(input_dir)):
+        if file_name.endswith(".csv"):
+            counts[file_name] = sample_table(
+                os.path.join(input_dir, file_name), os.path.join(output_dir, file_name),
+                fraction, seed, sampled,
+            )
+    return counts
+
+
+
+
+
+# MAIN ------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--sample-fraction", type=float, required=True)
+    parser.add_argument("--sample-seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if not 0 < args.sample_fraction <= 1:
+        parser.error("--sample-fraction must be in (0, 1]")
+    counts = sample_tables(args.input_dir, args.output_dir, args.sample_fraction, args.sample_seed)
+    for file_name, (kept, read) in counts.items():
+        print(f"{file_name}: kept {kept} of {read} rows")
@@ -0,0 +1,106 @@
+################################################################################
+#
+# Description: This script splits the output of dataset_definition_sus_sweep.py
+#              into one file per grid point (admission method and study window)
+#              in one streaming pass:
+#             - a patient is written to a variant's file if they have a first
+#               admission date for that variant
+#             - the variant's columns lose their _<method>_<start>_<end> suffix
+#               (and comorbidities their _first_admission_date_sus index name),
+#               so each file has the column names of the single-variant
+#               extract (dataset_definition_sus.py), alongside the shared
+#               columns, plus first_admission_date_isaric and one
+#               isaric_within_<n>_days_sus column per matching tolerance
+#
+# Input: output/admissions/sus_sweep.csv.gz
+#
+# Output: output/admissions/sweep/sus_<method>_<start>_<end>.csv.gz
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import csv
+import os
+from argparse import ArgumentParser
+from contextlib import ExitStack
+
+from output_io import open_output
+
+
+
+
+
+# SPLITTING ------------------------
+
+INDEX_PREFIX = "first_admission_date_sus_"
+INDEX_NAME = "_first_admission_date_sus"
+
+
+def variant_suffixes(fieldnames):
+    return [name[len(INDEX_PREFIX):] for name in fieldnames if name.startswith(INDEX_PREFIX)]
+
+
+def variant_columns(fieldnames, suffixes):
+    # {suffix: {sweep column: output column}}, and the columns shared by all
+    # variants. Longer suffixes are matched first so that no variant claims
+    # another's columns.
+    ordered = sorted(suffixes, key=len, reverse=True)
+    columns = {suffix: {} for suffix in suffixes}
+    shared = []
+    for name in fieldnames:
+        suffix = next((suffix for suffix in ordered if name.endswith(f"_{suffix}")), None)
+        if suffix is None:
+            shared.append(name)
+            continue
+        output_name = name[: -len(suffix) - 1]
+        if output_name.endswith(INDEX_NAME) and output_name != INDEX_NAME[1:]:
+            output_name = output_name[: -len(INDEX_NAME)]
+        columns[suffix][name] = output_name
+    return columns, shared
+
+
+def split_sweep(input_path, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    counts = {}
+    with open_output(input_path, "rt") as f, ExitStack() as outputs:
+        reader = csv.DictReader(f)
+        suffixes = variant_suffixes(reader.fieldnames)
+        columns, shared = variant_columns(reader.fieldnames, suffixes)
+        writers = {}
+        for suffix in suffixes:
+            output = outputs.enter_context(
+                open_output(os.path.join(output_dir, f"sus_{suffix}.csv.gz"), "wt")
+            )
+            writers[suffix] = csv.DictWriter(output, fieldnames=shared + list(columns[suffix].values()))
+            writers[suffix].writeheader()
+            counts[suffix] = 0
+
+        for row in reader:
+            shared_values = {name: row[name] for name in shared}
+            for suffix in suffixes:
+                if not row[INDEX_PREFIX + suffix]:
+                    continue
+                writers[suffix].writerow(
+                    {**shared_values, **{output: row[name] for name, output in columns[suffix].items()}}
+                )
+                counts[suffix] += 1
+    return counts
+
+
+
+
+
+# MAIN ------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--input", default="output/admissions/sus_sweep.csv.gz")
+    parser.add_argument("--output-dir", default="output/admissions/sweep")
+    args = parser.parse_args()
+
+    for suffix, count in split_sweep(args.input, args.output_dir).items():
+        print(f"sus_{suffix}: {count} patients")
@@ -0,0 +1,269 @@
+################################################################################
+#
+# Description: This script materialises slim, patient-sorted slices of the
+#              large base tables once per data refresh, so that local runs read
+#              the slice instead of reducing the raw table again in every action:
+#             - clinical_events is restricted to the union of codes in every
+#               codelist defined in codelists_ehrql.py
+#             - every staged table is restricted to patients who could be in
+#               any population (anyone in ISARIC, hospital_admissions or
+#               emergency_care_attendances - a superset of each definition's
+#               population, so no qualifying rows are dropped)
+#             - slices are stored column by column (npz) with a manifest; a
+#               slice is rebuilt only when the codelist union, its source data
+#               version or the version of a population table changes
+#             - local_engine.ScanPlan(staging_dir=...) reads a table's slice
+#               instead of its raw CSV when the manifest shows the slice is
+#               current for that CSV (current_slice), and the raw CSV otherwise
+#
+# Input: dummy-tables/*.csv, codelists/*.csv
+#
+# Output: output/staging/<table>.slice.npz, output/staging/manifest.json
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import csv
+import hashlib
+import json
+import os
+from argparse import ArgumentParser
+
+import numpy as np
+
+from compile_codelists import CODELIST_MODULE, read_codelists
+from local_tables import KindInference, LocalTable, column_kinds, sample_mask, to_column
+
+
+
+
+
+# CODELIST UNION ------------------------
+
+def codelist_union(module_path=CODELIST_MODULE):
+    return set().union(*read_codelists(module_path).values())
+
+
+def codes_hash(codes):
+    return hashlib.sha256("\n".join(sorted(codes)).encode()).hexdigest()
+
+
+
+
+
+# STAGING ------------------------
+
+# Tables to stage, and the code columns whose values must be in the codelist
+# union (None keeps every row for population patients)
+STAGED_TABLES = {
+    "clinical_events": ["snomedct_code", "ctv3_code"],
+    "hospital_admissions": None,
+    "emergency_care_attendances": None,
+    "sgss_covid_all_tests": None,
+}
+
+# Bumped when the slice layout changes, so older slices are rebuilt
+SLICE_FORMAT = 2
+
+# Tables whose patients make up the union of the definitions' populations
+POPULATION_TABLES = ["isaric_raw", "hospital_admissions", "emergency_care_attendances"]
+
+def source_version(path):
+    # Size and modification time identify a refresh without reading the file
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def population_versions(source_dir, version=None):
+    # Every slice is semi-joined with the population, so a change to any
+    # population table invalidates every slice
+    return {
+        name: version or source_version(os.path.join(source_dir, f"{name}.csv"))
+        for name in POPULATION_TABLES
+        if os.path.exists(os.path.join(source_dir, f"{name}.csv"))
+    }
+
+
+def slice_key(path, union_hash, populations, version=None):
+    # What a slice was built from; a slice is current while this is unchanged
+    return {
+        "slice_format": SLICE_FORMAT,
+        "codelist_hash": union_hash,
+        "source_version": version or source_version(path),
+        "population_versions": populations,
+    }
+
+
+def read_manifest(staging_dir):
+    manifest_path = os.path.join(staging_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def current_slice(name, path, staging_dir, version=None):
+    # True if the staged slice of the table at path is current, i.e. it was
+    # built from this file, population tables and codelist union
+    if name not in STAGED_TABLES or not os.path.exists(slice_path(staging_dir, name)):
+        return False
+    entry = read_manifest(staging_dir).get(name)
+    if entry is None or not os.path.exists(path):
+        return False
+    current = slice_key(
+        path, codes_hash(codelist_union()), population_versions(os.path.dirname(path), version), version
+    )
+    return all(entry.get(key) == value for key, value in current.items())
+
+
+def population_patients(source_dir):
+    patients = set()
+    for name in POPULATION_TABLES:
+        path = os.path.join(source_dir, f"{name}.csv")
+        if not os.path.exists(path):
+            continue
+        with open(path, newline="") as f:
+            reader = csv.reader(f)
+            position = next(reader).index("patient_id")
+            patients.update(int(row[position]) for row in reader)
+    return patients
+
+
+def read_slice(path, name, patients, code_columns=None, codes=None):
+    # One streaming pass over the raw table, keeping only matching rows. Kinds
+    # not fixed by local_tables are inferred from every row, kept or not, so a
+    # slice has the column kinds of the full table.
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        patient_position = header.index("patient_id")
+        code_positions = [header.index(column) for column in code_columns or () if column in header]
+        kinds = column_kinds(name, header)
+        inferences = [
+            (i, KindInference()) for i, column_name in enumerate(header) if kinds.get(column_name, "") is None
+        ]
+        raw = [[] for _ in header]
+        rows_read = 0
+        for row in reader:
+            rows_read += 1
+            for i, inference in inferences:
+                inference.update(row[i])
+            if int(row[patient_position]) not in patients:
+                continue
+            if code_positions and not any(row[i] in codes for i in code_positions):
+                continue
+            for values, value in zip(raw, row):
+                values.append(value)
+    kinds.update({header[i]: inference.kind for i, inference in inferences})
+    return header, raw, rows_read, kinds
+
+
+def build_columns(header, raw, kinds):
+    columns = {name: to_column(values, name, kinds.get(name)) for name, values in zip(header, raw)}
+    order = np.argsort(columns["patient_id"], kind="stable")
+    return {name: column.take(order) for name, column in columns.items()}
+
+
+def slice_path(staging_dir, name):
+    return os.path.join(staging_dir, f"{name}.slice.npz")
+
+
+def save_slice(path, columns, kinds):
+    # Typed columns are stored as they are; text (and packed tri-state) columns
+    # are stored as strings and re-typed on load with their recorded kind
+    arrays, text = {}, []
+    for name, column in columns.items():
+        if isinstance(column, np.ndarray) and column.dtype.kind in "iMf":
+            arrays[name] = column
+        else:
+            values = column if isinstance(column, np.ndarray) else column.decode()
+            arrays[name] = np.array(["" if value is None else value for value in values], dtype=str)
+            text.append(name)
+    arrays["__text_columns__"] = np.array(text, dtype=str)
+    arrays["__kinds__"] = np.array([f"{name}={kind}" for name, kind in kinds.items()], dtype=str)
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def load_slice(name, staging_dir="output/staging", columns=None, patient_ids=None, sample=None):
+    # npz members are read one at a time, so unreferenced columns are never
+    # loaded; patient_ids and sample (fraction, seed) restrict rows before any
+    # column is re-typed
+    with np.load(slice_path(staging_dir, name)) as data:
+        text = set(data["__text_columns__"].tolist())
+        kinds = dict(entry.split("=", 1) for entry in data["__kinds__"].tolist())
+        keep = np.ones(len(data["patient_id"]), dtype=bool)
+        if patient_ids is not None:
+            keep &= np.isin(data["patient_id"], np.asarray(list(patient_ids), dtype=np.int64))
+        if sample is not None:
+            keep &= sample_mask(data["patient_id"], *sample)
+        rows = slice(None) if keep.all() else np.flatnonzero(keep)
+        wanted = [
+            column_name
+            for column_name in data.files
+            if column_name not in ("__text_columns__", "__kinds__")
+            and (columns is None or column_name in columns or column_name == "patient_id")
+        ]
+        loaded = {}
+        for column_name in wanted:
+            values = data[column_name][rows]
+            if column_name in text:
+                values = to_column(values.tolist(), column_name, kinds[column_name])
+            loaded[column_name] = values
+    return LocalTable(name, loaded)
+
+
+def stage_tables(source_dir="dummy-tables", staging_dir="output/staging", version=None, force=False):
+    # Returns the manifest; tables whose codelist hash and source version match
+    # the existing manifest are left alone
+    os.makedirs(staging_dir, exist_ok=True)
+    manifest_path = os.path.join(staging_dir, "manifest.json")
+    manifest = read_manifest(staging_dir)
+
+    codes = codelist_union()
+    union_hash = codes_hash(codes)
+    patients = None
+    populations = population_versions(source_dir, version)
+
+    for name, code_columns in STAGED_TABLES.items():
+        path = os.path.join(source_dir, f"{name}.csv")
+        if not os.path.exists(path):
+            continue
+        current = slice_key(path, union_hash, populations, version)
+        previous = manifest.get(name, {})
+        if not force and os.path.exists(slice_path(staging_dir, name)) and all(
+            previous.get(key) == value for key, value in current.items()
+        ):
+            continue
+
+        if patients is None:
+            patients = population_patients(source_dir)
+        header, raw, rows_read, kinds = read_slice(path, name, patients, code_columns, codes)
+        save_slice(slice_path(staging_dir, name), build_columns(header, raw, kinds), kinds)
+        manifest[name] = {**current, "rows_read": rows_read, "rows_staged": len(raw[0])}
+
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+
+
+
+# MAIN ------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--source-dir", default="dummy-tables")
+    parser.add_argument("--staging-dir", default="output/staging")
+    parser.add_argument("--source-version", help="data refresh identifier (default: file size and mtime)")
+    parser.add_argument("--force", action="store_true", help="rebuild every slice")
+    args = parser.parse_args()
+
+    manifest = stage_tables(args.source_dir, args.staging_dir, args.source_version, args.force)
+    for name, entry in sorted(manifest.items()):
+        print(f"{name}: {entry['rows_staged']} of {entry['rows_read']} rows")
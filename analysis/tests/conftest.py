@@ -0,0 +1,6 @@
+# The analysis scripts import each other by module name, as they do when run
+# from analysis/
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
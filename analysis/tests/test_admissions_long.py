@@ -0,0 +1,25 @@
+import numpy as np
+
+from admissions_long import rank_admissions
+from local_tables import LocalTable
+
+
+def test_same_day_episodes_share_a_rank():
+    # As get_sequential_admissions_date, which only moves on to a later date
+    table = LocalTable("hospital_admissions", {
+        "patient_id": np.array([1, 1, 1, 2, 2, 1]),
+        "admission_date": np.array(
+            ["2020-01-05", "2020-01-01", "2020-01-05", "2020-02-01", "2020-02-01", "2020-03-01"],
+            dtype="datetime64[D]",
+        ),
+        "discharge_date": np.array(
+            ["2020-01-09", "2020-01-02", "2020-01-06", "2020-02-03", "2020-02-02", "2020-03-04"],
+            dtype="datetime64[D]",
+        ),
+    })
+    table, rank = rank_admissions(table, "admission_date")
+    np.testing.assert_array_equal(table.patient_id, [1, 1, 1, 1, 2, 2])
+    np.testing.assert_array_equal(rank, [1, 2, 2, 3, 1, 1])
+    np.testing.assert_array_equal(
+        table["discharge_date"][1:3], np.array(["2020-01-06", "2020-01-09"], dtype="datetime64[D]")
+    )
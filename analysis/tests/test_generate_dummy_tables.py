@@ -0,0 +1,50 @@
+import csv
+import os
+import subprocess
+import sys
+
+import pytest
+
+from generate_dummy_tables import ISARIC_DEFINITION, generate, isaric_columns
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def read_rows(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+@pytest.fixture(scope="module")
+def tables_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp("tables")
+    generate(str(path), 500, seed=1)
+    return path
+
+
+def test_isaric_columns_are_those_the_definition_reads(tables_dir):
+    columns, checkboxes = isaric_columns(ISARIC_DEFINITION)
+    assert "hostdat" in columns and "chrincard" in columns and "smoking_mhyn" in columns
+    assert checkboxes == [f"ethnic___{n}" for n in range(1, 11)]
+    header = read_rows(tables_dir / "isaric_raw.csv")[0].keys()
+    assert set(columns + checkboxes) <= set(header)
+
+
+def test_isaric_admission_lines_up_with_sus(tables_dir):
+    sus = {(row["patient_id"], row["admission_date"]) for row in read_rows(tables_dir / "hospital_admissions.csv")}
+    isaric = read_rows(tables_dir / "isaric_raw.csv")
+    assert isaric and all((row["patient_id"], row["hostdat"]) in sus for row in isaric)
+
+
+def test_isaric_definition_runs_on_generated_tables(tables_dir, tmp_path):
+    pytest.importorskip("ehrql")
+    output = tmp_path / "isaric.csv"
+    subprocess.run(
+        [
+            sys.executable, "-m", "ehrql", "generate-dataset", ISARIC_DEFINITION,
+            "--dummy-tables", str(tables_dir), "--output", str(output),
+        ],
+        cwd=REPO_DIR, check=True,
+    )
+    rows = read_rows(output)
+    assert rows and all(row["first_admission_date_isaric"] and row["age_pc"] for row in rows)
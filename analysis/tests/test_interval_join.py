@@ -0,0 +1,27 @@
+from interval_join import containing_interval, first_point_in_interval
+
+
+def test_missing_discharge_contains_nothing():
+    # As in the ehrQL death_during_admission, an admission with a missing or
+    # far-future discharge date contains no death, not even one on the
+    # admission date
+    interval_patient_id = [1, 2, 3, 4]
+    starts = ["2020-04-01", "2020-04-01", "2020-04-01", "2020-04-01"]
+    ends = ["2020-04-10", "NaT", "9999-12-31", "2020-03-01"]
+    point_patient_id = [1, 2, 3, 4]
+    point_dates = ["2020-04-05", "2020-04-01", "2020-04-05", "2020-04-01"]
+
+    found = containing_interval(point_patient_id, point_dates, interval_patient_id, starts, ends)
+    assert found.tolist() == [0, -1, -1, -1]
+    found = first_point_in_interval(interval_patient_id, starts, ends, point_patient_id, point_dates)
+    assert found.tolist() == [0, -1, -1, -1]
+
+
+def test_missing_discharge_does_not_hide_other_admissions():
+    interval_patient_id = [1, 1]
+    starts = ["2020-04-01", "2020-04-03"]
+    ends = ["NaT", "2020-04-08"]
+    found = containing_interval([1, 1], ["2020-04-02", "2020-04-05"], interval_patient_id, starts, ends)
+    assert found.tolist() == [-1, 1]
+    found = first_point_in_interval(interval_patient_id, starts, ends, [1, 1], ["2020-04-02", "2020-04-05"])
+    assert found.tolist() == [-1, 1]
@@ -0,0 +1,36 @@
+import numpy as np
+
+from local_tables import LocalTable
+from registration_spells import OPEN_DAY, RegistrationSpells, to_days
+
+
+def registrations(rows):
+    patient_id, start_date, end_date = zip(*rows)
+    return LocalTable("practice_registrations", {
+        "patient_id": np.array(patient_id, dtype=np.int64),
+        "start_date": np.array(start_date, dtype="datetime64[D]"),
+        "end_date": np.array([end or "NaT" for end in end_date], dtype="datetime64[D]"),
+    })
+
+
+def test_pre_1970_end_next_to_open_end():
+    # An end date before 1970 alongside an open (9999-12-31) end used to
+    # overflow the running maximum and split patient 2's registration
+    spells = RegistrationSpells(registrations([
+        (1, "1960-01-01", "1968-01-01"),
+        (2, "2000-01-01", "9999-12-31"),
+        (2, "2010-01-01", "2012-01-01"),
+        (2, "2020-01-01", "2021-01-01"),
+    ]))
+    assert spells.patient_id.tolist() == [1, 2]
+    assert spells.end.tolist() == [to_days(["1968-01-01"])[0], OPEN_DAY]
+    status = spells.at([2], ["2015-06-01"])
+    assert status["registered"].tolist() == [True]
+
+
+def test_running_max_restarts_at_each_patient():
+    values = to_days(["1950-01-01", "1940-01-01", "2020-01-01", "2010-01-01", "NaT"])
+    values[2] = OPEN_DAY
+    new_group = np.array([True, False, True, False, True])
+    result = RegistrationSpells.running_max_by_patient(values, new_group)
+    assert result.tolist() == [values[0], values[0], OPEN_DAY, OPEN_DAY, values[4]]
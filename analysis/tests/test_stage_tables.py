@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+import pytest
+
+from generate_dummy_tables import generate
+from local_engine import ScanPlan
+from stage_tables import current_slice, stage_tables
+
+COLUMNS = ["admission_date", "discharge_date", "admission_method"]
+
+
+@pytest.fixture(scope="module")
+def staged(tmp_path_factory):
+    tables_dir = tmp_path_factory.mktemp("tables")
+    staging_dir = tmp_path_factory.mktemp("staging")
+    generate(str(tables_dir), 300, seed=2)
+    stage_tables(str(tables_dir), str(staging_dir))
+    return tables_dir, staging_dir
+
+
+def scan(tables_dir, staging_dir=None):
+    plan = ScanPlan(staging_dir=staging_dir).require("hospital_admissions", *COLUMNS)
+    return plan.scan("hospital_admissions", str(tables_dir / "hospital_admissions.csv"))
+
+
+def test_scan_reads_current_slice_with_same_result(staged):
+    tables_dir, staging_dir = staged
+    assert current_slice("hospital_admissions", str(tables_dir / "hospital_admissions.csv"), str(staging_dir))
+    from_csv, from_slice = scan(tables_dir), scan(tables_dir, str(staging_dir))
+    for column_name in ["patient_id"] + COLUMNS:
+        np.testing.assert_array_equal(from_slice[column_name], from_csv[column_name])
+
+
+def test_changed_source_makes_slice_stale(staged):
+    tables_dir, staging_dir = staged
+    path = tables_dir / "emergency_care_attendances.csv"
+    assert current_slice("emergency_care_attendances", str(path), str(staging_dir))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    # a population table changed, so every slice is stale
+    assert not current_slice("hospital_admissions", str(tables_dir / "hospital_admissions.csv"), str(staging_dir))
+    assert not current_slice("isaric", str(tables_dir / "isaric_raw.csv"), str(staging_dir))
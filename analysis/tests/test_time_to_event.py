@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from time_to_event import CENSORED, COMPETING_EVENT, EVENT, INELIGIBLE, follow_up_table, time_to_event
+
+
+def test_origin_after_end_of_follow_up_is_ineligible():
+    time, status = time_to_event(["2022-06-01"], [""], "2022-03-31")
+    assert np.isnan(time[0]) and status[0] == INELIGIBLE
+
+
+def test_missing_origin_is_ineligible():
+    time, status = time_to_event([""], ["2022-01-10"], "2022-03-31")
+    assert np.isnan(time[0]) and status[0] == INELIGIBLE
+
+
+def test_censored_at_earliest_censoring_date_or_end_of_follow_up():
+    time, status = time_to_event(
+        ["2022-01-01", "2022-01-01", "2022-01-01"],
+        ["", "2022-02-10", "2021-12-01"],
+        ["2022-03-31", "2022-03-31", "2022-01-31"],
+        censor=[["2022-02-01", "", ""]],
+    )
+    np.testing.assert_array_equal(time, [31, 40, 30])
+    np.testing.assert_array_equal(status, [CENSORED, EVENT, CENSORED])
+
+
+def test_outcome_wins_ties_with_competing_event():
+    table = follow_up_table(
+        ["2022-01-01", "2022-01-01"],
+        {"readmission": ["2022-01-10", "2022-01-20"], "death": ["2022-01-10", "2022-01-15"]},
+        "2022-03-31",
+        competing={"readmission": ["death"]},
+    )
+    np.testing.assert_array_equal(table["readmission_time"], [9, 14])
+    np.testing.assert_array_equal(table["readmission_status"], [EVENT, COMPETING_EVENT])
+
+
+def test_end_of_follow_up_is_required_for_every_patient():
+    with pytest.raises(ValueError):
+        time_to_event(["2022-01-01", "2022-01-01"], ["", ""], ["2022-03-31", ""])
@@ -0,0 +1,196 @@
+################################################################################
+#
+# Description: This script contains functions for computing time-to-event and
+#              event indicators for many outcomes at once (a vectorised
+#              counterpart to tte() in analysis/lib/custom_functions.R):
+#             - Dates are held as integer day arrays (days since 1970-01-01)
+#               with MISSING_DAY for missing dates
+#             - Follow-up ends at the earliest of the outcome, any competing
+#               events, any censoring dates and the end of follow-up, which is
+#               required (one date, or one per patient), so every censored
+#               patient has an explicit censoring date
+#             - Status is 1 for the outcome, 2 for a competing event and 0 for
+#               censoring; the outcome wins ties with competing events and
+#               censoring on the same day
+#             - Patients with no origin date, or an origin after their end of
+#               follow-up, are ineligible: status -1 and a missing (NaN) time
+#
+# Input: output/admissions/*.csv.gz
+#
+# Output: follow-up table with <outcome>_time and <outcome>_status columns
+#
+# Date last updated: 19/10/2026
+#
+################################################################################
+
+
+
+# IMPORT STATEMENTS ------------------------
+import csv
+import os
+from argparse import ArgumentParser
+
+import numpy as np
+
+from output_io import open_output, write_csv
+
+
+
+
+
+# DATES AS DAY ARRAYS ------------------------
+
+# Same bit pattern as NaT when datetime64[D] is viewed as int64
+MISSING_DAY = np.iinfo(np.int64).min
+
+INELIGIBLE, CENSORED, EVENT, COMPETING_EVENT = -1, 0, 1, 2
+
+
+def to_days(dates):
+    # Accepts ISO date strings (with "" or "NA" for missing), datetime64 arrays
+    # or integer day arrays
+    dates = np.asarray(dates)
+    if dates.dtype.kind in "iu":
+        return dates.astype(np.int64)
+    if dates.dtype.kind != "M":
+        dates = np.where(np.isin(dates, ["", "NA"]), "NaT", dates).astype("datetime64[D]")
+    return dates.astype("datetime64[D]").view(np.int64)
+
+
+def from_days(days):
+    return np.asarray(days, dtype=np.int64).view("datetime64[D]")
+
+
+def earliest(*date_arrays):
+    # Element-wise earliest date, ignoring missing dates
+    stacked = np.stack([np.asarray(dates, dtype=np.int64) for dates in date_arrays])
+    stacked = np.where(stacked == MISSING_DAY, np.iinfo(np.int64).max, stacked)
+    result = stacked.min(axis=0)
+    return np.where(result == np.iinfo(np.int64).max, MISSING_DAY, result)
+
+
+
+
+
+# TIME TO EVENT ------------------------
+
+def time_to_event(origin, event, end_date, censor=(), competing=()):
+    # Returns (time in days, status) for one outcome. end_date is the end of
+    # follow-up, one date or one per patient. Events, competing events and
+    # censoring dates before the origin are ignored. Ineligible patients get
+    # a NaN time, so times are floats.
+    origin = to_days(origin)
+    end_date = np.broadcast_to(to_days(np.atleast_1d(end_date)), origin.shape)
+    if np.any(end_date == MISSING_DAY):
+        raise ValueError("Every patient needs an end of follow-up date")
+    eligible = (origin != MISSING_DAY) & (origin <= end_date)
+
+    def on_or_after_origin(dates):
+        dates = to_days(dates)
+        return np.where((dates != MISSING_DAY) & (dates >= origin), dates, MISSING_DAY)
+
+    event = on_or_after_origin(event)
+    censor_date = earliest(end_date, *[on_or_after_origin(dates) for dates in censor])
+    competing_date = (
+        earliest(*[on_or_after_origin(dates) for dates in competing])
+        if competing else np.full(len(origin), MISSING_DAY)
+    )
+
+    # An outcome only counts if it is on or before every censoring date
+    event_observed = (event != MISSING_DAY) & (event <= censor_date) & (
+        (competing_date == MISSING_DAY) | (event <= competing_date)
+    )
+    competing_observed = ~event_observed & (competing_date != MISSING_DAY) & (competing_date <= censor_date)
+
+    stop = earliest(event, competing_date, censor_date)
+    time = np.where(eligible, stop - origin, np.nan)
+    status = np.select(
+        [~eligible, event_observed, competing_observed],
+        [INELIGIBLE, EVENT, COMPETING_EVENT],
+        default=CENSORED,
+    )
+    return time, status
+
+
+def follow_up_table(origin, outcomes, end_date, censor=(), competing=None):
+    # outcomes maps outcome names to event date arrays; competing maps an outcome
+    # name to the names of the outcomes that compete with it (e.g. death for
+    # readmission). Returns a dict of <name>_time and <name>_status arrays.
+    competing = competing or {}
+    table = {}
+    for name, event in outcomes.items():
+        time, status = time_to_event(
+            origin, event, end_date, censor=censor,
+            competing=[outcomes[other] for other in competing.get(name, ())],
+        )
+        table[f"{name}_time"] = time
+        table[f"{name}_status"] = status
+    return table
+
+
+def csv_value(value):
+    # Missing (NaN) times are written as empty cells, whole days as integers
+    if isinstance(value, float):
+        return "" if np.isnan(value) else int(value)
+    return value
+
+
+def read_date_columns(path, columns):
+    opener = open_output if path.endswith(".gz") else open
+    with opener(path, "rt") as f:
+        reader = csv.DictReader(f)
+        values = {column: [] for column in ["patient_id"] + columns}
+        for row in reader:
+            for column in values:
+                values[column].append(row.get(column, ""))
+    patient_id = np.array(values.pop("patient_id"), dtype=np.int64)
+    return patient_id, {column: to_days(dates) for column, dates in values.items()}
+
+
+
+
+
+# MAIN ------------------------
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--origin", required=True, help="date column follow-up starts from")
+    parser.add_argument("--outcomes", nargs="+", required=True, help="name=date_column pairs")
+    parser.add_argument("--censor", nargs="*", default=[], help="censoring date columns")
+    parser.add_argument("--competing", nargs="*", default=[], help="outcome=competing_outcome pairs")
+    parser.add_argument("--end-date", required=True, help="administrative end of follow-up (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    outcome_columns = dict(pair.split("=", 1) for pair in args.outcomes)
+    competing = {}
+    for pair in args.competing:
+        outcome, other = pair.split("=", 1)
+        competing.setdefault(outcome, []).append(other)
+
+    patient_id, dates = read_date_columns(
+        args.input, [args.origin] + list(outcome_columns.values()) + args.censor
+    )
+    table = follow_up_table(
+        dates[args.origin],
+        {name: dates[column] for name, column in outcome_columns.items()},
+        args.end_date,
+        censor=[dates[column] for column in args.censor],
+        competing=competing,
+    )
+
+    fieldnames = ["patient_id"] + list(table)
+    columns = [patient_id] + list(table.values())
+    rows = (
+        {name: csv_value(value) for name, value in zip(fieldnames, row)}
+        for row in zip(*(column.tolist() for column in columns))
+    )
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    if args.output.endswith(".gz"):
+        write_csv(args.output, fieldnames, rows)
+    else:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
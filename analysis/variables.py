@@ -3,18 +3,22 @@
 # Description: This script contains custom functions for:
 #             - 
 #             - Extracting comorbidities from primary care data based on codelist
+#               (at one index date, or as of several index dates in one pass)
 #             - Extracting emergency care data based on codelist
 #             - Extracting patients with COVID-19 admissions depending on method specified
-#             - Matching hospital admission dignosis with codelist
+#             - Matching hospital admission dignosis with codelist (pre-validated
+#               code sets from compile_codelists.py skip per-code validation)
 #             - Creating n sequential admission date variables
 #             - Extracting practice deregistration date
-#             - 
-#             - 
-#             - 
+#             - Summarising numeric measures (e.g. BMI) in windows before an index date
+#             - Flagging events within several windows around an index date
+#             - Packing multi-select (checkbox) fields into one integer bitmask
+#             - Adding the SUS variables that depend on the admissions (shared by
+#               the single-variant and sweep SUS definitions)
 #             - 
 #
 # Author(s): M Green, W Hulme, S Maude
-# Date last updated: 04/08/2023
+# Date last updated: 19/10/2026
 #
 ################################################################################
 
@@ -33,13 +37,15 @@ from ehrql.tables.beta.tpp import (
   sgss_covid_all_tests, 
   vaccinations,
   addresses, 
-  clinical_events
+  clinical_events,
+  ons_deaths
   )
 import operator
 from functools import reduce
 
 # Import codelists
 import codelists_ehrql
+from compile_codelists import ValidatedCodes
 
 
 
@@ -70,6 +76,34 @@ def has_prior_comorbidity(
 
 
 
+# Extract comorbidity as of several index dates ------------------------
+
+# clinical_events code column for each coding system
+CODE_COLUMNS = {"snomed": "snomedct_code", "ctv3": "ctv3_code"}
+
+def has_prior_comorbidity_as_of(
+  extract_name_template, codelist_name, system, column_names, dataset):
+    # Equivalent to calling has_prior_comorbidity once per index date column, but
+    # the codelist is matched once: a patient has a prior comorbidity at an index
+    # date exactly when their first qualifying event is before that date
+    if system not in CODE_COLUMNS:
+      raise ValueError(f"Unknown coding system: {system}")
+    
+    codelist_attribute = getattr(codelists_ehrql, codelist_name)
+    first_event_date = (
+        clinical_events.where(getattr(clinical_events, CODE_COLUMNS[system]).is_in(codelist_attribute))
+        .date.minimum_for_patient()
+    )
+    
+    for column_name in column_names:
+      characteristic = case(
+        when(first_event_date.is_on_or_before(getattr(dataset, column_name) - days(1))).then(True),
+        default=False,
+      )
+      setattr(dataset, extract_name_template.format(column=column_name), characteristic)
+
+
+
 # Extract emergency care data based on codelist ------------------------
 def emergency_care_diagnosis_matches(emergency_care_attendances, codelist):
   conditions = [
@@ -82,12 +116,16 @@ def emergency_care_diagnosis_matches(emergency_care_attendances, codelist):
 
 # Match hospital admission dignosis with codelists ------------------------
 def hospitalisation_diagnosis_matches(admissions, codelist):
-    code_strings = set()
-    for code in codelist:
-        # Pass the string through the ICD10Code to constructor to validate that it has
-        # the expected format
-        code_string = ICD10Code(code)._to_primitive_type()
-        code_strings.add(code_string)
+    if isinstance(codelist, ValidatedCodes):
+        # Already validated and normalised in bulk by compile_codelists.py
+        code_strings = codelist
+    else:
+        code_strings = set()
+        for code in codelist:
+            # Pass the string through the ICD10Code to constructor to validate that it has
+            # the expected format
+            code_string = ICD10Code(code)._to_primitive_type()
+            code_strings.add(code_string)
     conditions = [
         # The reason a plain substring search like this works is twofold:
         #
@@ -112,24 +150,29 @@ def hospitalisation_diagnosis_matches(admissions, codelist):
 
 
 # Extract patients with COVID-19 admissions depending on method specified ------------------------
-def admissions_data(admission_method, hospital_admissions, emergency_care_attendances):
+
+# Admission methods counted as unplanned (emergency) admissions for method A
+EMERGENCY_ADMISSION_METHODS = ["21", "22", "23", "24", "25", "2A", "2B", "2C", "2D", "28"]
+
+def admissions_data(
+    admission_method, hospital_admissions, emergency_care_attendances, start_date=None, end_date=None):
+    # start_date/end_date optionally restrict admissions to a study window
+    # (inclusive), e.g. for sensitivity sweeps over windows
     
     # Unplanned admissions with a ICD10 COVID code as a diagnosis
     if admission_method == "A":
       admissions_data_sus = (
-          hospitalisation_diagnosis_matches(hospital_admissions, codelists_ehrql.covid_icd10)
-          .where(hospital_admissions.admission_method.is_in(["21", "22", "23", "24", "25", "2A", "2B", "2C", "2D", "28"]))
-          #.where(hospital_admissions.admission_date.is_on_or_after(start_date))
-          .sort_by(hospital_admissions.admission_date)
+          hospitalisation_diagnosis_matches(hospital_admissions, codelists_ehrql.validated["covid_icd10"])
+          .where(hospital_admissions.admission_method.is_in(EMERGENCY_ADMISSION_METHODS))
       )
+      date_column = hospital_admissions.admission_date
     
     ## Any hospital admission with a ICD10 COVID code as a diagnosis
     if admission_method == "B":
       admissions_data_sus = (
-          hospitalisation_diagnosis_matches(hospital_admissions, codelists_ehrql.covid_icd10)
-          #.where(hospital_admissions.admission_date.is_on_or_after(start_date))
-          .sort_by(hospital_admissions.admission_date)
+          hospitalisation_diagnosis_matches(hospital_admissions, codelists_ehrql.validated["covid_icd10"])
       )
+      date_column = hospital_admissions.admission_date
     
     ## A&E attendance resulting in admission to hospital, with a COVID code 
     ## (from the A&E SNOMED discharge diagnosis refset) as the A&E discharge diagnosis
@@ -138,12 +181,16 @@ def admissions_data(admission_method, hospital_admissions, emergency_care_attend
     if admission_method == "C":
       admissions_data_sus = (
           emergency_care_diagnosis_matches(emergency_care_attendances, codelists_ehrql.covid_emergency)
-          #.where(emergency_care_attendances.arrival_date.is_on_or_after(start_date))
           .where(emergency_care_attendances.discharge_destination.is_in(codelists_ehrql.discharged_to_hospital))
-          .sort_by(emergency_care_attendances.arrival_date)
       )
+      date_column = emergency_care_attendances.arrival_date
+    
+    if start_date is not None:
+      admissions_data_sus = admissions_data_sus.where(date_column.is_on_or_after(start_date))
+    if end_date is not None:
+      admissions_data_sus = admissions_data_sus.where(date_column.is_on_or_before(end_date))
       
-    return admissions_data_sus
+    return admissions_data_sus.sort_by(date_column)
 
 
 
@@ -183,3 +230,215 @@ def date_deregistered_from_all_supported_practices(practice_registrations, case,
     )
 
 
+
+# Summarise numeric measures in windows before an index date ------------------------
+
+# Each statistic is derived from one shared filtered frame per codelist/window
+# so adding statistics does not add scans of clinical_events
+NUMERIC_MEASURE_STATISTICS = {
+    "max": lambda events: events.numeric_value.maximum_for_patient(),
+    "min": lambda events: events.numeric_value.minimum_for_patient(),
+    "mean": lambda events: events.numeric_value.mean_for_patient(),
+    "count": lambda events: events.count_for_patient(),
+    "last": lambda events: events.sort_by(events.date).last_for_patient().numeric_value,
+}
+
+def numeric_measure_in_window(
+    dataset, variable_name_template, codelist_names, system, column_name, windows,
+    statistics=("max",), value_range=(None, None), min_age=None):
+    
+    unknown = set(statistics) - set(NUMERIC_MEASURE_STATISTICS)
+    if unknown:
+      raise ValueError(f"Unknown statistic(s): {', '.join(sorted(unknown))}")
+    
+    if system not in CODE_COLUMNS:
+      raise ValueError(f"Unknown coding system: {system}")
+    code_column = CODE_COLUMNS[system]
+    
+    index_date = getattr(dataset, column_name)
+    lower, upper = value_range
+    
+    # Filters shared by every codelist and window: values in range and, optionally,
+    # measurements taken once the patient had reached the minimum age
+    measures = clinical_events
+    if lower is not None:
+      measures = measures.where(measures.numeric_value > lower)
+    if upper is not None:
+      measures = measures.where(measures.numeric_value < upper)
+    if min_age is not None:
+      measures = measures.where(measures.date >= patients.date_of_birth + years(min_age))
+    
+    for codelist_name in codelist_names:
+      codelist_attribute = getattr(codelists_ehrql, codelist_name)
+      coded = measures.where(getattr(measures, code_column).is_in(codelist_attribute))
+      
+      for window in windows:
+        # Window is given in years before (and including) the index date
+        in_window = coded.where(coded.date.is_on_or_between(index_date - years(window), index_date))
+        
+        for statistic in statistics:
+          variable_name = variable_name_template.format(
+            codelist=codelist_name, window=window, statistic=statistic)
+          if hasattr(dataset, variable_name):
+            raise ValueError(f"Variable {variable_name} is already defined; "
+                             "include {codelist}, {window} or {statistic} in the template")
+          setattr(dataset, variable_name, NUMERIC_MEASURE_STATISTICS[statistic](in_window))
+
+
+
+# Flag events within several windows around an index date ------------------------
+
+# Event tables supported by events_within_windows, with the date each event is indexed on
+EVENT_DATE_COLUMNS = {
+    "hospital_admissions": (hospital_admissions, "admission_date"),
+    "emergency_care_attendances": (emergency_care_attendances, "arrival_date"),
+    "sgss_covid_all_tests": (sgss_covid_all_tests, "specimen_taken_date"),
+    "ons_deaths": (ons_deaths, "date"),
+}
+
+def events_within_windows(dataset, table_name, column_name, windows, events=None):
+    # windows maps variable names to (days_before, days_after) around the index date.
+    # The nearest event on or before and on or after the index date are found once,
+    # after which each window is just two comparisons: an event lies in
+    # [index - before, index + after] if and only if one of these nearest events does.
+    table, date_column = EVENT_DATE_COLUMNS[table_name]
+    events = table if events is None else events
+    
+    index_date = getattr(dataset, column_name)
+    event_date = getattr(events, date_column)
+    
+    nearest_before_date = getattr(
+      events.where(event_date.is_on_or_before(index_date)), date_column).maximum_for_patient()
+    nearest_after_date = getattr(
+      events.where(event_date.is_on_or_after(index_date)), date_column).minimum_for_patient()
+    
+    for variable_name, (days_before, days_after) in windows.items():
+      if days_before < 0 or days_after < 0:
+        raise ValueError(f"Window for {variable_name} must contain the index date")
+      setattr(dataset, variable_name, case(
+        when(nearest_before_date.is_on_or_after(index_date - days(days_before))).then(True),
+        when(nearest_after_date.is_on_or_before(index_date + days(days_after))).then(True),
+        default=False,
+      ))
+
+
+
+# Pack multi-select (checkbox) fields into one integer bitmask ------------------------
+
+def multi_select_bitmask(frame, column_template, n_options, checked="Checked"):
+    # Option n (numbered from 1) sets bit n-1 if it is checked, so e.g. ethnic___1
+    # and ethnic___3 both checked gives 5. Unchecked and missing options add 0.
+    return reduce(operator.add, [
+      case(when(getattr(frame, column_template.format(n=n)) == checked).then(2 ** (n - 1)), default=0)
+      for n in range(1, n_options + 1)
+    ])
+
+
+
+# Add the SUS variables that depend on the admissions ------------------------
+
+def add_sus_admission_variables(dataset, admissions_data_sus, admission_method, suffix=""):
+    # The variables of dataset_definition_sus.py that depend on the admissions,
+    # and so on the admission method and study window: first and subsequent
+    # admission dates and everything recorded as of the first admission other
+    # than comorbidities (added per index date column by the definitions). With
+    # a suffix each variable is named <variable>_<suffix>, so that the sweep
+    # (dataset_definition_sus_sweep.py) adds one set per variant from the same
+    # code. dataset.ons_death_date must already be defined.
+    def name(variable_name):
+      return f"{variable_name}_{suffix}" if suffix else variable_name
+    
+    # First COVID-19 admission date
+    index_column = name("first_admission_date_sus")
+    if admission_method == "C":
+      setattr(dataset, index_column, admissions_data_sus.first_for_patient().arrival_date)
+    else:
+      setattr(dataset, index_column, admissions_data_sus.first_for_patient().admission_date)
+    index_date = getattr(dataset, index_column)
+    
+    # Subsequent COVID-19 admission dates
+    get_sequential_admissions_date(dataset, name("admission{n}_date_sus"), admissions_data_sus, 5, admission_method)
+    
+    # Registration details
+    setattr(dataset, name("prior_dereg_date_sus"), practice_registrations.where(
+      practice_registrations.end_date.is_before(index_date)).end_date.maximum_for_patient())
+    setattr(dataset, name("registered_sus"), practice_registrations.for_patient_on(index_date).exists_for_patient())
+    
+    # Age
+    setattr(dataset, name("age_sus"), patients.age_on(index_date))
+    
+    # Ethnicity
+    ethnicity6 = clinical_events.where(clinical_events.snomedct_code.is_in(codelists_ehrql.ethnicity_codelist)
+      ).where(
+        clinical_events.date.is_on_or_before(index_date)
+      ).sort_by(
+        clinical_events.date
+      ).last_for_patient().snomedct_code.to_category(codelists_ehrql.ethnicity_codelist)
+    setattr(dataset, name("ethnicity_sus"), case(
+      when(ethnicity6 == "1").then("White"),
+      when(ethnicity6 == "2").then("Mixed"),
+      when(ethnicity6 == "3").then("South Asian"),
+      when(ethnicity6 == "4").then("Black"),
+      when(ethnicity6 == "5").then("Other"),
+      when(ethnicity6 == "6").then("Not stated"),
+      default = "Unknown"
+    ))
+    
+    # IMD
+    imd = addresses.for_patient_on(index_date).imd_rounded
+    setattr(dataset, name("imd_sus"), case(
+      when((imd >=0) & (imd < int(32844 * 1 / 5))).then("1 (most deprived)"),
+      when(imd < int(32844 * 2 / 5)).then("2"),
+      when(imd < int(32844 * 3 / 5)).then("3"),
+      when(imd < int(32844 * 4 / 5)).then("4"),
+      when(imd < int(32844 * 5 / 5)).then("5 (least deprived)"),
+      default="unknown"
+    ))
+    
+    # Region
+    setattr(dataset, name("region_sus"), practice_registrations.for_patient_on(index_date).practice_nuts1_region_name)
+    
+    # COVID-19 infection
+    setattr(dataset, name("suspected_covid_date_sus"), clinical_events.where(
+      clinical_events.ctv3_code.is_in(codelists_ehrql.primary_care_suspected_covid_combined)
+      ).where(
+        clinical_events.date.is_on_or_before(index_date)
+      ).sort_by(
+        clinical_events.date
+      ).last_for_patient().date)
+    setattr(dataset, name("probable_covid_date_sus"), clinical_events.where(
+      clinical_events.ctv3_code.is_in(codelists_ehrql.covid_primary_care_probable_combined)
+      ).where(
+        clinical_events.date.is_on_or_before(index_date)
+      ).sort_by(
+        clinical_events.date
+      ).last_for_patient().date)
+    setattr(dataset, name("last_positive_test_date_sus"), sgss_covid_all_tests.where(sgss_covid_all_tests.is_positive
+      ).where(
+        sgss_covid_all_tests.specimen_taken_date.is_on_or_before(index_date)
+      ).sort_by(
+        sgss_covid_all_tests.specimen_taken_date
+      ).last_for_patient().specimen_taken_date)
+    
+    # COVID-19 Vaccination
+    setattr(dataset, name("covid19_vaccine_sus"),
+            vaccinations.where(vaccinations.date.is_on_or_before(index_date)).exists_for_patient())
+    
+    # Number of admissions and in-hospital severity (critical care stay)
+    if admission_method == "A" or admission_method == "B":
+      setattr(dataset, name("n_admissions"), admissions_data_sus.count_for_patient())
+      setattr(dataset, name("days_in_critical_care"), admissions_data_sus.first_for_patient().days_in_critical_care)
+    
+    # Death after admission
+    setattr(dataset, name("has_died"), ons_deaths.where(ons_deaths.date >= index_date).exists_for_patient())
+    
+    # Discharge, and death inside any admission's admission-discharge interval, not just the
+    # first (interval_join.py gives the containing admission per row locally). Admissions with
+    # a missing or far-future discharge date have no known end and are left out, in both.
+    if admission_method == "A" or admission_method == "B":
+      setattr(dataset, name("discharge_date"), admissions_data_sus.first_for_patient().discharge_date)
+      setattr(dataset, name("death_during_admission"), admissions_data_sus.where(
+        admissions_data_sus.admission_date.is_on_or_before(dataset.ons_death_date)
+        & admissions_data_sus.discharge_date.is_on_or_after(dataset.ons_death_date)
+        & admissions_data_sus.discharge_date.is_before("3000-01-01")
+      ).exists_for_patient())